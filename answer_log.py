@@ -0,0 +1,274 @@
+import atexit
+import os
+import struct
+import threading
+import time
+
+# File layout: MAGIC, then records. A string record ('S', id, length, utf-8 bytes)
+# names a user / deck / item the first time it is used; an answer record
+# ('A', timestamp, user id, deck id, item id, correct, latency in ms) refers to
+# strings by id, so an answer takes 26 bytes on disk.
+MAGIC = b'JLPTLOG1'
+STRING_RECORD = struct.Struct('<cIH')
+ANSWER_RECORD = struct.Struct('<cdIIIBI')
+NO_LATENCY = 0xFFFFFFFF
+
+
+class AnswerLog:
+    """Append-only binary log of answer events (user, deck, item, correct, latency, timestamp).
+
+    Appends are buffered in memory and written after `flush_delay` seconds
+    or once `buffer_size` events are waiting, whichever comes first. A torn
+    tail from a crash mid-write is skipped when reading, and cut off by the
+    process that appends to the log before its first write.
+    """
+
+    def __init__(self, file_path, flush_delay=1.0, buffer_size=256):
+        self.file_path = file_path
+        self.flush_delay = flush_delay
+        self.buffer_size = buffer_size
+
+        self._strings = {}
+        self._strings_loaded = False
+        self._buffer = []
+        self._buffered_events = 0
+        self._timer = None
+        self._valid_bytes = None
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+
+        atexit.register(self.close)
+
+    def _string_id(self, text):
+        """Id of a string, queueing its string record when it is new (call with _lock held)"""
+        string_id = self._strings.get(text)
+        if string_id is None:
+            string_id = self._strings[text] = len(self._strings)
+            encoded = text.encode('utf-8')[:0xFFFF]
+            self._buffer.append(STRING_RECORD.pack(b'S', string_id, len(encoded)) + encoded)
+        return string_id
+
+    def append(self, user_id, deck, item, correct, latency_ms=None, timestamp=None):
+        """Queue one answer event and schedule a buffered write"""
+        if not self._strings_loaded:
+            self._load_strings()
+        timestamp = time.time() if timestamp is None else timestamp
+        latency = NO_LATENCY if latency_ms is None else max(0, min(int(latency_ms), NO_LATENCY - 1))
+        with self._lock:
+            record = ANSWER_RECORD.pack(b'A', timestamp, self._string_id(user_id), self._string_id(deck),
+                                        self._string_id(item), 1 if correct else 0, latency)
+            self._buffer.append(record)
+            self._buffered_events += 1
+            if self._buffered_events >= self.buffer_size:
+                flush_now = True
+            else:
+                flush_now = False
+                if self._timer is None:
+                    self._timer = threading.Timer(self.flush_delay, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+        if flush_now:
+            self.flush()
+
+    def flush(self):
+        """Write every buffered record to the log"""
+        with self._io_lock:
+            with self._lock:
+                records, self._buffer = self._buffer, []
+                self._buffered_events = 0
+                timer, self._timer = self._timer, None
+            if timer is not None:
+                timer.cancel()
+            if not records:
+                return
+            try:
+                new_file = not os.path.exists(self.file_path)
+                with open(self.file_path, 'ab') as f:
+                    if new_file:
+                        f.write(MAGIC)
+                    f.write(b''.join(records))
+                    f.flush()
+                    os.fsync(f.fileno())
+            except IOError as e:
+                print(f"❌ Could not write {self.file_path}. Error: {e}")
+                with self._lock:
+                    self._buffer = records + self._buffer
+
+    def close(self):
+        self.flush()
+
+    def _load_strings(self):
+        """Rebuild the string table of an existing log so new records keep using the same ids,
+        and drop a torn tail so appends start on a record boundary"""
+        for _ in self.events():
+            pass
+        valid_bytes = self._valid_bytes
+        if valid_bytes is not None and valid_bytes < os.path.getsize(self.file_path):
+            with self._io_lock, open(self.file_path, 'r+b') as f:
+                f.truncate(valid_bytes)
+
+    def events(self):
+        """Yield every logged event as a (timestamp, user_id, deck, item, correct, latency_ms) tuple.
+
+        Reading the whole log also loads its string table, which appends need.
+        The file is only read, so logs other processes are appending to can be
+        replayed: a record still being written is left out, not cut off.
+        """
+        self._valid_bytes = None
+        if not os.path.exists(self.file_path):
+            self._strings_loaded = True
+            return
+        with open(self.file_path, 'rb') as f:
+            data = f.read()
+        if not data.startswith(MAGIC):
+            print(f"⚠️ {self.file_path} is not an answer log, ignoring it")
+            self._strings_loaded = True
+            return
+
+        names = {}
+        offset = len(MAGIC)
+        while offset < len(data):
+            kind = data[offset:offset + 1]
+            if kind == b'S' and offset + STRING_RECORD.size <= len(data):
+                _, string_id, length = STRING_RECORD.unpack_from(data, offset)
+                end = offset + STRING_RECORD.size + length
+                if end > len(data):
+                    break
+                names[string_id] = data[offset + STRING_RECORD.size:end].decode('utf-8', 'replace')
+                offset = end
+            elif kind == b'A' and offset + ANSWER_RECORD.size <= len(data):
+                _, timestamp, user, deck, item, correct, latency = ANSWER_RECORD.unpack_from(data, offset)
+                offset += ANSWER_RECORD.size
+                yield (timestamp, names.get(user), names.get(deck), names.get(item), bool(correct),
+                       None if latency == NO_LATENCY else latency)
+            else:
+                break
+
+        # Keep the string ids of this file, for appends
+        with self._lock:
+            for string_id, text in names.items():
+                self._strings.setdefault(text, string_id)
+            self._strings_loaded = True
+        self._valid_bytes = offset
+
+
+# Buckets of time since the previous answer about an item, for retention curves
+RETENTION_BUCKETS = ((3600, '<1h'), (86400, '<1d'), (3 * 86400, '<3d'), (7 * 86400, '<7d'),
+                     (30 * 86400, '<30d'), (float('inf'), '30d+'))
+DAY = 86400
+
+
+class StatsEngine:
+    """Answer statistics kept as rollups updated per event, so reading them never rescans the log.
+
+    Per (user, deck): answer and correct totals, the current and best run of
+    correct answers, the latency sum, per-item accuracy and streaks, a
+    retention curve (accuracy by time since the item was last answered) and
+    the days with answers, for the study-day streak.
+    """
+
+    def __init__(self):
+        self._rollups = {}
+        self._lock = threading.Lock()
+
+    def _rollup(self, user_id, deck):
+        key = (user_id, deck)
+        rollup = self._rollups.get(key)
+        if rollup is None:
+            rollup = self._rollups[key] = {
+                'answers': 0, 'correct': 0, 'run': 0, 'best_run': 0,
+                'latency_total': 0, 'latency_count': 0,
+                'items': {},   # item -> [answers, correct, streak, last_seen]
+                'retention': {label: [0, 0] for _, label in RETENTION_BUCKETS},
+                'days': set()
+            }
+        return rollup
+
+    def record(self, timestamp, user_id, deck, item, correct, latency_ms=None):
+        with self._lock:
+            rollup = self._rollup(user_id, deck)
+            rollup['answers'] += 1
+            rollup['days'].add(int(timestamp // DAY))
+            if latency_ms is not None:
+                rollup['latency_total'] += latency_ms
+                rollup['latency_count'] += 1
+
+            stats = rollup['items'].get(item)
+            if stats is None:
+                stats = rollup['items'][item] = [0, 0, 0, None]
+            elif stats[3] is not None:
+                gap = timestamp - stats[3]
+                for limit, label in RETENTION_BUCKETS:
+                    if gap < limit:
+                        bucket = rollup['retention'][label]
+                        bucket[0] += 1
+                        bucket[1] += 1 if correct else 0
+                        break
+            stats[0] += 1
+            stats[3] = timestamp
+
+            if correct:
+                rollup['correct'] += 1
+                rollup['run'] += 1
+                rollup['best_run'] = max(rollup['best_run'], rollup['run'])
+                stats[1] += 1
+                stats[2] += 1
+            else:
+                rollup['run'] = 0
+                stats[2] = 0
+
+    def load(self, events):
+        """Build the rollups from logged events"""
+        count = 0
+        for event in events:
+            self.record(*event)
+            count += 1
+        return count
+
+    def summary(self, user_id, deck, deck_size=None, today=None):
+        """Statistics of one learner's deck, from the rollups"""
+        today = int((time.time() if today is None else today) // DAY)
+        with self._lock:
+            rollup = self._rollups.get((user_id, deck))
+            if rollup is None:
+                return {'answers': 0, 'correct': 0, 'accuracy': None, 'items_seen': 0,
+                        'coverage': 0.0 if deck_size else None, 'streak': 0, 'best_streak': 0,
+                        'study_days': 0, 'study_day_streak': 0, 'mean_latency_ms': None, 'retention': []}
+
+            study_day_streak = 0
+            day = today if today in rollup['days'] else today - 1
+            while day in rollup['days']:
+                study_day_streak += 1
+                day -= 1
+
+            return {
+                'answers': rollup['answers'],
+                'correct': rollup['correct'],
+                'accuracy': rollup['correct'] / rollup['answers'],
+                'items_seen': len(rollup['items']),
+                'coverage': min(1.0, len(rollup['items']) / deck_size) if deck_size else None,
+                'streak': rollup['run'],
+                'best_streak': rollup['best_run'],
+                'study_days': len(rollup['days']),
+                'study_day_streak': study_day_streak,
+                'mean_latency_ms': (rollup['latency_total'] / rollup['latency_count']
+                                    if rollup['latency_count'] else None),
+                'retention': [{'since_last': label, 'answers': answers, 'accuracy': correct / answers}
+                              for label, (answers, correct) in rollup['retention'].items() if answers]
+            }
+
+    def item_counts(self, user_id, deck):
+        """Live per-item rollup of a learner's deck (item -> [answers, correct, streak, last_seen])"""
+        with self._lock:
+            return self._rollup(user_id, deck)['items']
+
+    def item_stats(self, user_id, deck, limit=20):
+        """Per-item accuracy of a learner's deck, weakest items first"""
+        with self._lock:
+            rollup = self._rollups.get((user_id, deck))
+            items = list(rollup['items'].items()) if rollup else []
+        rows = [{'item': item, 'answers': answers, 'accuracy': correct / answers, 'streak': streak,
+                 'last_seen': last_seen}
+                for item, (answers, correct, streak, last_seen) in items]
+        rows.sort(key=lambda row: (row['accuracy'], -row['answers']))
+        return rows[:limit]
@@ -1,17 +1,64 @@
-from flask import Flask, render_template, request, jsonify, session
+import time
+# Start of the app's startup, for the startup report (the Google client libraries are imported on first use)
+IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, Response, render_template, request, jsonify, session
 import os
 import random
-import pandas as pd
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 import json
+import threading
+import collections
+from answer_log import AnswerLog, StatsEngine
+from cross_index import CrossIndex
+from deck_file import compile_deck_file, open_deck_file
+from deck_registry import DeckRegistry
+from decks import KNOWLEDGE_LEVELS, SHEET_SCHEMAS, Deck, LevelIndex, deck_fingerprints, diff_fingerprints, parse_example_sentences, row_fingerprints
+from distractors import DistractorPool
+from grader import AnswerGrader
+from knowledge_store import KnowledgeStore, SQLiteCardStore, SQLiteKnowledgeStore
+from quiz_pool import QuizPool
+from quiz_sessions import QuizSessionStore, SQLiteQuizBackend
+from sheet_fetcher import call_with_backoff, fetch_sheets
+from search import SearchIndex
+from snapshot import is_snapshot, load_snapshot, save_snapshot, values_version
+from sources import open_source, parse_source_specs, source_signature
+from srs import DueQueue
 
 app = Flask(__name__)
 app.secret_key = 'jlpt_quiz_secret_key_2024'
 
+# Learner that knowledge is recorded for when a request names no user
+DEFAULT_USER = 'default'
+
+# Quiz length when the page asks for none, and the most a quiz may have
+DEFAULT_QUIZ_QUESTIONS = 20
+MAX_QUIZ_QUESTIONS = 500
+
+# Most results /api/search returns
+MAX_SEARCH_RESULTS = 100
+
+# Most sentences /api/sentences returns, and weak items tried per targeted sentence question
+MAX_SENTENCE_RESULTS = 200
+TARGET_CANDIDATES = 5
+
+# Most answers /api/check-kanji-answers grades in one call
+MAX_GRADE_BATCH = 5000
+
+# Field of a quiz question naming the deck item it asks about
+QUIZ_ITEM_FIELDS = {'grammar': 'grammar', 'vocabulary': 'word'}
+
+# Bounds for the cached per-user knowledge-level indexes and review queues
+MAX_LEVEL_INDEXES = 256
+LEVEL_INDEX_MAX_AGE = 30
+
+# Due reviews a single random question is picked from, so skipping one doesn't repeat it
+DUE_WINDOW = 10
+
+# Memory the decks of other levels may hold before the least recently used ones are dropped
+DECK_MEMORY_MB = 512
+
 class JLPTWebApp:
-    def __init__(self):
+    def __init__(self, service=None):
         self.credentials_file = 'credentials.json'
         self.spreadsheet_id = "1ROkMNwMWyUYoE7LdNFLqc85xUUiToWMOqnS61R095zg"
         
@@ -20,84 +67,388 @@ class JLPTWebApp:
         self.vocabulary_knowledge_file = 'vocabulary_knowledge.json'
         self.grammar_knowledge_file = 'grammar_knowledge.json'
         
-        self.kanji_knowledge = {}
-        self.vocabulary_knowledge = {}
-        self.grammar_knowledge = {}
+        # Default user's knowledge stores, opened on first use (see knowledge())
+        self.kanji_knowledge = None
+        self.vocabulary_knowledge = None
+        self.grammar_knowledge = None
+        self._knowledge_lock = threading.Lock()
+        
+        # Knowledge storage backend: 'json' (single learner, one file per deck) or
+        # 'sqlite' (per-user rows in one database shared by all worker processes)
+        self.knowledge_backend = os.environ.get('JLPT_KNOWLEDGE_BACKEND', 'json')
+        self.knowledge_db = os.environ.get('JLPT_KNOWLEDGE_DB', 'knowledge.db')
+        self._user_knowledge = {}
+        
+        # Running quizzes live server-side; the session cookie only carries their id
+        quiz_session_db = os.environ.get('JLPT_QUIZ_SESSION_DB')
+        self.quiz_sessions = QuizSessionStore(
+            ttl=float(os.environ.get('JLPT_QUIZ_SESSION_TTL', 6 * 3600)),
+            backend=SQLiteQuizBackend(quiz_session_db) if quiz_session_db else None
+        )
+        
+        # Ready-made quiz sets per (deck, user, length), pre-generated in the background
+        self.quiz_pool = QuizPool(
+            self._build_pooled_quiz,
+            lambda key, quiz_set: (question[QUIZ_ITEM_FIELDS[key[0]]] for question in quiz_set),
+            size=int(os.environ.get('JLPT_QUIZ_POOL_SIZE', 4))
+        )
+        
+        # Per (user, deck, level) knowledge-level pools over the deck rows, least recently used first
+        self._level_indexes = collections.OrderedDict()
+        self._level_index_lock = threading.Lock()
+        # Per (user, deck) count of knowledge updates, so an index built outside the lock can tell it missed one
+        self._knowledge_versions = collections.Counter()
+        
+        # Character n-gram search over the items of every loaded deck
+        self.search_index = SearchIndex()
+        # Decks whose search entries / graded answers aren't indexed yet (decks mapped from a deck file)
+        self._unindexed = set()
+        self._index_lock = threading.Lock()
+        
+        # Kanji / word -> example sentences across all decks, rebuilt on first use after a reload
+        self._cross_index = None
+        self._cross_index_lock = threading.Lock()
+        
+        # Free-text grader with the correct answers of every loaded deck precompiled
+        self.grader = AnswerGrader(fuzzy=os.environ.get('JLPT_FUZZY_GRADING', '1') != '0')
+        
+        # Every graded answer goes to an append-only log; statistics are rolled up as they arrive,
+        # after the log is replayed on first use (see answer_stats())
+        self.answer_log = AnswerLog(os.environ.get('JLPT_ANSWER_LOG', 'answers.log'))
+        self.stats = StatsEngine()
+        self._stats_loaded = False
+        self._stats_lock = threading.Lock()
+        
+        # Spaced-repetition cards per (user, deck): stores and due-time queues
+        self._srs_stores = {}
+        self._srs_lock = threading.Lock()
+        self._schedules = collections.OrderedDict()
 
         # Configuration for multiple sheets
         self.sheets_config = {
             'grammar': {
                 'name': "Grammar",
                 'data': None,
-                'loaded': False
+                'loaded': False,
+                'deck': None,
+                'fingerprints': {}
             },
             'kanji': {
                 'name': "Kanji",  # Change this to your actual kanji sheet name (e.g., "Sheet2", "Kanji", "漢字", etc.)
                 'data': None,
-                'loaded': False
+                'loaded': False,
+                'deck': None,
+                'fingerprints': {}
             },
             'vocabulary': {
                 'name': "Vocabulary",
                 'data': None,
-                'loaded': False
+                'loaded': False,
+                'deck': None,
+                'fingerprints': {}
             }
         }
-        self.service = None
+        # JLPT level the decks above are; other levels (and custom decks) live in the deck registry,
+        # configured in JLPT_LEVELS_FILE and loaded on first use
+        self.level = os.environ.get('JLPT_LEVEL', 'n3').lower()
+        self.decks = DeckRegistry(
+            max_bytes=int(float(os.environ.get('JLPT_DECK_MEMORY_MB', DECK_MEMORY_MB)) * 1e6),
+            workers=int(os.environ.get('JLPT_DECK_LOAD_WORKERS', 4)),
+            on_evict=self._forget_deck
+        )
+        self.register_levels(os.environ.get('JLPT_LEVELS_FILE', 'levels.json'))
+        
+        # Sheets API client; a fake exposing spreadsheets().values() can be injected for testing
+        self.service = service
+        self.credentials = None
         self.data = None  # Keep for backward compatibility
         self.data_loaded = False
         
-        # Load all knowledge data on startup
-        self.load_kanji_knowledge()
-        self.load_vocabulary_knowledge()
-        self.load_grammar_knowledge()
+        # Compact mode serves straight from the decks and never builds DataFrames
+        self.compact_decks = os.environ.get('JLPT_COMPACT_DECKS') == '1'
+        
+        # Local snapshot of the sheet values, used for fast / offline startup
+        self.snapshot_file = os.environ.get('JLPT_SNAPSHOT_FILE', 'sheets_snapshot.bin')
+        # Compiled, memory-mapped decks, written next to the snapshot and preferred at startup
+        self.deck_file = os.environ.get('JLPT_DECK_FILE', 'decks.bin')
+        self.deck_file_version = None
+        self.snapshot_version = None
+        
+        # Local files (CSV / TSV, Anki, JMdict / KANJIDIC2) imported in place of their sheets: {sheet_type: (path, header)}
+        self.sources = parse_source_specs(os.environ.get('JLPT_SOURCES', ''))
+        self.source_signatures = {}
+        
+        # Background refresh of the sheet data; decks are swapped under _deck_lock
+        self.refresh_interval = float(os.environ.get('JLPT_REFRESH_INTERVAL', '0'))
+        self.last_refresh = None
+        self._deck_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refresher = None
+        # Set by the prefork server: asks the parent process to refresh instead of this worker
+        self.reload_handler = None
+        
+        # (phase, seconds) of the startup so far, printed by startup_report()
+        self.startup_phases = []
+        self.started_at = IMPORT_STARTED
+        self.first_request_after = None
 
+    def record_phase(self, name, start, end=None):
+        """Add a startup phase that ran from start (a perf_counter() reading) to end / now; returns its end"""
+        end = time.perf_counter() if end is None else end
+        self.startup_phases.append((name, end - start))
+        return end
+    
+    def startup_report(self):
+        """Print how long each startup phase took"""
+        total = sum(seconds for _, seconds in self.startup_phases)
+        phases = ', '.join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.startup_phases)
+        print(f"⏱️ Started in {total * 1000:.0f} ms ({phases})")
+    
+    def note_first_request(self):
+        """Log the time from start (or a worker's fork) to the first response, once"""
+        if self.first_request_after is None:
+            self.first_request_after = time.perf_counter() - self.started_at
+            print(f"⏱️ First request served {self.first_request_after * 1000:.0f} ms after start")
+    
     def load_kanji_knowledge(self):
-        """Loads the kanji knowledge data from a JSON file."""
-        self.kanji_knowledge = self._load_knowledge_data(self.kanji_knowledge_file)
+        """Loads the kanji knowledge store of the default user."""
+        self.kanji_knowledge = self._open_knowledge_store('kanji', self.kanji_knowledge_file)
 
     def save_kanji_knowledge(self):
-        """Saves the kanji knowledge data to a JSON file."""
-        self._save_knowledge_data(self.kanji_knowledge, self.kanji_knowledge_file)
+        """Writes pending kanji knowledge changes to disk now (updates are otherwise written behind)."""
+        if self.kanji_knowledge is not None:
+            self.kanji_knowledge.flush()
 
     def load_vocabulary_knowledge(self):
-        """Loads the vocabulary knowledge data from a JSON file."""
-        self.vocabulary_knowledge = self._load_knowledge_data(self.vocabulary_knowledge_file)
+        """Loads the vocabulary knowledge store of the default user."""
+        self.vocabulary_knowledge = self._open_knowledge_store('vocabulary', self.vocabulary_knowledge_file)
 
     def save_vocabulary_knowledge(self):
-        """Saves the vocabulary knowledge data to a JSON file."""
-        self._save_knowledge_data(self.vocabulary_knowledge, self.vocabulary_knowledge_file)
+        """Writes pending vocabulary knowledge changes to disk now (updates are otherwise written behind)."""
+        if self.vocabulary_knowledge is not None:
+            self.vocabulary_knowledge.flush()
 
     def load_grammar_knowledge(self):
-        """Loads the grammar knowledge data from a JSON file."""
-        self.grammar_knowledge = self._load_knowledge_data(self.grammar_knowledge_file)
+        """Loads the grammar knowledge store of the default user."""
+        self.grammar_knowledge = self._open_knowledge_store('grammar', self.grammar_knowledge_file)
 
     def save_grammar_knowledge(self):
-        """Saves the grammar knowledge data to a JSON file."""
-        self._save_knowledge_data(self.grammar_knowledge, self.grammar_knowledge_file)
+        """Writes pending grammar knowledge changes to disk now (updates are otherwise written behind)."""
+        if self.grammar_knowledge is not None:
+            self.grammar_knowledge.flush()
 
-    def _load_knowledge_data(self, file_path):
-        """Generic function to load knowledge data from a JSON file."""
-        if os.path.exists(file_path):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    knowledge_data = json.load(f)
-                print(f"✅ Loaded {len(knowledge_data)} entries from {file_path}.")
-                return knowledge_data
-            except (json.JSONDecodeError, IOError) as e:
-                print(f"⚠️ Could not load {file_path}, starting fresh. Error: {e}")
-                return {}
-        else:
-            print(f"ℹ️ No {file_path} found. A new one will be created.")
-            return {}
+    def _open_knowledge_store(self, deck, file_path):
+        """Open the default user's knowledge store of a deck with the configured backend"""
+        if self.knowledge_backend != 'sqlite':
+            return KnowledgeStore(file_path)
+        
+        store = SQLiteKnowledgeStore(self.knowledge_db, deck, DEFAULT_USER)
+        if len(store) == 0 and os.path.exists(file_path):
+            # First run on SQLite: carry over the existing JSON knowledge
+            levels = dict(KnowledgeStore(file_path).items())
+            store.update(levels)
+            print(f"✅ Imported {len(levels)} {deck} knowledge entries from {file_path} into {self.knowledge_db}.")
+        return store
+    
+    def knowledge(self, deck, user_id=None):
+        """Knowledge store of a deck ('kanji', 'grammar' or 'vocabulary') for a user.
 
-    def _save_knowledge_data(self, data, file_path):
-        """Generic function to save knowledge data to a JSON file."""
-        try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
-        except IOError as e:
-            print(f"❌ Could not save {file_path}. Error: {e}")
+        The JSON backend only tracks a single learner, so every user shares it.
+        """
+        if self.knowledge_backend != 'sqlite' or user_id in (None, DEFAULT_USER):
+            store = getattr(self, f"{deck}_knowledge")
+            if store is None:
+                with self._knowledge_lock:
+                    if getattr(self, f"{deck}_knowledge") is None:
+                        getattr(self, f"load_{deck}_knowledge")()
+                    store = getattr(self, f"{deck}_knowledge")
+            return store
+        
+        key = (user_id, deck)
+        store = self._user_knowledge.get(key)
+        if store is None:
+            store = self._user_knowledge[key] = SQLiteKnowledgeStore(self.knowledge_db, deck, user_id)
+        return store
+    
+    def level_index(self, deck_type, user_id=None, level=None):
+        """Knowledge-level pools of a deck for a user, built on first use and after deck reloads.
 
+        Knowledge and answer counts belong to the items, so every level's deck shares them.
+        """
+        deck = self.get_deck(deck_type, level)
+        if deck is None:
+            return None
+        
+        user_id = user_id or DEFAULT_USER
+        key = (user_id, deck_type, level)
+        now = time.time()
+        with self._level_index_lock:
+            index = self._level_indexes.get(key)
+            # SQLite knowledge can be changed by other worker processes, so rebuild periodically
+            stale = index is not None and self.knowledge_backend == 'sqlite' and now - index.built_at > LEVEL_INDEX_MAX_AGE
+            if index is not None and index.deck is deck and not stale:
+                self._level_indexes.move_to_end(key)
+                return index
+            version = self._knowledge_versions[user_id, deck_type]
+        
+        # The answer counts behind the sampling weights are the statistics' per-item rollup,
+        # so they survive restarts (replayed from the answer log) and stay current as answers arrive
+        answers = self.answer_stats().item_counts(user_id, deck_type)
+        while True:
+            # Read outside the lock, through the store's level query; an update landing meanwhile
+            # may be missing from what was read, so build again
+            levels = self.knowledge(deck_type, user_id).items_at(KNOWLEDGE_LEVELS)
+            index = LevelIndex(deck, levels, built_at=now, answers=answers)
+            with self._level_index_lock:
+                if self._knowledge_versions[user_id, deck_type] == version:
+                    self._level_indexes[key] = index
+                    self._level_indexes.move_to_end(key)
+                    while len(self._level_indexes) > MAX_LEVEL_INDEXES:
+                        self._level_indexes.popitem(last=False)
+                    return index
+                version = self._knowledge_versions[user_id, deck_type]
+    
+    def srs_store(self, deck, user_id=None):
+        """Store of a user's spaced-repetition cards of a deck (item -> (interval, ease, reps, due)), using the knowledge backend"""
+        if self.knowledge_backend != 'sqlite':
+            user_id = DEFAULT_USER
+        key = (user_id or DEFAULT_USER, deck)
+        with self._srs_lock:
+            store = self._srs_stores.get(key)
+            if store is None:
+                if self.knowledge_backend != 'sqlite':
+                    store = KnowledgeStore(f'{deck}_srs.json')
+                else:
+                    store = SQLiteCardStore(self.knowledge_db, deck, key[0])
+                self._srs_stores[key] = store
+        return store
+    
+    def schedule(self, deck_type, user_id=None):
+        """Due-time queue of a user's reviews in a deck, built on first use"""
+        user_id = user_id or DEFAULT_USER
+        key = (user_id, deck_type)
+        now = time.time()
+        with self._level_index_lock:
+            queue = self._schedules.get(key)
+            stale = queue is not None and self.knowledge_backend == 'sqlite' and now - queue.built_at > LEVEL_INDEX_MAX_AGE
+            if queue is None or stale:
+                queue = DueQueue(self.srs_store(deck_type, user_id).items(), built_at=now)
+                self._schedules[key] = queue
+            self._schedules.move_to_end(key)
+            while len(self._schedules) > MAX_LEVEL_INDEXES:
+                self._schedules.popitem(last=False)
+        return queue
+    
+    def select_quiz_rows(self, deck_type, num_questions, user_id=None, due_window=None, level=None):
+        """Deck rows to ask about: due reviews first, the rest drawn weighted by level and error rate.
+
+        With due_window the rows are picked at random among that many of the most overdue reviews.
+        """
+        deck = self.get_deck(deck_type, level)
+        index = self.level_index(deck_type, user_id, level)
+        queue = self.schedule(deck_type, user_id)
+        with self._level_index_lock:
+            due_items = queue.due(max(num_questions, due_window or 0))
+        if len(due_items) > num_questions:
+            due_items = random.sample(due_items, num_questions)
+        
+        rows = [deck.rows_for(item)[0] for item in due_items if deck.rows_for(item)]
+        if len(rows) < num_questions:
+            chosen = set(rows)
+            with self._level_index_lock:
+                extra = [row for row in index.sample(num_questions) if row not in chosen]
+            rows.extend(extra[:num_questions - len(rows)])
+        random.shuffle(rows)
+        return rows
+    
+    def record_results(self, deck_type, results, user_id=None, latencies=None):
+        """Log graded answers ({item: correct}, optional {item: latency_ms}) and count them,
+        so items answered wrongly are asked more often"""
+        user_id = user_id or DEFAULT_USER
+        latencies = latencies or {}
+        now = time.time()
+        stats = self.answer_stats()
+        for item, is_correct in results.items():
+            latency = latencies.get(item)
+            self.answer_log.append(user_id, deck_type, item, is_correct, latency, now)
+            stats.record(now, user_id, deck_type, item, is_correct, latency)
+        
+        # The level indexes read the counts from the statistics, only their weights need updating
+        with self._level_index_lock:
+            for index in self._level_indexes_of(deck_type, user_id):
+                for item in results:
+                    index.reweigh(item)
+    
+    def deck_stats(self, user_id=None, deck_types=None):
+        """Answer statistics of a user per deck, with the weakest items of each"""
+        user_id = user_id or DEFAULT_USER
+        stats = self.answer_stats()
+        summaries = {}
+        for deck_type in deck_types or self.sheets_config:
+            deck = self.get_deck(deck_type)
+            summary = stats.summary(user_id, deck_type, len(deck.valid_rows) if deck else None)
+            summary['weakest'] = stats.item_stats(user_id, deck_type, limit=10)
+            summaries[deck_type] = summary
+        return summaries
+    
+    def answer_stats(self):
+        """Answer statistics, replaying the answer log the first time they are needed"""
+        if not self._stats_loaded:
+            with self._stats_lock:
+                if not self._stats_loaded:
+                    start = time.perf_counter()
+                    replayed = self.stats.load(self.answer_log.events())
+                    self._stats_loaded = True
+                    if replayed:
+                        print(f"✅ Loaded {replayed} answers from {self.answer_log.file_path} "
+                              f"in {(time.perf_counter() - start) * 1000:.0f} ms.")
+        return self.stats
+    
+    def reload_stats(self, log_paths=()):
+        """Rebuild the answer statistics from the answer log and other logs (e.g. of worker processes)"""
+        self.answer_log.flush()
+        stats = StatsEngine()
+        replayed = stats.load(self.answer_log.events())
+        for path in log_paths:
+            replayed += stats.load(AnswerLog(path).events())
+        with self._stats_lock:
+            self.stats = stats
+            self._stats_loaded = True
+        # The level indexes weigh rows by the counts of the replaced statistics
+        with self._level_index_lock:
+            self._level_indexes.clear()
+        return replayed
+    
+    def set_knowledge_level(self, deck_type, item, level, user_id=None):
+        """Record a knowledge level and move the item between the level pools"""
+        self.set_knowledge_levels(deck_type, {item: level}, user_id)
+    
+    def set_knowledge_levels(self, deck_type, levels, user_id=None):
+        """Record several knowledge levels of a deck in one store transaction and reschedule their reviews"""
+        self.knowledge(deck_type, user_id).update(levels)
+        queue = self.schedule(deck_type, user_id)
+        cards = {}
+        with self._level_index_lock:
+            self._knowledge_versions[user_id or DEFAULT_USER, deck_type] += 1
+            for index in self._level_indexes_of(deck_type, user_id):
+                for item, level in levels.items():
+                    index.set_level(item, level)
+            for item, level in levels.items():
+                card = queue.record(item, level)
+                if card is not None:
+                    cards[item] = card.fields()
+        if cards:
+            self.srs_store(deck_type, user_id).update(cards)
+        # Pre-generated quizzes asking about these items now show stale levels
+        if deck_type in QUIZ_ITEM_FIELDS:
+            self.quiz_pool.invalidate(deck_type, user_id or DEFAULT_USER, levels)
+    
+    def _level_indexes_of(self, deck_type, user_id=None, exclude=None):
+        """A user's built level indexes of a deck type, across all levels (call under _level_index_lock)"""
+        user_id = user_id or DEFAULT_USER
+        return [index for key, index in self._level_indexes.items()
+                if key[:2] == (user_id, deck_type) and index is not exclude]
+    
     def authenticate(self):
         """Authenticate with Google Sheets API"""
         try:
@@ -105,12 +456,16 @@ class JLPTWebApp:
                 print(f"❌ Credentials file not found: {self.credentials_file}")
                 return False
             
+            # The client libraries take a noticeable part of startup, so they load only once a fetch needs them
+            from google.oauth2.service_account import Credentials
+            
             credentials = Credentials.from_service_account_file(
                 self.credentials_file, 
                 scopes=['https://www.googleapis.com/auth/spreadsheets.readonly']
             )
             
-            self.service = build('sheets', 'v4', credentials=credentials)
+            self.credentials = credentials
+            self.service = self.sheets_client()
             print("✅ Authenticated with Google Sheets API")
             return True
             
@@ -118,211 +473,682 @@ class JLPTWebApp:
             print(f"❌ Authentication failed: {e}")
             return False
     
-    def load_sheet_data(self, sheet_type):
-        """Load data from a specific sheet type"""
-        if sheet_type not in self.sheets_config:
-            print(f"❌ Unknown sheet type: {sheet_type}")
-            return False
-            
-        config = self.sheets_config[sheet_type]
+    def sheets_client(self):
+        """A new Sheets API client on the authenticated credentials (clients are not thread-safe)"""
+        from googleapiclient.discovery import build
         
-        # Check if already loaded
-        if config['loaded'] and config['data'] is not None:
-            print(f"✅ {sheet_type} data already loaded from cache")
-            return True
-            
-        try:
-            print(f"📥 Loading {sheet_type} data from Google Sheets...")
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.spreadsheet_id,
-                range=f"{config['name']}!A:Z"
+        return build('sheets', 'v4', credentials=self.credentials)
+    
+    def sheet_range(self, sheet_type):
+        """Spreadsheet id and A1 range of a configured sheet"""
+        config = self.sheets_config[sheet_type]
+        return config.get('spreadsheet_id', self.spreadsheet_id), self._whole_sheet(config['name'])
+    
+    @staticmethod
+    def _whole_sheet(name):
+        """A1 range of a whole sheet: the bare, quoted name covers every column, however wide the sheet grows"""
+        return "'{}'".format(name.replace("'", "''"))
+    
+    def sheet_types(self):
+        """Sheet types fetched from Google Sheets: those without a local source, none once grammar has one"""
+        if 'grammar' in self.sources:
+            return []
+        return [sheet_type for sheet_type in self.sheets_config if sheet_type not in self.sources]
+    
+    def fetch_sheet_values(self, sheet_type):
+        """Fetch the raw `values` payload (header row first) of a sheet from the Sheets API"""
+        spreadsheet_id, sheet_range = self.sheet_range(sheet_type)
+        result, _ = call_with_backoff(
+            lambda: self.service.spreadsheets().values().get(
+                spreadsheetId=spreadsheet_id,
+                range=sheet_range
             ).execute()
-            
-            values = result.get('values', [])
-            if not values:
-                print(f"❌ No data found in {sheet_type} sheet")
-                return False
-            
-            config['data'] = pd.DataFrame(values[1:], columns=values[0])
+        )
+        return result.get('values', [])
+    
+    def fetch_all_sheet_values(self, sheet_types=None):
+        """Fetch several sheets with one batchGet per spreadsheet, reporting per-sheet timing.
+
+        Returns (values, errors) keyed by sheet type.
+        """
+        sheet_types = list(sheet_types or self.sheets_config)
+        requests = {sheet_type: self.sheet_range(sheet_type) for sheet_type in sheet_types}
+        service_factory = self.sheets_client if self.credentials else None
+        
+        print(f"📥 Fetching {', '.join(sheet_types)} from Google Sheets...")
+        values, timings, errors = fetch_sheets(self.service, requests, service_factory=service_factory)
+        
+        for sheet_type in sheet_types:
+            if sheet_type in errors:
+                print(f"❌ Error fetching {sheet_type} data: {errors[sheet_type]}")
+            elif sheet_type in timings:
+                timing = timings[sheet_type]
+                print(f"⏱️ {sheet_type}: {max(len(values[sheet_type]) - 1, 0)} rows in {timing['seconds'] * 1000:.0f} ms "
+                      f"(batch of {timing['batch_size']}, {timing['attempts']} attempt(s))")
+        return values, errors
+    
+    def install_sheet_values(self, sheet_type, values):
+        """Build the DataFrame (unless in compact mode) and deck of a sheet from its raw values.
+
+        Everything is built off to the side and swapped in at once, so requests
+        in flight keep using the previous deck until the new one is complete.
+        """
+        config = self.sheets_config[sheet_type]
+        if self.compact_decks:
+            data = None
+            deck = self.build_deck(sheet_type, values=values)
+        else:
+            import pandas as pd
+            data = pd.DataFrame(values[1:], columns=values[0])
+            deck = self.build_deck(sheet_type, data=data)
+        self.install_deck(sheet_type, deck, data=data, fingerprints=row_fingerprints(sheet_type, values))
+        self.build_indexes()
+        print(f"✅ Successfully loaded {deck.size} {sheet_type} items!")
+    
+    def install_deck(self, sheet_type, deck, data=None, fingerprints=None):
+        """Swap in the deck of a sheet; its search and grading indexes follow with build_indexes()"""
+        config = self.sheets_config[sheet_type]
+        with self._deck_lock:
+            config['data'] = data
+            config['deck'] = deck
+            config['fingerprints'] = fingerprints or {}
             config['loaded'] = True
-            print(f"✅ Successfully loaded {len(config['data'])} {sheet_type} items!")
-            return True
-            
-        except HttpError as error:
-            print(f"❌ Error loading {sheet_type} data: {error}")
-            return False
+            if sheet_type == 'grammar':
+                # For backward compatibility, set the main data to grammar data
+                self.data = data
+        self.quiz_pool.clear(sheet_type)
+        with self._index_lock:
+            self._unindexed.add(sheet_type)
+    
+    def build_indexes(self):
+        """Index the decks installed since the last call for search and free-text grading"""
+        with self._index_lock:
+            while self._unindexed:
+                sheet_type = self._unindexed.pop()
+                deck = self.get_deck(sheet_type)
+                if deck is None:
+                    continue
+                # Sentence translations are what free-text answers are graded against
+                self.grader.compile(sentence['english'] for sentence in deck.sentences)
+                added, removed = self.search_index.update_deck(deck)
+                print(f"🔍 Search index: {added} {sheet_type} entries added, {removed} removed")
     
     def load_data(self):
-        """Load all sheet data - ONLY CALLED ONCE AT STARTUP"""
+        """Load all sheet data from Google Sheets and refresh the local snapshot"""
         if self.data_loaded:
             print("✅ All data already loaded from cache")
             return True
-            
-        # Load grammar data (existing functionality)
-        if self.load_sheet_data('grammar'):
-            # For backward compatibility, set the main data to grammar data
-            self.data = self.sheets_config['grammar']['data']
-            self.data_loaded = True
-            
-            # Try to load other sheets if available
+        
+        try:
+            fetched, errors = self.fetch_all_sheet_values(self.sheet_types())
+        except Exception as e:
+            print(f"❌ Error loading data: {e}")
+            return False
+        
+        # Grammar data is required, the other sheets are optional
+        if not fetched.get('grammar'):
+            if 'grammar' not in errors:
+                print("❌ No data found in grammar sheet")
+            return False
+        
+        installed = {}
+        for sheet_type, values in fetched.items():
+            if not values:
+                print(f"⚠️ No data found in {sheet_type} sheet")
+                continue
+            start = time.perf_counter()
             try:
-                self.load_sheet_data('kanji')
+                self.install_sheet_values(sheet_type, values)
             except Exception as e:
-                print(f"⚠️ Could not load kanji sheet: {e}")
+                if sheet_type == 'grammar':
+                    print(f"❌ Error loading grammar data: {e}")
+                    return False
+                print(f"⚠️ Could not load {sheet_type} sheet: {e}")
+                continue
+            installed[sheet_type] = values
+            print(f"⏱️ {sheet_type}: deck built in {(time.perf_counter() - start) * 1000:.0f} ms")
+        
+        self.data_loaded = True
+        self.save_snapshot(installed)
+        return True
+    
+    def save_snapshot(self, sheets_values):
+        """Write the fetched sheet values to the local snapshot file"""
+        if not self.snapshot_file or not sheets_values:
+            return False
+        if os.path.exists(self.snapshot_file) and not is_snapshot(self.snapshot_file):
+            # e.g. a .json fixture the app was started from
+            print(f"⚠️ Not saving the snapshot over {self.snapshot_file}: it is not a sheet snapshot")
+            return False
+        try:
+            self.snapshot_version = save_snapshot(self.snapshot_file, sheets_values, self.spreadsheet_id)
+            print(f"💾 Saved sheet snapshot {self.snapshot_version[:10]} to {self.snapshot_file}")
+            self.save_deck_file()
+            return True
+        except OSError as e:
+            print(f"⚠️ Could not save snapshot {self.snapshot_file}: {e}")
+            return False
+    
+    def load_initial_data(self, snapshot=None, offline=False):
+        """Load the decks at startup: from the deck file or the snapshot if there is one, else from Google Sheets.
+
+        Decks with a local source are imported from it, unless the deck file
+        was compiled from the same source files. The deck file is compiled
+        from the app's own snapshot, so a different snapshot asked for here is
+        loaded in its place. Returns 'deck_file', 'sources', 'snapshot' or
+        'sheets' for where the data came from, or None if nothing could be loaded.
+        """
+        other_snapshot = bool(snapshot) and os.path.abspath(snapshot) != os.path.abspath(self.snapshot_file or '')
+        snapshot = snapshot or self.snapshot_file
+        if not other_snapshot and self.load_deck_file():
+            return 'deck_file'
+        if other_snapshot and self.deck_file and os.path.exists(self.deck_file):
+            print(f"ℹ️ Starting from {snapshot}, not from the deck file {self.deck_file}")
+        if self.sources:
+            self.load_sources()
+            if not self.sheet_types():
+                if self.get_deck('grammar') is None:
+                    print("❌ Failed to import the grammar deck from its source file.")
+                    return None
+                self.data_loaded = True
+                self.save_deck_file()
+                return 'sources'
+        if self.load_from_snapshot(snapshot):
+            # The deck file was missing, outdated or of an older format: compile it for the next start
+            if not other_snapshot:
+                self.save_deck_file()
+            return 'snapshot'
+        if offline:
+            print(f"❌ Offline mode needs a snapshot, none found at {snapshot}")
+            return None
+        if self.service is None and not self.authenticate():
+            print("❌ Failed to authenticate! Check your credentials.json file.")
+            return None
+        if not self.load_data():
+            print("❌ Failed to load data! Check your Google Sheets connection.")
+            return None
+        return 'sheets'
+    
+    def close_stores(self):
+        """Write pending knowledge changes and answers, and close this thread's database connections"""
+        stores = [self.kanji_knowledge, self.vocabulary_knowledge, self.grammar_knowledge]
+        stores += list(self._user_knowledge.values()) + list(self._srs_stores.values())
+        for store in stores:
+            if store is not None:
+                store.close()
+        self.answer_log.flush()
+    
+    def after_fork(self, worker_id, quiz_session_db=None):
+        """Give a forked worker its own answer log (and the shared quiz session database)"""
+        self.started_at, self.first_request_after = time.perf_counter(), None
+        self.answer_log = AnswerLog(f"{self.answer_log.file_path}.{worker_id}")
+        if self.knowledge_backend != 'sqlite':
+            # The worker this one replaces may have written the JSON files since the parent read them;
+            # compacting the parent's copy would erase those updates
+            stores = [self.kanji_knowledge, self.vocabulary_knowledge, self.grammar_knowledge]
+            for store in stores + list(self._srs_stores.values()):
+                if store is not None:
+                    store.load()
+            with self._level_index_lock:
+                self._level_indexes.clear()
+                self._schedules.clear()
+        if quiz_session_db:
+            # No in-process cache: another worker may have moved the quiz on since
+            self.quiz_sessions = QuizSessionStore(ttl=self.quiz_sessions.ttl, max_entries=0,
+                                                  backend=SQLiteQuizBackend(quiz_session_db))
+    
+    def load_sources(self, sheet_types=None):
+        """Stream the local source files into decks, one row at a time.
 
+        Returns {sheet_type: row diff} for the decks that were imported.
+        """
+        changes = {}
+        for sheet_type in sheet_types or list(self.sources):
+            path, header = self.sources[sheet_type]
             try:
-                if self.load_sheet_data('vocabulary'):
-                    # --- DIAGNOSTIC CODE ---
-                    vocab_df = self.sheets_config['vocabulary']['data']
-                    if vocab_df is not None:
-                        print("📖 DEBUG: Found the following columns in your 'Vocabulary' sheet:")
-                        for i, col in enumerate(vocab_df.columns):
-                            print(f"  -> Column index {i}: '{col}'")
-                    # --- END OF DIAGNOSTIC CODE ---
+                start = time.perf_counter()
+                signature = source_signature(path, header)
+                deck = Deck.from_rows(sheet_type, *open_source(path, header))
             except Exception as e:
-                print(f"⚠️ Could not load vocabulary sheet: {e}")
+                print(f"❌ Could not import {sheet_type} from {path}: {e}")
+                continue
             
-            return True
-        return False
+            print(f"📋 Schema {deck.describe()}")
+            for problem in deck.problems:
+                print(f"⚠️ {sheet_type} source: {problem}")
+            fingerprints = deck_fingerprints(deck)
+            changes[sheet_type] = diff_fingerprints(self.sheets_config[sheet_type]['fingerprints'], fingerprints)
+            self.install_deck(sheet_type, deck, fingerprints=fingerprints)
+            self.source_signatures[sheet_type] = signature
+            print(f"✅ Imported {deck.size} {sheet_type} items from {path} in {time.perf_counter() - start:.1f}s")
+        self.build_indexes()
+        return changes
     
-    def create_grammar_quiz_set(self, num_questions=20):
-        """Create a set of grammar questions without repeating grammar points"""
-        if self.data is None or self.data.empty:
-            print("❌ No data available for grammar questions")
-            return None
+    def changed_sources(self):
+        """Sheet types whose source file changed on disk since it was imported"""
+        changed = []
+        for sheet_type, (path, header) in self.sources.items():
+            try:
+                if source_signature(path, header) != self.source_signatures.get(sheet_type):
+                    changed.append(sheet_type)
+            except OSError as e:
+                print(f"⚠️ Source {path} is unavailable: {e}")
+        return changed
+    
+    def load_deck_file(self, file_path=None):
+        """Map the compiled deck file; its decks are served straight from the mapped pages"""
+        file_path = file_path or self.deck_file
+        start = time.perf_counter()
+        compiled = open_deck_file(file_path)
+        if not compiled or not compiled['decks'].get('grammar'):
+            return False
+        try:
+            signatures = {sheet_type: source_signature(path, header) for sheet_type, (path, header) in self.sources.items()}
+        except OSError:
+            signatures = None
+        if compiled['sources'] != signatures:
+            print(f"ℹ️ {file_path} was not compiled from the current source files")
+            return False
         
-        # Get all available grammar points
-        available_grammars = self.data.copy()
-        grammar_col = 'Grammar Lesson' # Assuming this is the unique identifier
-
-        # Filter out 'good' grammar points
-        good_grammar = [k for k, v in self.grammar_knowledge.items() if v == 'good']
-        if good_grammar:
-            original_count = len(available_grammars)
-            available_grammars = available_grammars[~available_grammars[grammar_col].isin(good_grammar)]
-            print(f"ℹ️ Filtered out {original_count - len(available_grammars)} 'good' grammar points.")
-
-        # If we have fewer grammar points than requested, use all available
-        if len(available_grammars) < num_questions:
-            print(f"⚠️ Only {len(available_grammars)} grammar points available, using all of them")
-            num_questions = len(available_grammars)
+        for sheet_type, deck in compiled['decks'].items():
+            if sheet_type in self.sheets_config:
+                self.install_deck(sheet_type, deck, fingerprints=compiled['fingerprints'].get(sheet_type))
+                print(f"📋 Schema {deck.describe()}")
+        # The sheets the file was compiled from; a refresh only reloads decks if they changed
+        self.snapshot_version = self.deck_file_version = compiled['version']
+        self.source_signatures = dict(compiled['sources'])
+        self.data_loaded = True
+        print(f"🗺️ Mapped decks from {file_path} in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return True
+    
+    def save_deck_file(self):
+        """Compile the current decks into the deck file"""
+        if not self.deck_file:
+            return False
+        decks = {sheet_type: self.get_deck(sheet_type) for sheet_type in self.sheets_config}
+        fingerprints = {sheet_type: config['fingerprints'] for sheet_type, config in self.sheets_config.items()}
+        try:
+            start = time.perf_counter()
+            size = compile_deck_file(self.deck_file, decks, self.snapshot_version, self.source_signatures, fingerprints)
+            self.deck_file_version = self.snapshot_version
+            print(f"💾 Compiled {self.deck_file} ({size / 1e6:.1f} MB) in {(time.perf_counter() - start) * 1000:.0f} ms")
+            return True
+        except OSError as e:
+            print(f"⚠️ Could not write deck file {self.deck_file}: {e}")
+            return False
+    
+    def load_from_snapshot(self, file_path=None):
+        """Load all sheet data from the local snapshot file instead of the Sheets API"""
+        file_path = file_path or self.snapshot_file
+        snapshot = load_snapshot(file_path)
+        if not snapshot or not snapshot['sheets'].get('grammar'):
+            print(f"ℹ️ No usable sheet snapshot at {file_path}")
+            return False
         
-        # Randomly sample grammar points without replacement
-        selected_grammars = available_grammars.sample(n=num_questions)
+        print(f"📦 Loading sheet data from snapshot {file_path} ({snapshot['version'][:10]})")
+        for sheet_type, values in snapshot['sheets'].items():
+            if sheet_type in self.sheets_config and sheet_type not in self.sources and values:
+                self.install_sheet_values(sheet_type, values)
         
-        quiz_set = []
-        for _, row in selected_grammars.iterrows():
-            # Try different possible column names for examples
-            example = None
-            possible_example_columns = ['Example Senstence', 'Example Sentence', 'Example', 'Examples', 'Sentence', 'Sentences']
+        if not snapshot['fixture']:
+            # Later fetches update the snapshot the app started from; fixtures are only ever read
+            self.snapshot_file = file_path
+        self.snapshot_version = snapshot['version']
+        self.data_loaded = True
+        return True
+    
+    def refresh_data(self):
+        """Re-import changed source files, re-pull the sheets and swap in the ones whose rows changed.
+
+        Sheets without changes keep their current deck and indexes. Returns
+        {sheet_type: row diff} for the decks that were reloaded, or None if
+        the fetch failed and no source changed.
+        """
+        with self._refresh_lock:
+            changed_sources = self.changed_sources()
+            source_changes = self.load_sources(changed_sources) if changed_sources else {}
+            sheet_types = self.sheet_types()
+            if not sheet_types:
+                self.last_refresh = time.time()
+                if source_changes:
+                    self.save_deck_file()
+                else:
+                    print("✅ Source files are up to date")
+                return source_changes
             
-            for col_name in possible_example_columns:
-                if col_name in self.data.columns:
-                    example = row.get(col_name, None)
-                    if example and str(example) != 'nan' and str(example).strip():
-                        break
+            if self.service is None and not self.authenticate():
+                return source_changes or None
             
-            # Extract Japanese example sentence only
-            japanese_example = None
-            if example:
-                example_str = str(example)
-                example_lines = example_str.split('\n')
-                japanese_example = example_lines[0].strip()
-                
-                if not japanese_example or japanese_example.isspace():
-                    japanese_example = example_str.strip()
+            fetched, errors = self.fetch_all_sheet_values(sheet_types)
+            if errors:
+                print("⚠️ Sheet refresh failed, keeping current data")
+                return source_changes or None
             
-            grammar_lesson = row.get(grammar_col, 'N/A')
+            fetched = {sheet_type: values for sheet_type, values in fetched.items() if values}
+            if not fetched.get('grammar'):
+                print("⚠️ Sheet refresh returned no grammar data, keeping current data")
+                return source_changes or None
             
-            question = {
-                'grammar': grammar_lesson,
-                'japanese': row.get('文法レッスン', 'N/A'),
-                'correct': row.get('Grammar Meaning', 'N/A'),
-                'example': japanese_example,
-                'level': self.grammar_knowledge.get(grammar_lesson, 'none')
-            }
+            if self.snapshot_version and values_version(fetched) == self.snapshot_version:
+                # Same sheets the snapshot (or the deck file) holds
+                self.last_refresh = time.time()
+                if source_changes:
+                    self.save_deck_file()
+                else:
+                    print("✅ Sheet data is up to date")
+                return source_changes
             
-            # Generate options for this question
-            options = self.generate_options(question['correct'])
-            question['options'] = options
+            changes = dict(source_changes)
+            for sheet_type, values in fetched.items():
+                config = self.sheets_config[sheet_type]
+                diff = diff_fingerprints(config['fingerprints'], row_fingerprints(sheet_type, values))
+                if config['loaded'] and not any(diff.values()):
+                    continue
+                
+                print(f"🔄 {sheet_type} changed: {len(diff['added'])} added, "
+                      f"{len(diff['removed'])} removed, {len(diff['changed'])} changed rows")
+                self.install_sheet_values(sheet_type, values)
+                changes[sheet_type] = diff
             
-            quiz_set.append(question)
-        
-        return quiz_set
+            self.last_refresh = time.time()
+            if len(changes) > len(source_changes):
+                self.data_loaded = True
+                self.save_snapshot(fetched)
+            elif changes:
+                self.save_deck_file()
+            else:
+                print("✅ Sheet data is up to date")
+            return changes
     
-    def create_vocabulary_quiz_set(self, num_questions=20):
-        """Create a set of vocabulary questions without repeating words."""
-        if 'vocabulary' not in self.sheets_config or not self.sheets_config['vocabulary']['loaded']:
-            print("❌ Vocabulary data not available")
+    def revalidate_snapshot(self):
+        """Fetch the sheets from the API and swap in the new data if it differs from the snapshot"""
+        try:
+            return self.refresh_data() is not None
+        except Exception as e:
+            print(f"⚠️ Snapshot revalidation failed, keeping snapshot data: {e}")
+            return False
+    
+    def revalidate_in_background(self):
+        """Start snapshot revalidation on a daemon thread"""
+        thread = threading.Thread(target=self.revalidate_snapshot, name='snapshot-revalidate', daemon=True)
+        thread.start()
+        return thread
+    
+    def start_refresher(self, interval=None):
+        """Refresh the sheet data every `interval` seconds on a daemon thread"""
+        interval = interval or self.refresh_interval
+        if not interval or (self._refresher and self._refresher.is_alive()):
             return None
         
-        vocab_data = self.sheets_config['vocabulary']['data']
-        if vocab_data is None or vocab_data.empty:
-            print("❌ No data available for vocabulary questions")
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh_data()
+                except Exception as e:
+                    print(f"⚠️ Background sheet refresh crashed: {e}")
+        
+        self.refresh_interval = interval
+        self._refresher = threading.Thread(target=run, name='sheet-refresher', daemon=True)
+        self._refresher.start()
+        print(f"🔁 Refreshing sheet data every {interval:g}s")
+        return self._refresher
+    
+    def build_deck(self, sheet_type, values=None, data=None):
+        """Resolve the schema of a sheet and build its deck (cleaned rows, sentences, distractors)"""
+        if values is not None:
+            deck = Deck.from_values(sheet_type, values)
+        else:
+            deck = Deck.from_dataframe(sheet_type, data)
+        
+        print(f"📋 Schema {deck.describe()}")
+        for problem in deck.problems:
+            print(f"⚠️ {sheet_type} sheet: {problem}")
+        return deck
+    
+    def get_deck(self, sheet_type, level=None):
+        """Return the deck of a loaded sheet, rebuilding it if the sheet data was replaced.
+
+        Decks of another level come from the deck registry, loaded on first use.
+        """
+        if level is not None and level != self.level:
+            return self.decks.get(level, sheet_type)
+        config = self.sheets_config.get(sheet_type)
+        if not config or not config['loaded']:
             return None
+        
+        deck = config['deck']
+        if config['data'] is not None and (deck is None or deck.source is not config['data']):
+            with self._deck_lock:
+                deck = config['deck']
+                if config['data'] is not None and (deck is None or deck.source is not config['data']):
+                    deck = config['deck'] = self.build_deck(sheet_type, data=config['data'])
+        return deck
+    
+    def register_levels(self, file_path):
+        """Register the decks of other levels from a JSON file (skipped if there is none).
+
+        {"n5": {"grammar": "N5 Grammar", "vocabulary": {"path": "n5_vocab.tsv"}}, ...}:
+        a string is a sheet name (in the level's "spreadsheet_id", else the app's
+        spreadsheet), {"path": ..., "columns": [...]} a local source file.
+        """
+        if not file_path or not os.path.exists(file_path):
+            return 0
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                levels = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not read deck levels from {file_path}: {e}")
+            return 0
+
+        registered = 0
+        for level, decks in levels.items():
+            level = level.lower()
+            spreadsheet_id = decks.get('spreadsheet_id', self.spreadsheet_id)
+            for sheet_type, spec in decks.items():
+                if sheet_type not in SHEET_SCHEMAS:
+                    continue
+                if isinstance(spec, str):
+                    spec = {'sheet': spec}
+                self.decks.register(level, sheet_type, self._deck_loader(sheet_type, spec, spreadsheet_id))
+                registered += 1
+        print(f"📚 Registered {registered} decks of {', '.join(self.decks.levels())} from {file_path}")
+        return registered
+
+    def _deck_loader(self, sheet_type, spec, spreadsheet_id):
+        """Loader of a registry deck: streamed from a local source file, or fetched from its sheet"""
+        if 'path' in spec:
+            return lambda: Deck.from_rows(sheet_type, *open_source(spec['path'], spec.get('columns')))
 
-        # Identify columns, now case-insensitive
-        word_col = next((col for col in vocab_data.columns if col.strip().lower() in ['word', '単語', 'vocabulary']), None)
-        meaning_col = next((col for col in vocab_data.columns if col.strip().lower() in ['meaning', '意味', 'english']), None)
+        def load():
+            if self.service is None and not self.authenticate():
+                raise RuntimeError("not authenticated with Google Sheets")
+            # API clients are not thread-safe and registry decks load in parallel
+            client = self.sheets_client() if self.credentials else self.service
+            sheet_range = self._whole_sheet(spec['sheet'])
+            values, _, errors = fetch_sheets(client, {sheet_type: (spec.get('spreadsheet_id', spreadsheet_id), sheet_range)})
+            if sheet_type in errors:
+                raise errors[sheet_type]
+            return Deck.from_values(sheet_type, values.get(sheet_type, []))
+        return load
 
-        if not word_col or not meaning_col:
+    def _forget_deck(self, level, sheet_type):
+        """Drop what was built from an evicted registry deck, so its memory is actually freed"""
+        with self._level_index_lock:
+            for key in [key for key in self._level_indexes if key[1:] == (sheet_type, level)]:
+                del self._level_indexes[key]
+
+    def has_level(self, level):
+        """Whether decks of a level exist (None is the app's own level)"""
+        return level is None or level == self.level or level in self.decks.levels()
+
+    def preload_levels(self, levels=None):
+        """Load the registry decks of some (default: all) levels in parallel"""
+        keys = [(level, sheet_type) for level in (levels or self.decks.levels()) for sheet_type in SHEET_SCHEMAS]
+        return self.decks.preload(keys)
+
+    def get_sentence_index(self, sheet_type, level=None):
+        """Return the precomputed example sentences of a sheet"""
+        deck = self.get_deck(sheet_type, level)
+        return deck.sentences if deck else []
+    
+    def cross_index(self):
+        """Kanji / vocabulary to sentence index over the current decks, rebuilt when any deck was reloaded"""
+        decks = [self.get_deck(sheet_type) for sheet_type in self.sheets_config]
+        index = self._cross_index
+        if index is None or not index.built_from(decks):
+            with self._cross_index_lock:
+                index = self._cross_index
+                if index is None or not index.built_from(decks):
+                    start = time.perf_counter()
+                    index = self._cross_index = CrossIndex(decks)
+                    print(f"🔗 Cross index: {len(index.items)} items over {len(index.sentences)} sentences "
+                          f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return index
+    
+    def get_distractor_pool(self, sheet_type, kind='meaning', level=None):
+        """Return the distractor pool of a sheet ('meaning' or 'sentence')"""
+        deck = self.get_deck(sheet_type, level)
+        return deck.distractors[kind] if deck else DistractorPool()
+    
+    def _grammar_question(self, deck, row):
+        """Build a grammar question dict from a deck row"""
+        # Extract Japanese example sentence only
+        japanese_example = None
+        example = deck.value('example', row, None)
+        if example and example.strip():
+            japanese_example = example.split('\n')[0].strip()
+            
+            if not japanese_example or japanese_example.isspace():
+                japanese_example = example.strip()
+        
+        return {
+            'grammar': deck.value('grammar', row, 'N/A'),
+            'japanese': deck.value('japanese', row, 'N/A'),
+            'correct': deck.value('meaning', row, 'N/A'),
+            'example': japanese_example
+        }
+    
+    @staticmethod
+    def _level_name(level):
+        """Knowledge level as sent to the pages ('none' for items never rated)"""
+        return 'none' if level == 'unseen' else level
+    
+    def prepare_grammar_quiz(self, num_questions=20, user_id=None, level=None):
+        """Pick the grammar points of a new quiz.
+
+        Returns (question count, iterator building each question on demand),
+        or None if there is no grammar data.
+        """
+        deck = self.get_deck('grammar', level)
+        if not deck:
+            print("❌ No data available for grammar questions")
+            return None
+        
+        # Due reviews first, then grammar points weighted towards the weak ones
+        index = self.level_index('grammar', user_id, level)
+        selected_rows = self.select_quiz_rows('grammar', num_questions, user_id, level=level)
+        
+        # If we have fewer grammar points than requested, use all available
+        if len(selected_rows) < num_questions:
+            print(f"⚠️ Only {len(selected_rows)} grammar points available, using all of them")
+        
+        def questions():
+            for row in selected_rows:
+                question = self._grammar_question(deck, row)
+                question['level'] = self._level_name(index.level(row))
+                
+                # Generate options for this question
+                options = self.generate_options(question['correct'], level=level)
+                question['options'] = options
+                
+                yield question
+        
+        return len(selected_rows), questions()
+    
+    def create_grammar_quiz_set(self, num_questions=20, user_id=None, level=None):
+        """Create a set of grammar questions without repeating grammar points"""
+        prepared = self.prepare_grammar_quiz(num_questions, user_id, level)
+        return list(prepared[1]) if prepared else None
+    
+    def prepare_vocabulary_quiz(self, num_questions=20, user_id=None, level=None):
+        """Pick the words of a new quiz.
+
+        Returns (question count, iterator building each question on demand),
+        or None if there are no usable words.
+        """
+        deck = self.get_deck('vocabulary', level)
+        if not deck:
+            print("❌ Vocabulary data not available")
+            return None
+        
+        if deck.problems:
             print("❌ Could not find 'Word' or 'Meaning' columns in Vocabulary sheet.")
             return None
-            
-        # Filter out rows with invalid meanings
-        valid_vocab = vocab_data[vocab_data[meaning_col].notna()]
-        valid_vocab = valid_vocab[~valid_vocab[meaning_col].astype(str).str.strip().str.lower().isin(['', 'nan', 'n/a'])]
-
-        # Filter out 'good' vocabulary
-        good_vocab = [k for k, v in self.vocabulary_knowledge.items() if v == 'good']
-        if good_vocab:
-            original_count = len(valid_vocab)
-            valid_vocab = valid_vocab[~valid_vocab[word_col].isin(good_vocab)]
-            print(f"ℹ️ Filtered out {original_count - len(valid_vocab)} 'good' vocabulary words.")
-
-        if len(valid_vocab) < num_questions:
-            print(f"⚠️ Only {len(valid_vocab)} vocabulary words available, using all of them")
-            num_questions = len(valid_vocab)
         
-        if num_questions == 0:
+        # Due reviews first, then words weighted towards the weak ones
+        index = self.level_index('vocabulary', user_id, level)
+        selected_rows = self.select_quiz_rows('vocabulary', num_questions, user_id, level=level)
+        
+        if len(selected_rows) < num_questions:
+            print(f"⚠️ Only {len(selected_rows)} vocabulary words available, using all of them")
+        
+        if not selected_rows:
             print("❌ No valid vocabulary words found.")
             return None
-
-        selected_vocab = valid_vocab.sample(n=num_questions)
         
-        quiz_set = []
-        for _, row in selected_vocab.iterrows():
-            correct_meaning = row[meaning_col]
-            word = row.get(word_col, 'N/A')
-            
-            question = {
-                'word': word,
-                'correct': correct_meaning,
-                'level': self.vocabulary_knowledge.get(word, 'none')
-            }
-            
-            quiz_set.append(question)
+        def questions():
+            for row in selected_rows:
+                correct = deck.value('meaning', row)
+                yield {
+                    'word': deck.key(row),
+                    'correct': correct,
+                    'options': self.generate_vocabulary_options(correct, level=level),
+                    'level': self._level_name(index.level(row))
+                }
         
-        return quiz_set
+        return len(selected_rows), questions()
+    
+    def create_vocabulary_quiz_set(self, num_questions=20, user_id=None, level=None):
+        """Create a set of vocabulary questions without repeating words."""
+        prepared = self.prepare_vocabulary_quiz(num_questions, user_id, level)
+        return list(prepared[1]) if prepared else None
 
-    def generate_vocabulary_options(self, correct_answer):
+    def _build_pooled_quiz(self, key):
+        deck_type, user_id, num_questions, level = key
+        if deck_type == 'grammar':
+            return self.create_grammar_quiz_set(num_questions, user_id, level)
+        return self.create_vocabulary_quiz_set(num_questions, user_id, level)
+    
+    def take_quiz_set(self, deck_type, num_questions=20, user_id=None, level=None):
+        """A quiz set from the pre-generated pool, built on the spot when the pool is cold"""
+        quiz_set = self.quiz_pool.take((deck_type, user_id or DEFAULT_USER, num_questions, level))
+        if quiz_set is None:
+            quiz_set = self._build_pooled_quiz((deck_type, user_id, num_questions, level))
+        return quiz_set
+    
+    def prepare_quiz(self, deck_type, num_questions=20, user_id=None, level=None):
+        """Like prepare_*_quiz, but serving a pre-generated quiz set when one is ready"""
+        quiz_set = self.quiz_pool.take((deck_type, user_id or DEFAULT_USER, num_questions, level))
+        if quiz_set is not None:
+            return len(quiz_set), iter(quiz_set)
+        if deck_type == 'grammar':
+            return self.prepare_grammar_quiz(num_questions, user_id, level)
+        return self.prepare_vocabulary_quiz(num_questions, user_id, level)
+    
+    def warm_quiz_pools(self, user_id=None):
+        """Start pre-generating default-length quizzes for every quiz deck"""
+        for deck_type in QUIZ_ITEM_FIELDS:
+            if self.get_deck(deck_type) is not None:
+                self.quiz_pool.refill((deck_type, user_id or DEFAULT_USER, DEFAULT_QUIZ_QUESTIONS, None))
+    
+    def generate_vocabulary_options(self, correct_answer, rank=None, level=None):
         """Generate 3 wrong multiple choice options for a vocabulary question."""
-        if 'vocabulary' not in self.sheets_config or not self.sheets_config['vocabulary']['loaded']:
+        if not self.get_deck('vocabulary', level):
             return []
             
-        vocab_data = self.sheets_config['vocabulary']['data']
-        meaning_col = next((col for col in vocab_data.columns if col.strip().lower() in ['meaning', '意味', 'english']), None)
-        
-        if not meaning_col:
-            return []
-
-        # Get a pool of valid wrong answers
-        valid_options = vocab_data[vocab_data[meaning_col].notna()]
-        valid_options = valid_options[~valid_options[meaning_col].astype(str).str.strip().str.lower().isin(['', 'nan', 'n/a', correct_answer.lower()])]
-
-        wrong_answers = []
-        if len(valid_options) >= 3:
-            wrong_answers = valid_options.sample(n=3)[meaning_col].tolist()
+        # Draw wrong answers from the vocabulary meaning pool
+        wrong_answers = self.get_distractor_pool('vocabulary', level=level).sample(3, exclude=correct_answer, rank=rank)
 
         # Fallback to generic answers if needed
         generic_answers = ["I don't know", "A type of food", "An action", "A place"]
@@ -338,114 +1164,55 @@ class JLPTWebApp:
 
     def parse_example_sentences(self, example_text):
         """Parse example sentences and their translations"""
-        if not example_text or str(example_text) == 'nan':
-            return []
-        
-        sentences = []
-        lines = str(example_text).split('\n')
-        
-        for i in range(0, len(lines), 2):
-            if i + 1 < len(lines):
-                japanese = lines[i].strip()
-                english = lines[i + 1].strip()
-                if japanese and english:
-                    sentences.append({
-                        'japanese': japanese,
-                        'english': english
-                    })
-        
-        return sentences
+        return parse_example_sentences(example_text)
     
-    def get_random_grammar_question(self):
-        """Get a random grammar question from cached DataFrame"""
-        if self.data is None or self.data.empty:
+    def get_random_grammar_question(self, level=None):
+        """Get a random grammar question from the grammar deck"""
+        deck = self.get_deck('grammar', level)
+        if not deck:
             print("❌ No data available for grammar questions")
             return None
         
-        row = self.data.sample(n=1).iloc[0]
-        
-        # Try different possible column names for examples
-        example = None
-        possible_example_columns = ['Example Senstence', 'Example Sentence', 'Example', 'Examples', 'Sentence', 'Sentences']
-        
-        for col_name in possible_example_columns:
-            if col_name in self.data.columns:
-                example = row.get(col_name, None)
-                if example and str(example) != 'nan' and str(example).strip():
-                    break
-        
-        # Extract Japanese example sentence only
-        japanese_example = None
-        if example:
-            example_str = str(example)
-            example_lines = example_str.split('\n')
-            japanese_example = example_lines[0].strip()
-            
-            if not japanese_example or japanese_example.isspace():
-                japanese_example = example_str.strip()
-        
-        return {
-            'grammar': row.get('Grammar Lesson', 'N/A'),
-            'japanese': row.get('文法レッスン', 'N/A'),
-            'correct': row.get('Grammar Meaning', 'N/A'),
-            'example': japanese_example
-        }
-    
-    def get_random_sentence_question(self):
-        """Get a random sentence question from cached DataFrame"""
-        if self.data is None or self.data.empty:
-            print("❌ No data available for sentence questions")
+        rows = deck.sample_rows(1)
+        if not rows:
+            print("❌ No valid grammar questions found")
             return None
         
-        # Try different possible column names for examples
-        example_column = None
-        possible_example_columns = ['Example Senstence', 'Example Sentence', 'Example', 'Examples', 'Sentence', 'Sentences']
-        
-        for col_name in possible_example_columns:
-            if col_name in self.data.columns:
-                example_column = col_name
-                break
-        
-        if not example_column:
-            print("❌ No example column found")
-            return None
-        
-        # Get all sentences from all rows
-        all_sentences = []
-        
-        for i, row in self.data.iterrows():
-            example_text = row.get(example_column, '')
-            if example_text and str(example_text) != 'nan':
-                sentences = self.parse_example_sentences(example_text)
-                all_sentences.extend(sentences)
-        
+        return self._grammar_question(deck, rows[0])
+    
+    def get_random_sentence_question(self, level=None):
+        """Get a random sentence question from the precomputed sentence index"""
+        all_sentences = self.get_sentence_index('grammar', level)
         if not all_sentences:
             print("❌ No sentences found in data")
             return None
         
         return random.choice(all_sentences)
     
-    def generate_options(self, correct_answer, is_sentence=False):
-        """Generate 4 multiple choice options from cached DataFrame"""
+    def get_targeted_sentence_question(self, user_id=None, deck_types=('kanji', 'vocabulary')):
+        """A sentence using one of the learner's weak kanji or words, else a random sentence"""
+        index = self.cross_index()
+        candidates = []
+        for deck_type in deck_types:
+            deck = self.get_deck(deck_type)
+            if deck is None:
+                continue
+            # Due reviews, then a draw weighted towards 'dont_know' and often-missed items
+            candidates.extend((deck_type, deck.key(row))
+                              for row in self.select_quiz_rows(deck_type, TARGET_CANDIDATES, user_id))
+        random.shuffle(candidates)
+        
+        for deck_type, item in candidates:
+            sentences = index.sentences_for(item)
+            if sentences:
+                return dict(random.choice(sentences), target=item, target_deck=deck_type)
+        return self.get_random_sentence_question()
+    
+    def generate_options(self, correct_answer, is_sentence=False, rank=None, level=None):
+        """Generate 4 multiple choice options from the grammar distractor pools"""
         if is_sentence:
             # For sentence questions, get other English translations
-            wrong_answers = []
-            example_column = None
-            possible_example_columns = ['Example Senstence', 'Example Sentence', 'Example', 'Examples', 'Sentence', 'Sentences']
-            
-            for col_name in possible_example_columns:
-                if col_name in self.data.columns:
-                    example_column = col_name
-                    break
-            
-            if example_column:
-                for _, row in self.data.iterrows():
-                    example_text = row.get(example_column, '')
-                    sentences = self.parse_example_sentences(example_text)
-                    for sentence in sentences:
-                        english = sentence['english']
-                        if english and english != correct_answer and len(wrong_answers) < 5:
-                            wrong_answers.append(english)
+            wrong_answers = self.get_distractor_pool('grammar', 'sentence', level).sample(3, exclude=correct_answer, rank=rank)
             
             generic_answers = ["I don't know", "It's difficult", "Please help me", "I understand"]
             while len(wrong_answers) < 3:
@@ -454,13 +1221,7 @@ class JLPTWebApp:
                     wrong_answers.append(generic)
         else:
             # For grammar questions, get wrong answers from other grammar points
-            wrong_answers = []
-            sample = self.data.sample(n=min(10, len(self.data)))
-            
-            for _, row in sample.iterrows():
-                meaning = row.get('Grammar Meaning', '')
-                if meaning and meaning != correct_answer and len(wrong_answers) < 3:
-                    wrong_answers.append(meaning)
+            wrong_answers = self.get_distractor_pool('grammar', level=level).sample(3, exclude=correct_answer, rank=rank)
             
             generic = ["to do something", "because of", "in order to", "while doing"]
             while len(wrong_answers) < 3:
@@ -471,93 +1232,45 @@ class JLPTWebApp:
         random.shuffle(options)
         return options
 
-    def get_random_kanji_question(self):
-        """Get a random kanji question from kanji sheet, ensuring it has a valid meaning."""
-        if 'kanji' not in self.sheets_config or not self.sheets_config['kanji']['loaded']:
+    def get_random_kanji_question(self, user_id=None, level=None):
+        """Get a random kanji question from the kanji deck, ensuring it has a valid meaning."""
+        deck = self.get_deck('kanji', level)
+        if not deck:
             print("❌ Kanji data not available")
             return None
-        
-        data = self.sheets_config['kanji']['data']
-        if data is None or data.empty:
-            print("❌ No kanji data available")
-            return None
 
-        # Find the meaning column to filter by
-        meaning_column = None
-        possible_meaning_columns = ['Meaning', 'English', 'Translation', '意味', 'Definition', 'Kanji Meaning']
-        for col_name in possible_meaning_columns:
-            if col_name in data.columns:
-                meaning_column = col_name
-                break
-        
-        if not meaning_column:
+        if not deck.has('meaning'):
             print("❌ No meaning column found in kanji sheet")
             return None
 
-        # Filter out rows that have invalid meanings (NaN, 'N/A', or empty)
-        valid_rows = data[data[meaning_column].notna()]
-        valid_rows = valid_rows[~valid_rows[meaning_column].astype(str).str.strip().str.lower().isin(['', 'nan', 'n/a'])]
-
-        if valid_rows.empty:
-            print("❌ No valid kanji questions with meanings found after cleaning.")
-            return None
-
-        # --- Knowledge-based filtering ---
-        good_kanji = [k for k, v in self.kanji_knowledge.items() if v == 'good']
-        if good_kanji:
-            # Filter out the kanji marked as 'good'
-            original_count = len(valid_rows)
-            valid_rows = valid_rows[~valid_rows[meaning_column].isin(good_kanji)]
-            print(f"ℹ️ Filtered out {original_count - len(valid_rows)} 'good' kanji from quiz pool.")
+        # --- Knowledge-based selection: a due review, else a kanji weighted towards the weak ones ---
+        index = self.level_index('kanji', user_id, level)
+        rows = self.select_quiz_rows('kanji', 1, user_id, due_window=DUE_WINDOW, level=level)
 
-        if valid_rows.empty:
+        if not rows:
             print("❌ No valid kanji questions with meanings found after cleaning and filtering.")
             # Optional: a message to the user that they've learned everything
             # or reset the 'good' list if they want to practice again.
             return None
 
-        # Now, safely sample a random row from the cleaned data
-        row = valid_rows.sample(n=1).iloc[0]
-        
-        kanji_column = next((col for col in ['Kanji', '漢字', 'Character', '字'] if col in data.columns), None)
-        onyomi_column = next((col for col in ['Onyomi', '音読み', 'On Reading', 'On'] if col in data.columns), None)
-        kunyomi_column = next((col for col in ['Kunyomi', '訓読み', 'Kun Reading', 'Kun'] if col in data.columns), None)
-        
-        kanji_char = row.get(kanji_column, 'N/A')
-        current_level = self.kanji_knowledge.get(kanji_char, 'none')
+        row = rows[0]
+        kanji_char = deck.value('kanji', row, 'N/A')
+        current_level = self._level_name(index.level(row))
         
         return {
             'kanji': kanji_char,
-            'meaning': row.get(meaning_column),  # No default needed, as we've already filtered
-            'onyomi': row.get(onyomi_column, '') if onyomi_column else '',
-            'kunyomi': row.get(kunyomi_column, '') if kunyomi_column else '',
+            'meaning': deck.value('meaning', row),
+            'onyomi': deck.value('onyomi', row),
+            'kunyomi': deck.value('kunyomi', row),
             'level': current_level
         }
     
-    def generate_kanji_options(self, correct_answer, question_type='meaning'):
-        """Generate wrong options for kanji questions from a clean data pool."""
-        if 'kanji' not in self.sheets_config or not self.sheets_config['kanji']['loaded']:
+    def generate_kanji_options(self, correct_answer, question_type='meaning', rank=None, level=None):
+        """Generate wrong options for kanji questions from the kanji meaning pool."""
+        if not self.get_deck('kanji', level):
             return []
         
-        data = self.sheets_config['kanji']['data']
-        wrong_answers = []
-        
-        # Find the correct meaning column
-        meaning_column = None
-        possible_meaning_columns = ['Meaning', 'English', 'Translation', '意味', 'Definition', 'Kanji Meaning']
-        for col_name in possible_meaning_columns:
-            if col_name in data.columns:
-                meaning_column = col_name
-                break
-        
-        if meaning_column:
-            # Filter the entire dataset to get a pool of valid wrong answers, excluding the correct answer
-            valid_options = data[data[meaning_column].notna()]
-            valid_options = valid_options[~valid_options[meaning_column].astype(str).str.strip().str.lower().isin(['', 'nan', 'n/a', correct_answer.lower()])]
-            
-            # If there are enough valid options, sample from them
-            if len(valid_options) >= 3:
-                wrong_answers = valid_options.sample(n=3)[meaning_column].tolist()
+        wrong_answers = self.get_distractor_pool('kanji', level=level).sample(3, exclude=correct_answer, rank=rank)
 
         # Fallback to generic answers only if we couldn't get enough real ones
         generic_answers = [
@@ -575,39 +1288,13 @@ class JLPTWebApp:
         
         return wrong_answers[:3]
 
-    def get_random_kanji_sentence_question(self):
-        """Get a random kanji sentence question from example sentences"""
-        if 'kanji' not in self.sheets_config or not self.sheets_config['kanji']['loaded']:
+    def get_random_kanji_sentence_question(self, level=None):
+        """Get a random kanji sentence question from the precomputed sentence index"""
+        if not self.get_deck('kanji', level):
             print("❌ Kanji data not available")
             return None
         
-        data = self.sheets_config['kanji']['data']
-        if data is None or data.empty:
-            print("❌ No kanji data available")
-            return None
-        
-        # Try different possible column names for example sentences
-        example_column = None
-        possible_example_columns = ['Example Sentence', 'Example', 'Sentence', 'Sentences', '例文', 'Example Sentences']
-        
-        for col_name in possible_example_columns:
-            if col_name in data.columns:
-                example_column = col_name
-                break
-        
-        if not example_column:
-            print("❌ No example sentence column found")
-            return None
-        
-        # Get all sentences from all rows
-        all_sentences = []
-        
-        for i, row in data.iterrows():
-            example_text = row.get(example_column, '')
-            if example_text and str(example_text) != 'nan':
-                sentences = self.parse_kanji_example_sentences(example_text)
-                all_sentences.extend(sentences)
-        
+        all_sentences = self.get_sentence_index('kanji', level)
         if not all_sentences:
             print("❌ No sentences found in kanji data")
             return None
@@ -616,58 +1303,31 @@ class JLPTWebApp:
     
     def parse_kanji_example_sentences(self, example_text):
         """Parse kanji example sentences and their translations"""
-        if not example_text or str(example_text) == 'nan':
-            return []
-        
-        sentences = []
-        lines = str(example_text).split('\n')
-        
-        for i in range(0, len(lines), 2):
-            if i + 1 < len(lines):
-                japanese = lines[i].strip()
-                english = lines[i + 1].strip()
-                if japanese and english:
-                    sentences.append({
-                        'japanese': japanese,
-                        'english': english
-                    })
-        
-        return sentences
+        return parse_example_sentences(example_text)
     
-    def check_answer_similarity(self, user_answer, correct_answer):
+    def check_answer_similarity(self, user_answer, correct_answer, fuzzy=None):
         """Check if user answer is similar enough to correct answer"""
-        if not user_answer or not correct_answer:
-            return False
-        
-        # Convert to lowercase for comparison
-        user_lower = user_answer.lower().strip()
-        correct_lower = correct_answer.lower().strip()
-        
-        # Exact match
-        if user_lower == correct_lower:
-            return True
-        
-        # Check if user answer contains key words from correct answer
-        correct_words = set(correct_lower.split())
-        user_words = set(user_lower.split())
-        
-        # Remove common words that don't add meaning
-        common_words = {'the', 'a', 'an', 'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should', 'may', 'might', 'can', 'of', 'in', 'on', 'at', 'to', 'for', 'with', 'by', 'from', 'up', 'down', 'out', 'off', 'over', 'under', 'and', 'or', 'but', 'so', 'because', 'if', 'then', 'else', 'when', 'where', 'why', 'how', 'what', 'which', 'who', 'whom', 'whose'}
-        
-        correct_key_words = correct_words - common_words
-        user_key_words = user_words - common_words
-        
-        # If user has at least 50% of the key words, consider it correct
-        if len(correct_key_words) > 0:
-            matching_words = correct_key_words.intersection(user_key_words)
-            similarity_ratio = len(matching_words) / len(correct_key_words)
-            return similarity_ratio >= 0.5
-        
-        # Fallback: check if user answer is a substring of correct answer or vice versa
-        return user_lower in correct_lower or correct_lower in user_lower
+        return self.grader.grade(user_answer, correct_answer, fuzzy)
 
 # Initialize the JLPT app
+imports_done = time.perf_counter()
 jlpt_app = JLPTWebApp()
+jlpt_app.record_phase('imports', IMPORT_STARTED, imports_done)
+jlpt_app.record_phase('init', imports_done)
+
+@app.after_request
+def note_first_request(response):
+    """Time to first request, for the startup report"""
+    jlpt_app.note_first_request()
+    return response
+
+def current_user_id():
+    """Learner making the request: ?user=<id> (remembered in the session), X-User-Id, or the default user"""
+    user_id = request.args.get('user')
+    if user_id:
+        session['user_id'] = user_id
+        return user_id
+    return request.headers.get('X-User-Id') or session.get('user_id') or DEFAULT_USER
 
 @app.route('/')
 def index():
@@ -697,7 +1357,7 @@ def vocabulary_quiz():
 @app.route('/grammar-knowledge')
 def grammar_knowledge():
     """Page to display categorized grammar knowledge."""
-    knowledge = jlpt_app.grammar_knowledge
+    knowledge = jlpt_app.knowledge('grammar', current_user_id())
     categorized = {
         'good': [k for k, v in knowledge.items() if v == 'good'],
         'medium': [k for k, v in knowledge.items() if v == 'medium'],
@@ -708,7 +1368,7 @@ def grammar_knowledge():
 @app.route('/vocabulary-knowledge')
 def vocabulary_knowledge():
     """Page to display categorized vocabulary knowledge."""
-    knowledge = jlpt_app.vocabulary_knowledge
+    knowledge = jlpt_app.knowledge('vocabulary', current_user_id())
     categorized = {
         'good': [k for k, v in knowledge.items() if v == 'good'],
         'medium': [k for k, v in knowledge.items() if v == 'medium'],
@@ -719,7 +1379,7 @@ def vocabulary_knowledge():
 @app.route('/kanji-knowledge')
 def kanji_knowledge():
     """Page to display categorized kanji knowledge."""
-    knowledge = jlpt_app.kanji_knowledge
+    knowledge = jlpt_app.knowledge('kanji', current_user_id())
     
     categorized = {
         'good': [k for k, v in knowledge.items() if v == 'good'],
@@ -735,11 +1395,15 @@ def get_grammar_question():
     if not jlpt_app.data_loaded:
         return jsonify({'error': 'Data not loaded. Please restart the app.'}), 500
     
-    question = jlpt_app.get_random_grammar_question()
+    level = requested_level()
+    if not jlpt_app.has_level(level):
+        return unknown_level(level)
+    
+    question = jlpt_app.get_random_grammar_question(level)
     if not question:
         return jsonify({'error': 'No questions available'}), 404
     
-    options = jlpt_app.generate_options(question['correct'])
+    options = jlpt_app.generate_options(question['correct'], level=level)
     
     return jsonify({
         'grammar': question['grammar'],
@@ -749,21 +1413,206 @@ def get_grammar_question():
         'correct': question['correct']
     })
 
+def requested_level():
+    """Level asked for with ?level= (e.g. n5); None stands for the app's own decks"""
+    level = request.args.get('level', '').strip().lower()
+    return None if not level or level == jlpt_app.level else level
+
+def unknown_level(level):
+    return jsonify({'error': f'Unknown level: {level}', 'levels': [jlpt_app.level] + jlpt_app.decks.levels()}), 400
+
+def requested_quiz_size():
+    """Number of questions asked for with ?count=, within [1, MAX_QUIZ_QUESTIONS]"""
+    count = request.args.get('count', DEFAULT_QUIZ_QUESTIONS, type=int)
+    return max(1, min(count, MAX_QUIZ_QUESTIONS))
+
+def active_quiz(kind):
+    """Server-side state of the session's current quiz of a kind ('grammar' / 'vocabulary')"""
+    return jlpt_app.quiz_sessions.get(session.get(f'{kind}_quiz_id'))
+
+def record_answers(kind, quiz_id, quiz, graded, latencies=None):
+    """Store graded answers ({question_index: correct}) of a quiz and recompute its score.
+
+    First answers to a question are also logged, with their latency
+    ({question_index: ms}) when the page measured it, and feed the learner's
+    per-item error rates. Returns the updated quiz, or None if it expired
+    in the meantime (nothing is recorded then).
+    """
+    answers = dict(quiz.get('answers', {}))
+    item_field = QUIZ_ITEM_FIELDS[kind]
+    first = {quiz['quiz_set'][question_index][item_field]: is_correct
+             for question_index, is_correct in graded.items() if str(question_index) not in answers}
+    item_latencies = {quiz['quiz_set'][question_index][item_field]: latency
+                      for question_index, latency in (latencies or {}).items()}
+    
+    answers.update({str(question_index): is_correct for question_index, is_correct in graded.items()})
+    quiz = jlpt_app.quiz_sessions.update(quiz_id, answers=answers, score=sum(answers.values()))
+    if quiz is not None:
+        jlpt_app.record_results(kind, first, current_user_id(), item_latencies)
+    return quiz
+
+def expired_quiz():
+    return jsonify({'error': 'The quiz has expired. Please start a new quiz.'}), 400
+
+def unknown_knowledge_level(level):
+    return jsonify({'error': f'Unknown knowledge level: {level}', 'levels': list(KNOWLEDGE_LEVELS)}), 400
+
+def answer_latency(data, question_index):
+    """{question_index: ms} from the optional 'latency_ms' of a submitted answer"""
+    latency = data.get('latency_ms')
+    return {question_index: latency} if isinstance(latency, (int, float)) else None
+
+def quiz_bundle(kind, prepared, public_fields):
+    """Start a quiz and return all of its questions in one response.
+
+    With ?stream=ndjson the response is newline-delimited JSON: one line with
+    the question count, then one line per question as soon as it is built.
+    """
+    if not prepared:
+        return jsonify({'error': 'No questions available'}), 404
+    total, questions = prepared
+    
+    state = {'quiz_set': [], 'score': 0, 'answers': {}}
+    quiz_id = jlpt_app.quiz_sessions.create(state)
+    session[f'{kind}_quiz_id'] = quiz_id
+    
+    def generate(save_each=False):
+        for question_index, question in enumerate(questions):
+            state['quiz_set'].append(question)
+            if save_each:
+                # The page can answer a question before the stream ends, possibly on another worker:
+                # only add the question, keeping answers already stored
+                jlpt_app.quiz_sessions.update(quiz_id, quiz_set=state['quiz_set'])
+            public = {field: question.get(field) for field in public_fields}
+            public['question_index'] = question_index
+            yield public
+        if not save_each:
+            jlpt_app.quiz_sessions.save(quiz_id, state)
+    
+    if request.args.get('stream') == 'ndjson':
+        def stream():
+            yield json.dumps({'total_questions': total}, ensure_ascii=False) + '\n'
+            for public in generate(save_each=True):
+                yield json.dumps(public, ensure_ascii=False) + '\n'
+        return Response(stream(), mimetype='application/x-ndjson')
+    
+    return jsonify({'total_questions': total, 'questions': list(generate())})
+
+def submit_quiz_answers(kind):
+    """Grade a batch of answers of the session's quiz and apply their knowledge levels together.
+
+    Expects {'answers': [{'question_index', 'answer', 'level'}, ...]}; 'answer'
+    and 'level' are both optional, so levels of unanswered questions can be sent too.
+    """
+    quiz_id = session.get(f'{kind}_quiz_id')
+    quiz = active_quiz(kind)
+    if not quiz:
+        return jsonify({'error': 'No active quiz. Please start a new quiz.'}), 400
+    quiz_set = quiz['quiz_set']
+    
+    data = request.get_json() or {}
+    entries = data.get('answers')
+    if not isinstance(entries, list):
+        return jsonify({'error': 'Missing answers list'}), 400
+    
+    graded, levels, latencies, results = {}, {}, {}, []
+    for entry in entries:
+        if not isinstance(entry, dict):
+            return jsonify({'error': 'Each answer must be an object'}), 400
+        question_index = entry.get('question_index')
+        if (not isinstance(question_index, int) or isinstance(question_index, bool)
+                or question_index < 0 or question_index >= len(quiz_set)):
+            return jsonify({'error': f'Invalid question index: {question_index}'}), 400
+        if entry.get('level') is not None and entry['level'] not in KNOWLEDGE_LEVELS:
+            return unknown_knowledge_level(entry['level'])
+        
+        question = quiz_set[question_index]
+        if entry.get('level'):
+            levels[question[QUIZ_ITEM_FIELDS[kind]]] = entry['level']
+        if 'answer' not in entry:
+            # Only a knowledge level for this question
+            continue
+        
+        is_correct = str(entry['answer']).strip() == question['correct']
+        graded[question_index] = is_correct
+        if isinstance(entry.get('latency_ms'), (int, float)):
+            latencies[question_index] = entry['latency_ms']
+        results.append({
+            'question_index': question_index,
+            'correct': is_correct,
+            'correct_answer': question['correct']
+        })
+    
+    quiz = record_answers(kind, quiz_id, quiz, graded, latencies)
+    if quiz is None:
+        return expired_quiz()
+    if levels:
+        jlpt_app.set_knowledge_levels(kind, levels, current_user_id())
+    
+    return jsonify({
+        'results': results,
+        'score': quiz['score'],
+        'answered': len(quiz['answers']),
+        'total_questions': len(quiz_set)
+    })
+
+@app.route('/api/grammar-quiz-bundle')
+def grammar_quiz_bundle():
+    """API endpoint to start a grammar quiz and get every question (with options) at once"""
+    if not jlpt_app.data_loaded:
+        return jsonify({'error': 'Data not loaded. Please restart the app.'}), 500
+    
+    level = requested_level()
+    if not jlpt_app.has_level(level):
+        return unknown_level(level)
+    
+    prepared = jlpt_app.prepare_quiz('grammar', requested_quiz_size(), current_user_id(), level)
+    return quiz_bundle('grammar', prepared, ('grammar', 'japanese', 'example', 'options', 'correct', 'level'))
+
+@app.route('/api/submit-grammar-answers', methods=['POST'])
+def submit_grammar_answers():
+    """API endpoint to grade several grammar answers in one request"""
+    if not jlpt_app.data_loaded:
+        return jsonify({'error': 'Data not loaded. Please restart the app.'}), 500
+    return submit_quiz_answers('grammar')
+
+@app.route('/api/vocabulary-quiz-bundle')
+def vocabulary_quiz_bundle():
+    """API endpoint to start a vocabulary quiz and get every question (with options) at once"""
+    if not jlpt_app.data_loaded:
+        return jsonify({'error': 'Data not loaded. Please restart the app.'}), 500
+    
+    level = requested_level()
+    if not jlpt_app.has_level(level):
+        return unknown_level(level)
+    
+    prepared = jlpt_app.prepare_quiz('vocabulary', requested_quiz_size(), current_user_id(), level)
+    return quiz_bundle('vocabulary', prepared, ('word', 'options', 'correct', 'level'))
+
+@app.route('/api/submit-vocabulary-answers', methods=['POST'])
+def submit_vocabulary_answers():
+    """API endpoint to grade several vocabulary answers in one request"""
+    if not jlpt_app.data_loaded:
+        return jsonify({'error': 'Data not loaded. Please restart the app.'}), 500
+    return submit_quiz_answers('vocabulary')
+
 @app.route('/api/start-grammar-quiz')
 def start_grammar_quiz():
     """API endpoint to start a new grammar quiz set"""
     if not jlpt_app.data_loaded:
         return jsonify({'error': 'Data not loaded. Please restart the app.'}), 500
     
-    # Create a new quiz set of 20 questions
-    quiz_set = jlpt_app.create_grammar_quiz_set(20)
+    level = requested_level()
+    if not jlpt_app.has_level(level):
+        return unknown_level(level)
+    
+    # Create a new quiz set (20 questions unless ?count= says otherwise)
+    quiz_set = jlpt_app.take_quiz_set('grammar', requested_quiz_size(), current_user_id(), level)
     if not quiz_set:
         return jsonify({'error': 'No questions available'}), 404
     
-    # Store quiz set in session
-    session['grammar_quiz_set'] = quiz_set
-    session['current_question_index'] = 0
-    session['grammar_quiz_score'] = 0
+    # Store quiz set server-side, only its id goes into the session cookie
+    session['grammar_quiz_id'] = jlpt_app.quiz_sessions.create({'quiz_set': quiz_set, 'score': 0, 'answers': {}})
     
     return jsonify({
         'message': 'Quiz started',
@@ -777,17 +1626,18 @@ def get_grammar_quiz_question(question_index):
     if not jlpt_app.data_loaded:
         return jsonify({'error': 'Data not loaded. Please restart the app.'}), 500
     
-    # Check if quiz set exists in session
-    quiz_set = session.get('grammar_quiz_set')
-    if not quiz_set:
+    # Check if quiz set exists for this session
+    quiz = active_quiz('grammar')
+    if not quiz:
         return jsonify({'error': 'No active quiz. Please start a new quiz.'}), 400
+    quiz_set = quiz['quiz_set']
     
     # Check if question index is valid
     if question_index < 0 or question_index >= len(quiz_set):
         return jsonify({'error': 'Invalid question index'}), 400
     
+    # Options were fixed when the quiz was created; serving a question does no deck work
     question = quiz_set[question_index]
-    options = jlpt_app.generate_options(question['correct'])
     
     return jsonify({
         'question_index': question_index,
@@ -809,10 +1659,11 @@ def submit_grammar_answer():
     user_answer = data.get('answer', '').strip()
     question_index = data.get('question_index', 0)
     
-    # Check if quiz set exists in session
-    quiz_set = session.get('grammar_quiz_set')
-    if not quiz_set:
+    # Check if quiz set exists for this session
+    quiz = active_quiz('grammar')
+    if not quiz:
         return jsonify({'error': 'No active quiz. Please start a new quiz.'}), 400
+    quiz_set = quiz['quiz_set']
     
     # Check if question index is valid
     if question_index < 0 or question_index >= len(quiz_set):
@@ -822,8 +1673,10 @@ def submit_grammar_answer():
     is_correct = user_answer == question['correct']
     
     # Update score
-    if is_correct:
-        session['grammar_quiz_score'] = session.get('grammar_quiz_score', 0) + 1
+    quiz = record_answers('grammar', session['grammar_quiz_id'], quiz, {question_index: is_correct},
+                          answer_latency(data, question_index))
+    if quiz is None:
+        return expired_quiz()
     
     # Check if this is the last question
     is_last_question = question_index == len(quiz_set) - 1
@@ -831,7 +1684,7 @@ def submit_grammar_answer():
     response = {
         'correct': is_correct,
         'correct_answer': question['correct'],
-        'score': session['grammar_quiz_score'],
+        'score': quiz['score'],
         'total_questions': len(quiz_set),
         'is_last_question': is_last_question
     }
@@ -848,17 +1701,29 @@ def get_sentence_question():
     if not jlpt_app.data_loaded:
         return jsonify({'error': 'Data not loaded. Please restart the app.'}), 500
     
-    question = jlpt_app.get_random_sentence_question()
+    level = requested_level()
+    if not jlpt_app.has_level(level):
+        return unknown_level(level)
+    
+    # Weak-item targeting goes through the cross index, which covers the app's own level
+    if request.args.get('target') == 'weak' and level is None:
+        question = jlpt_app.get_targeted_sentence_question(current_user_id())
+    else:
+        question = jlpt_app.get_random_sentence_question(level)
     if not question:
         return jsonify({'error': 'No sentences available'}), 404
     
-    options = jlpt_app.generate_options(question['english'], is_sentence=True)
+    options = jlpt_app.generate_options(question['english'], is_sentence=True, rank='length', level=level)
     
-    return jsonify({
+    response = {
         'japanese': question['japanese'],
         'options': options,
         'correct': question['english']
-    })
+    }
+    if 'target' in question:
+        response['target'] = question['target']
+        response['target_deck'] = question['target_deck']
+    return jsonify(response)
 
 @app.route('/api/kanji-question')
 def get_kanji_question():
@@ -866,14 +1731,18 @@ def get_kanji_question():
     if not jlpt_app.data_loaded:
         return jsonify({'error': 'Data not loaded. Please restart the app.'}), 500
     
+    level = requested_level()
+    if not jlpt_app.has_level(level):
+        return unknown_level(level)
+    
     # Classic kanji meaning question
-    question = jlpt_app.get_random_kanji_question()
+    question = jlpt_app.get_random_kanji_question(current_user_id(), level)
     if not question:
         return jsonify({'error': 'No kanji available'}), 404
     
     correct_answer = question['meaning']
     question_text = f"What does the kanji {question['kanji']} mean?"
-    options = jlpt_app.generate_kanji_options(correct_answer, 'meaning')
+    options = jlpt_app.generate_kanji_options(correct_answer, 'meaning', level=level)
     
     # Create and shuffle options
     all_options = [correct_answer] + options
@@ -902,7 +1771,7 @@ def check_kanji_answer():
     if not user_answer or not correct_answer:
         return jsonify({'error': 'Missing answer or correct answer'}), 400
     
-    is_correct = jlpt_app.check_answer_similarity(user_answer, correct_answer)
+    is_correct = jlpt_app.check_answer_similarity(user_answer, correct_answer, data.get('fuzzy'))
     
     return jsonify({
         'correct': is_correct,
@@ -910,6 +1779,122 @@ def check_kanji_answer():
         'correct_answer': correct_answer
     })
 
+@app.route('/api/check-kanji-answers', methods=['POST'])
+def check_kanji_answers():
+    """API endpoint to grade many sentence answers in one call.
+
+    Expects {'answers': [{'answer', 'correct'}, ...], 'fuzzy': optional bool}.
+    """
+    if not jlpt_app.data_loaded:
+        return jsonify({'error': 'Data not loaded. Please restart the app.'}), 500
+    
+    data = request.get_json() or {}
+    entries = data.get('answers') if isinstance(data, dict) else None
+    if not isinstance(entries, list):
+        return jsonify({'error': 'Missing answers list'}), 400
+    if len(entries) > MAX_GRADE_BATCH:
+        return jsonify({'error': f'At most {MAX_GRADE_BATCH} answers per call'}), 400
+    if not all(isinstance(entry, dict) for entry in entries):
+        return jsonify({'error': 'Each answer must be an object'}), 400
+    
+    pairs = [(str(entry.get('answer', '')).strip(), str(entry.get('correct', '')).strip()) for entry in entries]
+    graded = jlpt_app.grader.grade_many(pairs, data.get('fuzzy'))
+    
+    return jsonify({'results': [
+        {'correct': is_correct, 'user_answer': user_answer, 'correct_answer': correct_answer}
+        for (user_answer, correct_answer), is_correct in zip(pairs, graded)
+    ]})
+
+@app.route('/api/record-kanji-answer', methods=['POST'])
+def record_kanji_answer():
+    """API endpoint to log a kanji answer graded on the page (?level= for another level's kanji)"""
+    data = request.get_json()
+    if not isinstance(data, dict) or not isinstance(data.get('kanji'), str) or not isinstance(data.get('correct'), bool):
+        return jsonify({'error': 'Missing kanji or correct'}), 400
+    
+    level = requested_level()
+    if not jlpt_app.has_level(level):
+        return unknown_level(level)
+    
+    # Only kanji of the loaded deck reach the answer log and statistics
+    kanji = data['kanji']
+    deck = jlpt_app.get_deck('kanji', level)
+    if deck is None or not deck.rows_for(kanji):
+        return jsonify({'error': f'Unknown kanji: {kanji[:20]}'}), 400
+    
+    latency = data.get('latency_ms')
+    latencies = {kanji: latency} if isinstance(latency, (int, float)) else None
+    jlpt_app.record_results('kanji', {kanji: data['correct']}, current_user_id(), latencies)
+    return jsonify({'success': True})
+
+@app.route('/api/search')
+def api_search():
+    """API endpoint to look up kanji, words and grammar: ?q=<text>[&deck=kanji,vocabulary][&limit=20]"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing q'}), 400
+    
+    decks = [deck for deck in request.args.get('deck', '').split(',') if deck] or None
+    unknown = [deck for deck in decks or [] if deck not in jlpt_app.sheets_config]
+    if unknown:
+        return jsonify({'error': f"Unknown deck: {', '.join(unknown)}"}), 400
+    
+    limit = request.args.get('limit', default=20, type=int)
+    limit = max(1, min(limit, MAX_SEARCH_RESULTS))
+    
+    jlpt_app.build_indexes()
+    results = jlpt_app.search_index.search(query, decks, limit)
+    return jsonify({'query': query, 'results': results})
+
+@app.route('/api/sentences')
+def api_sentences():
+    """API endpoint listing the example sentences that use a kanji or word: ?item=議[&limit=20]"""
+    if not jlpt_app.data_loaded:
+        return jsonify({'error': 'Data not loaded. Please restart the app.'}), 500
+    
+    item = request.args.get('item', '').strip()
+    if not item:
+        return jsonify({'error': 'Missing item'}), 400
+    
+    limit = request.args.get('limit', default=20, type=int)
+    limit = max(1, min(limit, MAX_SENTENCE_RESULTS))
+    
+    index = jlpt_app.cross_index()
+    sentences = [{'japanese': sentence['japanese'], 'english': sentence['english'],
+                  'deck': sentence['sheet'], 'source': sentence['source']}
+                 for sentence in index.sentences_for(item, limit)]
+    return jsonify({
+        'item': item,
+        'decks': sorted(index.items.get(item, ())),
+        'count': index.count(item),
+        'sentences': sentences
+    })
+
+@app.route('/api/stats')
+def api_stats():
+    """API endpoint with the learner's answer statistics per deck (?deck= for one deck)"""
+    deck = request.args.get('deck')
+    if deck and deck not in jlpt_app.sheets_config:
+        return jsonify({'error': f'Unknown deck: {deck}'}), 400
+    
+    return jsonify({
+        'user': current_user_id(),
+        'decks': jlpt_app.deck_stats(current_user_id(), [deck] if deck else None)
+    })
+
+@app.route('/api/decks')
+def api_decks():
+    """API endpoint listing the decks of every level: rows, and memory held by the ones loaded on demand"""
+    decks = [{'level': jlpt_app.level, 'type': sheet_type, 'loaded': config['deck'] is not None,
+              'rows': config['deck'].size if config['deck'] is not None else None}
+             for sheet_type, config in jlpt_app.sheets_config.items()]
+    return jsonify({
+        'level': jlpt_app.level,
+        'decks': decks + jlpt_app.decks.describe(),
+        'memory_used': jlpt_app.decks.memory_used(),
+        'memory_limit': jlpt_app.decks.max_bytes
+    })
+
 @app.route('/api/update-kanji-knowledge', methods=['POST'])
 def update_kanji_knowledge():
     """API endpoint to update the knowledge level of a kanji."""
@@ -919,9 +1904,11 @@ def update_kanji_knowledge():
     
     if not kanji or not level:
         return jsonify({'error': 'Missing kanji or level'}), 400
+    if level not in KNOWLEDGE_LEVELS:
+        return unknown_knowledge_level(level)
         
-    jlpt_app.kanji_knowledge[kanji] = level
-    jlpt_app.save_kanji_knowledge()
+    # Written behind by the knowledge store, off the request thread
+    jlpt_app.set_knowledge_level('kanji', kanji, level, current_user_id())
     
     return jsonify({'success': True, 'kanji': kanji, 'level': level})
 
@@ -933,8 +1920,9 @@ def update_grammar_knowledge():
     level = data.get('level')
     if not grammar or not level:
         return jsonify({'error': 'Missing grammar or level'}), 400
-    jlpt_app.grammar_knowledge[grammar] = level
-    jlpt_app.save_grammar_knowledge()
+    if level not in KNOWLEDGE_LEVELS:
+        return unknown_knowledge_level(level)
+    jlpt_app.set_knowledge_level('grammar', grammar, level, current_user_id())
     return jsonify({'success': True, 'grammar': grammar, 'level': level})
 
 @app.route('/api/update-vocabulary-knowledge', methods=['POST'])
@@ -945,8 +1933,9 @@ def update_vocabulary_knowledge():
     level = data.get('level')
     if not word or not level:
         return jsonify({'error': 'Missing word or level'}), 400
-    jlpt_app.vocabulary_knowledge[word] = level
-    jlpt_app.save_vocabulary_knowledge()
+    if level not in KNOWLEDGE_LEVELS:
+        return unknown_knowledge_level(level)
+    jlpt_app.set_knowledge_level('vocabulary', word, level, current_user_id())
     return jsonify({'success': True, 'word': word, 'level': level})
 
 @app.route('/api/start-vocabulary-quiz')
@@ -955,12 +1944,15 @@ def start_vocabulary_quiz():
     if not jlpt_app.data_loaded:
         return jsonify({'error': 'Data not loaded. Please restart the app.'}), 500
     
-    quiz_set = jlpt_app.create_vocabulary_quiz_set(20)
+    level = requested_level()
+    if not jlpt_app.has_level(level):
+        return unknown_level(level)
+    
+    quiz_set = jlpt_app.take_quiz_set('vocabulary', requested_quiz_size(), current_user_id(), level)
     if not quiz_set:
         return jsonify({'error': 'No vocabulary questions available'}), 404
     
-    session['vocabulary_quiz_set'] = quiz_set
-    session['vocabulary_quiz_score'] = 0
+    session['vocabulary_quiz_id'] = jlpt_app.quiz_sessions.create({'quiz_set': quiz_set, 'score': 0, 'answers': {}})
     
     return jsonify({
         'message': 'Quiz started',
@@ -970,20 +1962,19 @@ def start_vocabulary_quiz():
 @app.route('/api/vocabulary-quiz-question/<int:question_index>')
 def get_vocabulary_quiz_question(question_index):
     """API endpoint to get a specific question from the current vocabulary quiz set"""
-    quiz_set = session.get('vocabulary_quiz_set')
+    quiz = active_quiz('vocabulary')
+    quiz_set = quiz['quiz_set'] if quiz else None
     if not quiz_set or question_index < 0 or question_index >= len(quiz_set):
         return jsonify({'error': 'Invalid quiz or question index'}), 400
     
+    # Options were fixed when the quiz was created, so reloading shows the same ones
     question = quiz_set[question_index]
     
-    # Generate options on the fly
-    options = jlpt_app.generate_vocabulary_options(question['correct'])
-    
     return jsonify({
         'question_index': question_index,
         'total_questions': len(quiz_set),
         'word': question['word'],
-        'options': options,
+        'options': question['options'],
         'correct': question['correct']
     })
 
@@ -994,44 +1985,115 @@ def submit_vocabulary_answer():
     user_answer = data.get('answer', '').strip()
     question_index = data.get('question_index', 0)
     
-    quiz_set = session.get('vocabulary_quiz_set')
+    quiz = active_quiz('vocabulary')
+    quiz_set = quiz['quiz_set'] if quiz else None
     if not quiz_set or question_index < 0 or question_index >= len(quiz_set):
         return jsonify({'error': 'Invalid quiz or question index'}), 400
     
     question = quiz_set[question_index]
     is_correct = user_answer == question['correct']
     
-    if is_correct:
-        session['vocabulary_quiz_score'] = session.get('vocabulary_quiz_score', 0) + 1
+    quiz = record_answers('vocabulary', session['vocabulary_quiz_id'], quiz, {question_index: is_correct},
+                          answer_latency(data, question_index))
+    if quiz is None:
+        return expired_quiz()
     
     return jsonify({
         'correct': is_correct,
         'correct_answer': question['correct'],
-        'score': session.get('vocabulary_quiz_score', 0),
+        'score': quiz['score'],
         'total_questions': len(quiz_set),
         'is_last_question': question_index == len(quiz_set) - 1
     })
 
+def is_admin_request():
+    """Admin endpoints need JLPT_ADMIN_TOKEN in X-Admin-Token, or a local request if no token is set"""
+    token = os.environ.get('JLPT_ADMIN_TOKEN')
+    if token:
+        return request.headers.get('X-Admin-Token') == token
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+@app.route('/api/startup')
+def api_startup():
+    """API endpoint with how long each startup phase took, and the time to the first request"""
+    return jsonify({
+        'phases': [{'phase': name, 'ms': round(seconds * 1000, 1)} for name, seconds in jlpt_app.startup_phases],
+        'first_request_ms': round(jlpt_app.first_request_after * 1000, 1) if jlpt_app.first_request_after else None
+    })
+
+@app.route('/api/admin/reload', methods=['POST'])
+def admin_reload():
+    """API endpoint to re-pull the sheets now and swap in whatever changed"""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    if jlpt_app.reload_handler is not None:
+        # Prefork workers: the parent refreshes and restarts the workers one by one
+        jlpt_app.reload_handler()
+        return jsonify({'status': 'Reload scheduled'}), 202
+    
+    changes = jlpt_app.refresh_data()
+    if changes is None:
+        return jsonify({'error': 'Could not fetch sheet data, keeping current data'}), 502
+    
+    return jsonify({
+        'reloaded': {sheet_type: {kind: len(row_ids) for kind, row_ids in diff.items()}
+                     for sheet_type, diff in changes.items()},
+        'last_refresh': jlpt_app.last_refresh
+    })
+
 @app.route('/stats')
 def stats():
     """Statistics page"""
     return render_template('stats.html')
 
 if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='JLPT N3 study web app')
+    parser.add_argument('--offline', action='store_true',
+                        help='serve purely from the local sheet snapshot, never calling the Sheets API')
+    parser.add_argument('--snapshot', default=jlpt_app.snapshot_file,
+                        help='snapshot file (or .json fixture of {sheet_type: values}, which is never overwritten) to start from; '
+                        'one other than the default is loaded in place of the deck file')
+    parser.add_argument('--deck-file', default=jlpt_app.deck_file,
+                        help="compiled deck file, mapped at startup in place of the snapshot ('' disables)")
+    parser.add_argument('--refresh-interval', type=float, default=jlpt_app.refresh_interval,
+                        help='re-pull the sheets every N seconds (0 disables; POST /api/admin/reload refreshes on demand)')
+    parser.add_argument('--preload', default=os.environ.get('JLPT_PRELOAD_LEVELS', ''),
+                        help="comma-separated levels whose decks load in parallel at startup ('all' for every level)")
+    args = parser.parse_args()
+    
     # Load data ONCE when starting the app
     print("🚀 Starting JLPT Web App...")
     print("📋 Initializing data loading...")
     
-    if jlpt_app.authenticate():
-        if jlpt_app.load_data():
-            print("✅ App ready! Data loaded successfully.")
-            print(f"📊 DataFrame shape: {jlpt_app.data.shape}")
-            print("🌐 Starting web server...")
-        else:
-            print("❌ Failed to load data! Check your Google Sheets connection.")
-            exit(1)
-    else:
-        print("❌ Failed to authenticate! Check your credentials.json file.")
+    jlpt_app.deck_file = args.deck_file
+    phase_start = time.perf_counter()
+    source = jlpt_app.load_initial_data(args.snapshot, args.offline)
+    if source is None:
         exit(1)
+    phase_start = jlpt_app.record_phase(f"data ({source})", phase_start)
+    if source == 'deck_file':
+        # Mapped decks serve right away; search and grading indexes are built meanwhile
+        threading.Thread(target=jlpt_app.build_indexes, name='index-build', daemon=True).start()
+    if source != 'sheets' and not args.offline:
+        # Serve from the snapshot right away and check the sheets for changes meanwhile
+        jlpt_app.revalidate_in_background()
+    
+    if not args.offline:
+        jlpt_app.start_refresher(args.refresh_interval)
+    if args.preload:
+        jlpt_app.preload_levels(None if args.preload == 'all' else args.preload.lower().split(','))
+        phase_start = jlpt_app.record_phase('preload', phase_start)
+    jlpt_app.warm_quiz_pools()
+    jlpt_app.record_phase('background start', phase_start)
+    
+    print("✅ App ready! Data loaded successfully.")
+    jlpt_app.startup_report()
+    for sheet_type, config in jlpt_app.sheets_config.items():
+        if config['deck'] is not None:
+            print(f"📊 {sheet_type}: {config['deck'].size} rows")
+    print("🌐 Starting web server...")
     
-    app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
+    app.run(debug=True, host='0.0.0.0', port=5000) 
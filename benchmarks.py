@@ -0,0 +1,263 @@
+"""Micro-benchmarks for the deck representations.
+
+Run with `python benchmarks.py [rows ...]`; no Google credentials are needed,
+decks are generated synthetically in the shape of the Sheets `values` payload.
+"""
+import gc
+import os
+import random
+import sys
+import time
+
+from cross_index import CrossIndex
+from deck_file import compile_deck_file, open_deck_file
+from deck_registry import DeckRegistry, deep_size
+from decks import Deck, LevelIndex
+from grader import AnswerGrader
+from search import SearchIndex
+from sources import open_source
+
+
+# Header of the Grammar sheet, in the column names SHEET_SCHEMAS resolves
+GRAMMAR_HEADER = ['Grammar Lesson', '文法レッスン', 'Grammar Meaning', 'Example Sentence']
+
+
+def make_kanji_values(rows):
+    """Synthetic Kanji sheet payload with `rows` data rows"""
+    header = ['Kanji', 'Meaning', 'Onyomi', 'Kunyomi', 'Example Sentence', 'Notes']
+    values = [header]
+    for i in range(rows):
+        meaning = 'n/a' if i % 50 == 0 else f'meaning {i % 3000}'
+        values.append([chr(0x4e00 + i % 20000), meaning, 'オン', 'くん',
+                       f'{chr(0x4e00 + i % 20000)}の例文です。\nExample sentence {i}.', 'note'])
+    return values
+
+
+def make_grammar_values(rows):
+    """Synthetic Grammar sheet payload with `rows` data rows"""
+    values = [list(GRAMMAR_HEADER)]
+    for i in range(rows):
+        values.append([f'〜文法{i}', f'ぶんぽう{i}', f'grammar meaning {i}', f'例文{i}です。\nExample {i}.'])
+    return values
+
+
+def timed(build):
+    """Return (result, seconds taken by build())"""
+    gc.collect()
+    start = time.perf_counter()
+    result = build()
+    return result, time.perf_counter() - start
+
+
+def measure_latency(fn, repeat=200):
+    """Mean latency of fn() in microseconds"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def bench_decks(rows):
+    import pandas as pd
+
+    values = make_kanji_values(rows)
+
+    frame, frame_build = timed(lambda: pd.DataFrame(values[1:], columns=values[0]))
+    deck, deck_build = timed(lambda: Deck.from_values('kanji', values))
+    frame_bytes = frame.memory_usage(deep=True).sum()
+    column_bytes = deep_size(deck.columns) + deep_size(deck.valid_rows)
+    index_bytes = deep_size(deck.sentences) + deep_size(deck.distractors['meaning'].answers)
+
+    good = {f'meaning {i}' for i in range(0, 3000, 3)}
+
+    def frame_question():
+        # The request path before decks: clean, filter and sample the DataFrame
+        valid = frame[frame['Meaning'].notna()]
+        valid = valid[~valid['Meaning'].astype(str).str.strip().str.lower().isin(['', 'nan', 'n/a'])]
+        valid = valid[~valid['Meaning'].isin(good)]
+        return valid.sample(n=1).iloc[0]
+
+    def deck_question():
+        return deck.sample_rows(1, exclude=lambda row: deck.value('meaning', row) in good)
+
+    index = LevelIndex(deck, [(deck.key(row), 'good') for row in deck.valid_rows[::3]])
+
+    def weighted_quiz():
+        return index.sample(20)
+
+    def deck_options():
+        return deck.distractors['meaning'].sample(3, exclude=random.choice(deck.columns['meaning']))
+
+    print(f"--- {rows} rows ---")
+    print(f"build    DataFrame {frame_build * 1000:8.1f} ms   Deck {deck_build * 1000:8.1f} ms "
+          f"(deck includes schema resolution, cleaning and indexes)")
+    print(f"memory   DataFrame {frame_bytes / 1e6:8.1f} MB   Deck {column_bytes / 1e6:8.1f} MB "
+          f"(+ {index_bytes / 1e6:.1f} MB sentence index and distractor pool)")
+    print(f"question DataFrame {measure_latency(frame_question, 20):8.0f} us   Deck {measure_latency(deck_question, 20):8.0f} us")
+    print(f"options  Deck      {measure_latency(deck_options):8.1f} us")
+    print(f"weighted 20 rows   {measure_latency(weighted_quiz):8.0f} us   "
+          f"one weight update {measure_latency(lambda: index.reweigh(deck.key(7))):6.1f} us")
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def load_app(rows, pool_size=0):
+    """The web app serving a synthetic grammar deck of `rows` rows, without the sheets or the snapshot"""
+    from app import app, jlpt_app
+
+    jlpt_app.snapshot_file = None
+    jlpt_app.knowledge_backend = 'json'
+    jlpt_app.quiz_pool.size = pool_size
+    jlpt_app.compact_decks = True
+    jlpt_app.install_sheet_values('grammar', make_grammar_values(rows))
+    jlpt_app.data_loaded = True
+    return app, jlpt_app
+
+
+def bench_quiz_start(rows, quizzes=100, num_questions=20):
+    """Start-quiz latency when the app builds each quiz on the spot vs pops a pre-generated one"""
+    from app import DEFAULT_USER
+
+    _, web_app = load_app(rows, pool_size=8)
+    # A learner who knows a third of the deck; set on the level index only, so nothing is written to disk
+    index = web_app.level_index('grammar')
+    for row in index.deck.valid_rows[::3]:
+        index.set_level(index.deck.key(row), 'good')
+
+    def latencies(start):
+        samples = []
+        for _ in range(quizzes):
+            begin = time.perf_counter()
+            assert start()
+            samples.append((time.perf_counter() - begin) * 1e6)
+            # Think time between quiz starts, which is when the pool refills
+            time.sleep(0.05)
+        return samples
+
+    # The builder behind /api/start-grammar-quiz on a cold pool: select_quiz_rows, then each question's options
+    direct = latencies(lambda: web_app.create_grammar_quiz_set(num_questions))
+    key = ('grammar', DEFAULT_USER, num_questions, None)
+    web_app.quiz_pool.refill(key)
+    while web_app.quiz_pool.counts().get(key, 0) < web_app.quiz_pool.size:
+        time.sleep(0.01)
+    pooled = latencies(lambda: web_app.take_quiz_set('grammar', num_questions))
+    web_app.quiz_pool.size = 0
+    print(f"start    direct p50 {percentile(direct, 0.5):8.0f} us  p99 {percentile(direct, 0.99):8.0f} us   "
+          f"pooled p50 {percentile(pooled, 0.5):6.0f} us  p99 {percentile(pooled, 0.99):6.0f} us")
+
+
+def bench_grader(answers=20000):
+    """Free-text grading: one reply, and a batch against precompiled vs not yet compiled answers"""
+    correct = [f'I studied Japanese number {i} at the library yesterday.' for i in range(2000)]
+    replies = [(f'yesterday i was studing japanese {i % 2000} in a library', correct[i % 2000]) for i in range(answers)]
+    precompiled, cold = AnswerGrader(), AnswerGrader()
+    precompiled.compile(correct)
+
+    single = measure_latency(lambda: precompiled.grade(*replies[0]), 2000)
+    _, precompiled_batch = timed(lambda: precompiled.grade_many(replies))
+    _, cold_batch = timed(lambda: cold.grade_many(replies))
+    print(f"grade    one reply {single:8.1f} us   batch of {answers}: precompiled {precompiled_batch * 1000:6.0f} ms, "
+          f"compiled on first use {cold_batch * 1000:6.0f} ms")
+
+
+def bench_search(rows):
+    """Search index build time and query latency"""
+    values = make_kanji_values(rows)
+    for position, row in enumerate(values[1:]):
+        row[1] = f'meaning {position}'
+    deck = Deck.from_values('kanji', values)
+    index = SearchIndex()
+    _, build = timed(lambda: index.update_deck(deck))
+    latencies = ', '.join(f"{query!r} {measure_latency(lambda: index.search(query), 50):.0f} us"
+                          for query in ('一', 'on', 'mean', 'ing 299'))
+    print(f"search   build {build * 1000:8.0f} ms   {latencies}")
+
+
+def bench_cross_index(sentences=100000, kanji=2000, words=8000):
+    """Kanji / word to sentence index build over `sentences` example sentences, vs a nested loop"""
+    rng = random.Random(0)
+    characters = [chr(0x4e00 + i) for i in range(kanji)]
+    kanji_deck = Deck.from_values('kanji', [['Kanji', 'Meaning']] + [[char, f'meaning {i}'] for i, char in enumerate(characters)])
+    vocabulary = [''.join(rng.sample(characters, 2)) for _ in range(words)]
+    vocabulary_deck = Deck.from_values('vocabulary', [['Word', 'Meaning']] + [[word, f'word {i}'] for i, word in enumerate(vocabulary)])
+    examples = [[f'〜文法{i}', f'ぶんぽう{i}', f'grammar meaning {i}',
+                 f'{rng.choice(vocabulary)}は{rng.choice(characters)}の例文です。\nExample {i}.'] for i in range(sentences)]
+    grammar_deck = Deck.from_values('grammar', [GRAMMAR_HEADER] + examples)
+
+    index, build = timed(lambda: CrossIndex([grammar_deck, kanji_deck, vocabulary_deck]))
+    sample = grammar_deck.sentences[:1000]
+    items = list(index.items)
+    _, nested = timed(lambda: [[item for item in items if item in sentence['japanese']] for sentence in sample])
+    lookup = measure_latency(lambda: index.sentences_for(characters[7], 20), 1000)
+    print(f"xref     build {build * 1000:8.0f} ms for {len(index.sentences)} sentences x {len(items)} items   "
+          f"nested loop ~{nested * len(index.sentences) / len(sample) * 1000:8.0f} ms   lookup {lookup:.1f} us")
+
+
+def bench_deck_file(rows, file_path='bench_decks.bin'):
+    """Cold start from a compiled deck file vs building the deck from the Sheets payload"""
+    values = make_kanji_values(rows)
+    deck, build = timed(lambda: Deck.from_values('kanji', values))
+    _, compile_time = timed(lambda: compile_deck_file(file_path, {'kanji': deck}))
+    compiled, mapped = timed(lambda: open_deck_file(file_path))
+    mapped_deck = compiled['decks']['kanji']
+    lookup = measure_latency(lambda: mapped_deck.rows_for(mapped_deck.value('kanji', random.randrange(rows))), 2000)
+    os.remove(file_path)
+    print(f"deckfile build {build * 1000:8.0f} ms   compile {compile_time * 1000:6.0f} ms   "
+          f"open {mapped * 1000:6.2f} ms   key lookup {lookup:.1f} us")
+
+
+def write_jmdict(rows, file_path):
+    """A JMdict-shaped XML file of `rows` entries, each with a few senses"""
+    with open(file_path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<JMdict>\n')
+        for i in range(rows):
+            f.write(f'<entry><ent_seq>{i}</ent_seq><k_ele><keb>語{i}</keb></k_ele><r_ele><reb>ご{i}</reb></r_ele>'
+                    f'<sense><pos>&amp;n;</pos><gloss>word {i}</gloss><gloss>term {i}</gloss></sense>'
+                    f'<sense><gloss xml:lang="ger">Wort {i}</gloss></sense></entry>\n')
+        f.write('</JMdict>\n')
+
+
+def bench_import(rows, file_path='bench_jmdict.xml'):
+    """Streaming import of a dictionary file: time and peak memory, which must track the deck, not the file"""
+    import tracemalloc
+
+    write_jmdict(rows, file_path)
+    size = os.path.getsize(file_path)
+    deck, elapsed = timed(lambda: Deck.from_rows('vocabulary', *open_source(file_path)))
+    # A second, traced run: tracing slows the import several times over
+    tracemalloc.start()
+    Deck.from_rows('vocabulary', *open_source(file_path))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    os.remove(file_path)
+    print(f"import   jmdict {size / 1e6:6.1f} MB -> {deck.size} rows in {elapsed * 1000:8.0f} ms   "
+          f"peak {peak / 1e6:6.1f} MB (deck {deep_size(deck.columns) / 1e6:6.1f} MB)")
+
+
+def bench_question_serving(rows, repeat=500):
+    """Latency of serving one question of a running quiz; it must not grow with the deck"""
+    app, _ = load_app(rows)
+    client = app.test_client()
+    # Time the real path, not an error response
+    response = client.get('/api/start-grammar-quiz')
+    assert response.status_code == 200, response.get_json()
+    response = client.get('/api/grammar-quiz-question/3')
+    assert response.status_code == 200, response.get_json()
+    question_latency = measure_latency(lambda: client.get('/api/grammar-quiz-question/3'), repeat)
+    print(f"serve    grammar question {question_latency:8.0f} us")
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+    bench_grader()
+    bench_cross_index()
+    for size in sizes:
+        bench_decks(size)
+        bench_quiz_start(size)
+        bench_search(size)
+        bench_deck_file(size)
+        bench_import(size)
+        bench_question_serving(size)
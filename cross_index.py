@@ -0,0 +1,108 @@
+import collections
+
+
+class PatternMatcher:
+    """Aho-Corasick automaton over a fixed set of patterns.
+
+    Scanning a text costs O(len(text) + matches) however many patterns
+    there are, so every kanji and word of the decks is looked for in one
+    pass over each sentence.
+    """
+
+    __slots__ = ('patterns', '_goto', '_fail', '_pattern', '_output')
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._goto = [{}]        # node -> {char: node}
+        self._pattern = [-1]     # node -> id of the pattern ending there, or -1
+        for pattern_id, pattern in enumerate(self.patterns):
+            node = 0
+            for char in pattern:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = self._goto[node][char] = len(self._goto)
+                    self._goto.append({})
+                    self._pattern.append(-1)
+                node = next_node
+            self._pattern[node] = pattern_id
+
+        # Failure links (longest proper suffix that is also a trie node) and output links
+        # (nearest node on the failure chain that ends a pattern), breadth first
+        self._fail = [0] * len(self._goto)
+        self._output = [0] * len(self._goto)
+        queue = collections.deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[child] = fail
+                self._output[child] = fail if self._pattern[fail] >= 0 else self._output[fail]
+                queue.append(child)
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def matches(self, text):
+        """Ids of the patterns occurring in text"""
+        goto, fail, pattern, output = self._goto, self._fail, self._pattern, self._output
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            hit = node if pattern[node] >= 0 else output[node]
+            # A pattern already found means the rest of its output chain was found with it
+            while hit and pattern[hit] not in found:
+                found.add(pattern[hit])
+                hit = output[hit]
+        return found
+
+
+class CrossIndex:
+    """Every kanji and vocabulary word mapped to the example sentences containing it, across all decks.
+
+    Built in a single pass: one PatternMatcher over all items scans each
+    sentence once. Postings hold sentence positions, in deck order.
+    """
+
+    __slots__ = ('decks', 'sentences', 'items', '_matcher', '_postings')
+
+    def __init__(self, decks):
+        self.decks = tuple(decks)
+        self.sentences = [sentence for deck in self.decks if deck is not None for sentence in deck.sentences]
+
+        # item -> deck types it belongs to (kanji and vocabulary keys)
+        self.items = {}
+        for deck in self.decks:
+            if deck is None or deck.sheet_type not in ('kanji', 'vocabulary'):
+                continue
+            for item in deck.rows_by_key:
+                item = item.strip()
+                if item:
+                    self.items.setdefault(item, set()).add(deck.sheet_type)
+
+        self._matcher = PatternMatcher(self.items)
+        self._postings = [[] for _ in range(len(self._matcher))]
+        for position, sentence in enumerate(self.sentences):
+            for pattern_id in self._matcher.matches(sentence['japanese']):
+                self._postings[pattern_id].append(position)
+        self._postings = dict(zip(self._matcher.patterns, self._postings))
+
+    def built_from(self, decks):
+        """Whether the index was built from exactly these deck objects"""
+        decks = tuple(decks)
+        return len(decks) == len(self.decks) and all(a is b for a, b in zip(decks, self.decks))
+
+    def count(self, item):
+        return len(self._postings.get(item, ()))
+
+    def sentences_for(self, item, limit=None):
+        """Example sentences containing an item, in deck order"""
+        positions = self._postings.get(item, ())
+        if limit is not None:
+            positions = positions[:limit]
+        return [self.sentences[position] for position in positions]
@@ -0,0 +1,414 @@
+"""Compiled deck files: every deck of a spreadsheet in one file that is memory-mapped, not parsed.
+
+Compile one from the sheet snapshot (or a JSON fixture of Sheets payloads)
+or from local source files (see sources.py):
+
+    python deck_file.py decks.bin --snapshot sheets_snapshot.bin
+    python deck_file.py decks.bin --source grammar=grammar.csv --source kanji=kanjidic2.xml
+"""
+import collections.abc
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+from array import array
+
+from decks import SHEET_SCHEMAS, Deck, deck_fingerprints, row_fingerprints
+from distractors import DistractorPool, normalize_answer
+
+# File layout: MAGIC, u32 format version, u32 directory length, the JSON directory,
+# then 8-byte aligned sections. Every section is an array of little-endian u32
+# (string ids, row numbers or offsets) except the utf-8 string data. All strings
+# are stored once, in a table of (offsets, data); columns hold string ids.
+MAGIC = b'JLPTDECK'
+# 2: vocabulary decks keep a reading column; 3: row fingerprints
+FORMAT_VERSION = 3
+PREAMBLE = struct.Struct('<8sII')
+
+
+def _u32(view):
+    """A u32 array over raw bytes, without copying on little-endian machines"""
+    if sys.byteorder == 'little':
+        return view.cast('I')
+    values = array('I', bytes(view))
+    values.byteswap()
+    return values
+
+
+class StringTable:
+    """Strings of a deck file, decoded on access"""
+
+    __slots__ = ('_offsets', '_data')
+
+    def __init__(self, offsets, data):
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, string_id):
+        return str(self._data[self._offsets[string_id]:self._offsets[string_id + 1]], 'utf-8')
+
+
+class StringColumn(collections.abc.Sequence):
+    """A column of string ids, read as the strings they name"""
+
+    __slots__ = ('_table', '_ids')
+
+    def __init__(self, table, ids):
+        self._table = table
+        self._ids = ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self._table[self._ids[index]]
+
+
+class SortedStrings:
+    """Binary search over string ids sorted by the strings they name"""
+
+    __slots__ = ('_table', '_ids')
+
+    def __init__(self, table, ids):
+        self._table = table
+        self._ids = ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return (self._table[string_id] for string_id in self._ids)
+
+    def position(self, text):
+        """Position of text in the sorted ids, or None"""
+        low, high = 0, len(self._ids)
+        while low < high:
+            middle = (low + high) // 2
+            if self._table[self._ids[middle]] < text:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self._ids) and self._table[self._ids[low]] == text:
+            return low
+        return None
+
+
+class MappedRowsByKey(collections.abc.Mapping):
+    """Deck item -> valid rows holding it, looked up by binary search over the sorted keys"""
+
+    __slots__ = ('_keys', '_starts', '_rows')
+
+    def __init__(self, keys, starts, rows):
+        self._keys = keys
+        self._starts = starts
+        self._rows = rows
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __getitem__(self, key):
+        position = self._keys.position(key) if isinstance(key, str) else None
+        if position is None:
+            raise KeyError(key)
+        return self._rows[self._starts[position]:self._starts[position + 1]]
+
+
+class MappedFingerprints(collections.abc.Mapping):
+    """Row id -> fingerprint of a mapped deck, read into a dict the first time a refresh compares them"""
+
+    __slots__ = ('_table', '_ids', '_hashes', '_fingerprints')
+
+    def __init__(self, table, ids, hashes):
+        self._table = table
+        self._ids = ids
+        self._hashes = hashes
+        self._fingerprints = None
+
+    def _load(self):
+        if self._fingerprints is None:
+            self._fingerprints = {self._table[string_id]: value for string_id, value in zip(self._ids, self._hashes)}
+        return self._fingerprints
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __getitem__(self, row_id):
+        return self._load()[row_id]
+
+
+class MappedPositions:
+    """Normalized answer -> position in a distractor pool"""
+
+    __slots__ = ('_keys', '_positions')
+
+    def __init__(self, keys, positions):
+        self._keys = keys
+        self._positions = positions
+
+    def get(self, key, default=None):
+        position = self._keys.position(key)
+        return default if position is None else self._positions[position]
+
+    def __contains__(self, key):
+        return self._keys.position(key) is not None
+
+
+class MappedSentences(collections.abc.Sequence):
+    """Example sentence pairs of a deck, as the dicts Deck.sentences holds"""
+
+    __slots__ = ('_sheet_type', '_table', '_japanese', '_english', '_rows', '_keys')
+
+    def __init__(self, sheet_type, table, japanese, english, rows, keys):
+        self._sheet_type = sheet_type
+        self._table = table
+        self._japanese = japanese
+        self._english = english
+        self._rows = rows
+        self._keys = keys
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        row = self._rows[index]
+        return {
+            'japanese': self._table[self._japanese[index]],
+            'english': self._table[self._english[index]],
+            'sheet': self._sheet_type,
+            'source': self._keys[row] if self._keys is not None else '',
+            'row': row
+        }
+
+
+class _Writer:
+    """Collects the strings and sections of a deck file"""
+
+    def __init__(self):
+        self.strings = {}
+        self.body = bytearray()
+
+    def string_id(self, text):
+        string_id = self.strings.get(text)
+        if string_id is None:
+            string_id = self.strings[text] = len(self.strings)
+        return string_id
+
+    def string_ids(self, texts):
+        return [self.string_id(text) for text in texts]
+
+    def section(self, data):
+        """Append a section (a list of u32 or raw bytes) and return its [offset, length in bytes]"""
+        if not isinstance(data, (bytes, bytearray)):
+            data = array('I', data)
+            if sys.byteorder != 'little':
+                data.byteswap()
+            data = data.tobytes()
+        self.body.extend(b'\0' * (-len(self.body) % 8))
+        offset = len(self.body)
+        self.body.extend(data)
+        return [offset, len(data)]
+
+
+def _deck_directory(writer, deck, fingerprints=None):
+    """Write the sections of one deck and return its directory entry"""
+    fingerprints = fingerprints or {}
+    entry = {
+        'mapping': deck.mapping,
+        'problems': deck.problems,
+        'size': deck.size,
+        'columns': {field: writer.section(writer.string_ids(column)) for field, column in deck.columns.items()},
+        'valid_rows': writer.section(deck.valid_rows),
+        'fingerprints': {'ids': writer.section(writer.string_ids(fingerprints)),
+                         'hashes': writer.section(list(fingerprints.values()))}
+    }
+
+    keys = sorted(deck.rows_by_key)
+    starts, rows = [0], []
+    for key in keys:
+        rows.extend(deck.rows_by_key[key])
+        starts.append(len(rows))
+    entry['rows_by_key'] = {'keys': writer.section(writer.string_ids(keys)), 'starts': writer.section(starts),
+                            'rows': writer.section(rows)}
+
+    sentences = list(deck.sentences)
+    entry['sentences'] = {
+        'japanese': writer.section(writer.string_ids(sentence['japanese'] for sentence in sentences)),
+        'english': writer.section(writer.string_ids(sentence['english'] for sentence in sentences)),
+        'rows': writer.section([sentence['row'] for sentence in sentences])
+    }
+
+    entry['distractors'] = {}
+    for kind, pool in deck.distractors.items():
+        normalized = sorted((normalize_answer(answer), position) for position, answer in enumerate(pool.answers))
+        entry['distractors'][kind] = {
+            'answers': writer.section(writer.string_ids(pool.answers)),
+            'keys': writer.section(writer.string_ids(key for key, _ in normalized)),
+            'positions': writer.section([position for _, position in normalized])
+        }
+    return entry
+
+
+def compile_deck_file(file_path, decks, version=None, sources=None, fingerprints=None):
+    """Atomically write {sheet_type: Deck} to a deck file; returns its size in bytes.
+
+    sources holds the signatures of the local files decks were imported from,
+    so a reader can tell whether the file still matches them. fingerprints
+    ({sheet_type: row_fingerprints()}) lets a refresh after a deck file start
+    diff the sheets row by row.
+    """
+    fingerprints = fingerprints or {}
+    writer = _Writer()
+    sheets = {sheet_type: _deck_directory(writer, deck, fingerprints.get(sheet_type))
+              for sheet_type, deck in decks.items() if deck is not None}
+
+    offsets, data = [0], bytearray()
+    for text in writer.strings:
+        data.extend(text.encode('utf-8'))
+        offsets.append(len(data))
+    directory = {
+        'version': version,
+        'compiled_at': time.time(),
+        'sources': sources or {},
+        'strings': {'offsets': writer.section(offsets), 'data': writer.section(bytes(data))},
+        'sheets': sheets
+    }
+    encoded = json.dumps(directory, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    header = PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(encoded)) + encoded
+    header += b'\0' * (-len(header) % 8)
+
+    # A temp file of its own, so two processes compiling the same deck file never rename each other's
+    directory, name = os.path.split(os.path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f'.{name}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header)
+            f.write(writer.body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return len(header) + len(writer.body)
+
+
+def open_deck_file(file_path):
+    """Map a deck file and return {'version', 'compiled_at', 'sources', 'decks': {sheet_type: Deck}}, or None.
+
+    Nothing is parsed up front: the decks read their columns, indexes and
+    pools straight from the mapped pages, which the OS shares between every
+    process that maps the same file. 'fingerprints' holds the row
+    fingerprints of each deck.
+    """
+    if not file_path or not os.path.exists(file_path):
+        return None
+    try:
+        with open(file_path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, format_version, directory_length = PREAMBLE.unpack_from(mapped, 0)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            print(f"⚠️ {file_path} is not a deck file of format version {FORMAT_VERSION}")
+            return None
+        directory = json.loads(mapped[PREAMBLE.size:PREAMBLE.size + directory_length].decode('utf-8'))
+        body_start = PREAMBLE.size + directory_length
+        body_start += -body_start % 8
+        view = memoryview(mapped)
+
+        def raw(section):
+            offset, length = section
+            return view[body_start + offset:body_start + offset + length]
+
+        def ids(section):
+            return _u32(raw(section))
+
+        table = StringTable(ids(directory['strings']['offsets']), raw(directory['strings']['data']))
+        decks, fingerprints = {}, {}
+        for sheet_type, entry in directory['sheets'].items():
+            fingerprints[sheet_type] = MappedFingerprints(table, ids(entry['fingerprints']['ids']),
+                                                          ids(entry['fingerprints']['hashes']))
+            columns = {field: StringColumn(table, ids(section)) for field, section in entry['columns'].items()}
+            key_field = SHEET_SCHEMAS[sheet_type]['key']
+            rows_by_key = entry['rows_by_key']
+            sentences = entry['sentences']
+            distractors = {
+                kind: DistractorPool.from_parts(
+                    StringColumn(table, ids(pool['answers'])),
+                    MappedPositions(SortedStrings(table, ids(pool['keys'])), ids(pool['positions']))
+                )
+                for kind, pool in entry['distractors'].items()
+            }
+            decks[sheet_type] = Deck.from_parts(
+                sheet_type, columns,
+                valid_rows=ids(entry['valid_rows']),
+                rows_by_key=MappedRowsByKey(SortedStrings(table, ids(rows_by_key['keys'])),
+                                            ids(rows_by_key['starts']), ids(rows_by_key['rows'])),
+                sentences=MappedSentences(sheet_type, table, ids(sentences['japanese']), ids(sentences['english']),
+                                          ids(sentences['rows']), columns.get(key_field)),
+                distractors=distractors,
+                mapping=entry['mapping'],
+                problems=entry['problems'],
+                size=entry['size']
+            )
+        return {'version': directory['version'], 'compiled_at': directory['compiled_at'],
+                'sources': directory.get('sources', {}), 'decks': decks, 'fingerprints': fingerprints}
+    except (OSError, ValueError, KeyError, TypeError, struct.error) as e:
+        print(f"⚠️ Could not read deck file {file_path}: {e}")
+        return None
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from snapshot import load_snapshot, values_version
+    from sources import open_source, parse_source_specs, source_signature
+
+    parser = argparse.ArgumentParser(description='Compile sheet data into a memory-mapped deck file')
+    parser.add_argument('output', help='deck file to write')
+    parser.add_argument('--snapshot', help='sheet snapshot (or .json fixture of {sheet_type: values}) to compile')
+    parser.add_argument('--source', '--csv', action='append', default=[], metavar='TYPE=PATH',
+                        help='CSV / TSV, Anki .apkg or JMdict / KANJIDIC2 .xml file of one sheet type '
+                             '(grammar, kanji or vocabulary), streamed row by row; repeatable')
+    args = parser.parse_args()
+
+    sheets_values = {}
+    if args.snapshot:
+        snapshot = load_snapshot(args.snapshot)
+        if snapshot is None:
+            print(f"❌ No usable snapshot at {args.snapshot}")
+            exit(1)
+        sheets_values.update(snapshot['sheets'])
+    try:
+        sources = parse_source_specs(','.join(args.source))
+    except ValueError as e:
+        parser.error(str(e))
+    if not sheets_values and not sources:
+        parser.error('nothing to compile: pass --snapshot and/or --source')
+
+    start = time.perf_counter()
+    decks = {sheet_type: Deck.from_values(sheet_type, values) for sheet_type, values in sheets_values.items()
+             if values and sheet_type not in sources}
+    fingerprints = {sheet_type: row_fingerprints(sheet_type, sheets_values[sheet_type]) for sheet_type in decks}
+    for sheet_type, (path, header) in sources.items():
+        decks[sheet_type] = Deck.from_rows(sheet_type, *open_source(path, header))
+        fingerprints[sheet_type] = deck_fingerprints(decks[sheet_type])
+    signatures = {sheet_type: source_signature(path, header) for sheet_type, (path, header) in sources.items()}
+    size = compile_deck_file(args.output, decks, values_version(sheets_values), signatures, fingerprints)
+    for deck in decks.values():
+        print(f"📋 {deck.describe()}")
+    print(f"✅ Compiled {args.output} ({size / 1e6:.1f} MB) in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,192 @@
+import collections
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Seconds before a deck whose load failed is tried again
+RETRY_AFTER = 60
+
+
+def deep_size(obj, seen=None):
+    """Approximate bytes held by obj and everything it references, counting shared objects once.
+
+    Follows dicts, lists, tuples, sets and __slots__ attributes, so a Deck is
+    measured with its columns, indexes, sentences and distractor pools.
+    Memory-mapped decks measure small: their pages belong to the page cache.
+    """
+    seen = set() if seen is None else seen
+    stack = [obj]
+    size = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif not isinstance(obj, (str, bytes, int, float)):
+            for cls in type(obj).__mro__:
+                for slot in getattr(cls, '__slots__', ()):
+                    value = getattr(obj, slot, None)
+                    if value is not None:
+                        stack.append(value)
+            if hasattr(obj, '__dict__'):
+                stack.append(obj.__dict__)
+    return size
+
+
+class _Entry:
+    __slots__ = ('loader', 'deck', 'size', 'loaded_at', 'failed_at', 'loads', 'lock')
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.deck = None
+        self.size = 0
+        self.loaded_at = None
+        self.failed_at = None
+        self.loads = 0
+        self.lock = threading.Lock()
+
+
+class DeckRegistry:
+    """Decks keyed by (level, sheet_type), loaded the first time they are asked for.
+
+    Each registered deck has a loader returning a Deck. Loaded decks are
+    measured with deep_size() and kept in least recently used order; once
+    their total passes max_bytes, the decks used longest ago are dropped
+    (and loaded again on their next use), so memory stays bounded however
+    many decks are registered. on_evict(level, sheet_type) lets the owner
+    drop whatever else it derived from an evicted deck.
+    """
+
+    def __init__(self, max_bytes=0, workers=4, on_evict=None):
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.on_evict = on_evict
+        self._entries = {}                              # (level, sheet_type) -> _Entry
+        self._resident = collections.OrderedDict()      # loaded keys, least recently used first
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def register(self, level, sheet_type, loader):
+        """Add (or replace) a deck; a replaced deck is loaded again from the new loader"""
+        with self._lock:
+            self._entries[(level, sheet_type)] = _Entry(loader)
+            self._resident.pop((level, sheet_type), None)
+
+    def levels(self):
+        return sorted({level for level, _ in self._entries})
+
+    def memory_used(self):
+        with self._lock:
+            return sum(self._entries[key].size for key in self._resident)
+
+    def get(self, level, sheet_type):
+        """The deck of a level, loading it on first use; None if it is not registered or failed to load"""
+        key = (level, sheet_type)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        with self._lock:
+            if entry.deck is not None:
+                self._resident.move_to_end(key)
+                return entry.deck
+
+        # One thread loads a deck while the others asking for it wait
+        with entry.lock:
+            if entry.deck is not None:
+                return entry.deck
+            if entry.failed_at is not None and time.time() - entry.failed_at < RETRY_AFTER:
+                return None
+            start = time.perf_counter()
+            try:
+                deck = entry.loader()
+            except Exception as e:
+                print(f"❌ Could not load {level} {sheet_type} deck: {e}")
+                deck = None
+            if deck is None:
+                entry.failed_at = time.time()
+                return None
+            size = deep_size(deck)
+
+            with self._lock:
+                if self._entries.get(key) is not entry:
+                    # Re-registered while loading
+                    return deck
+                entry.deck, entry.size, entry.loaded_at, entry.failed_at = deck, size, time.time(), None
+                entry.loads += 1
+                self._resident[key] = entry
+                evicted = self._evict(keep=key)
+            print(f"📚 Loaded {level} {sheet_type}: {deck.size} rows, {size / 1e6:.1f} MB "
+                  f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        for evicted_key in evicted:
+            print(f"♻️ Evicted {evicted_key[0]} {evicted_key[1]} deck to stay under "
+                  f"{self.max_bytes / 1e6:g} MB")
+            if self.on_evict:
+                self.on_evict(*evicted_key)
+        return deck
+
+    def _evict(self, keep):
+        """Drop least recently used decks (never `keep`) until the loaded ones fit in max_bytes"""
+        evicted = []
+        if not self.max_bytes:
+            return evicted
+        total = sum(entry.size for entry in self._resident.values())
+        for key in list(self._resident):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            entry = self._resident.pop(key)
+            total -= entry.size
+            entry.deck, entry.size = None, 0
+            evicted.append(key)
+        return evicted
+
+    def evict(self, level, sheet_type):
+        """Drop a loaded deck now; it is loaded again on its next use"""
+        key = (level, sheet_type)
+        with self._lock:
+            entry = self._resident.pop(key, None)
+            if entry is None:
+                return False
+            entry.deck, entry.size = None, 0
+        if self.on_evict:
+            self.on_evict(level, sheet_type)
+        return True
+
+    def preload(self, keys=None):
+        """Load several decks in parallel on a thread pool; returns how many are loaded"""
+        keys = list(self._entries) if keys is None else [key for key in keys if key in self._entries]
+        if not keys:
+            return 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(keys))),
+                                thread_name_prefix='deck-load') as executor:
+            loaded = sum(deck is not None for deck in executor.map(lambda key: self.get(*key), keys))
+        print(f"📚 Preloaded {loaded}/{len(keys)} decks in {time.perf_counter() - start:.1f}s "
+              f"({self.memory_used() / 1e6:.1f} MB resident)")
+        return loaded
+
+    def describe(self):
+        """State of every registered deck, for the deck listing endpoint"""
+        with self._lock:
+            return [{
+                'level': level,
+                'type': sheet_type,
+                'loaded': entry.deck is not None,
+                'rows': entry.deck.size if entry.deck is not None else None,
+                'bytes': entry.size,
+                'loads': entry.loads
+            } for (level, sheet_type), entry in sorted(self._entries.items())]
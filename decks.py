@@ -0,0 +1,418 @@
+import random
+import sys
+import zlib
+
+from distractors import DistractorPool, INVALID_ANSWERS
+
+# Canonical columns of each sheet type and the header names they may appear under.
+# Names are matched exactly first, then case-insensitively.
+SHEET_SCHEMAS = {
+    'grammar': {
+        'key': 'grammar',
+        'required': ['grammar', 'meaning'],
+        'columns': {
+            'grammar': ['Grammar Lesson'],
+            'japanese': ['文法レッスン'],
+            'meaning': ['Grammar Meaning'],
+            'example': ['Example Senstence', 'Example Sentence', 'Example', 'Examples', 'Sentence', 'Sentences']
+        }
+    },
+    'kanji': {
+        'key': 'kanji',
+        'required': ['kanji', 'meaning'],
+        'columns': {
+            'kanji': ['Kanji', '漢字', 'Character', '字'],
+            'meaning': ['Meaning', 'English', 'Translation', '意味', 'Definition', 'Kanji Meaning'],
+            'onyomi': ['Onyomi', '音読み', 'On Reading', 'On'],
+            'kunyomi': ['Kunyomi', '訓読み', 'Kun Reading', 'Kun'],
+            'example': ['Example Sentence', 'Example', 'Sentence', 'Sentences', '例文', 'Example Sentences']
+        }
+    },
+    'vocabulary': {
+        'key': 'word',
+        'required': ['word', 'meaning'],
+        'columns': {
+            'word': ['Word', '単語', 'Vocabulary'],
+            'reading': ['Reading', '読み', 'Kana', 'Furigana', 'Hiragana'],
+            'meaning': ['Meaning', '意味', 'English']
+        }
+    }
+}
+
+
+def clean_value(value):
+    """Turn a raw cell into a string, mapping empty cells (None / NaN) to ''"""
+    if value is None or value != value:
+        return ''
+    return str(value)
+
+
+def is_valid_value(value):
+    """Check that a cleaned cell holds a real value (not empty, 'nan' or 'N/A')"""
+    return value.strip().lower() not in INVALID_ANSWERS
+
+
+def parse_example_sentences(example_text):
+    """Parse alternating Japanese / English lines into sentence pairs"""
+    if not example_text or str(example_text) == 'nan':
+        return []
+
+    sentences = []
+    lines = str(example_text).split('\n')
+
+    for i in range(0, len(lines), 2):
+        if i + 1 < len(lines):
+            japanese = lines[i].strip()
+            english = lines[i + 1].strip()
+            if japanese and english:
+                sentences.append({
+                    'japanese': japanese,
+                    'english': english
+                })
+
+    return sentences
+
+
+def resolve_columns(sheet_type, header):
+    """Map the canonical columns of a sheet type onto an actual header row.
+
+    Returns (mapping, problems) where mapping is canonical name -> header name
+    (None if missing) and problems lists the required columns that were not found.
+    """
+    schema = SHEET_SCHEMAS[sheet_type]
+    mapping = {}
+
+    for field, candidates in schema['columns'].items():
+        column = next((name for name in candidates if name in header), None)
+        if column is None:
+            lowered = [name.lower() for name in candidates]
+            column = next((col for name in lowered for col in header if str(col).strip().lower() == name), None)
+        mapping[field] = column
+
+    problems = [f"missing required column '{field}' (tried {', '.join(schema['columns'][field])})"
+                for field in schema['required'] if mapping[field] is None]
+    return mapping, problems
+
+
+def fingerprint(cells):
+    """Hash of a row's cells that is the same in every process, so it can be stored in the deck file"""
+    return zlib.crc32('\x1f'.join(map(str, cells)).encode('utf-8'))
+
+
+def row_fingerprints(sheet_type, values):
+    """Map each row of a Sheets `values` payload to a hash of its cells.
+
+    Rows are identified by their key column (grammar lesson, kanji or word);
+    repeated keys get a '#n' suffix so every row keeps a distinct id.
+    """
+    header = [str(name) for name in values[0]] if values else []
+    mapping, _ = resolve_columns(sheet_type, header)
+    key_column = mapping[SHEET_SCHEMAS[sheet_type]['key']]
+    key_index = header.index(key_column) if key_column is not None else None
+
+    fingerprints = {}
+    for position, row in enumerate(values[1:]):
+        key = row[key_index] if key_index is not None and key_index < len(row) else f"@{position}"
+        row_id, n = key, 1
+        while row_id in fingerprints:
+            n += 1
+            row_id = f"{key}#{n}"
+        fingerprints[row_id] = fingerprint(row)
+    return fingerprints
+
+
+def deck_fingerprints(deck):
+    """row_fingerprints() of a deck built from a local source, hashing its canonical columns"""
+    columns = list(deck.columns.values())
+    key_column = deck.columns.get(deck.key_field)
+
+    fingerprints = {}
+    for position in range(deck.size):
+        key = key_column[position] if key_column is not None else f"@{position}"
+        row_id, n = key, 1
+        while row_id in fingerprints:
+            n += 1
+            row_id = f"{key}#{n}"
+        fingerprints[row_id] = fingerprint([column[position] for column in columns])
+    return fingerprints
+
+
+def diff_fingerprints(old, new):
+    """Row-level diff between two row_fingerprints() results"""
+    return {
+        'added': [row_id for row_id in new if row_id not in old],
+        'removed': [row_id for row_id in old if row_id not in new],
+        'changed': [row_id for row_id, fingerprint in new.items() if row_id in old and old[row_id] != fingerprint]
+    }
+
+
+class Deck:
+    """Schema-resolved, cleaned contents of one sheet, ready to be queried by the request handlers"""
+
+    __slots__ = ('sheet_type', 'schema', 'key_field', 'mapping', 'problems', 'source',
+                 'columns', 'size', 'valid_rows', 'rows_by_key', 'sentences', 'distractors')
+
+    def __init__(self, sheet_type, columns, mapping=None, problems=(), source=None):
+        self.sheet_type = sheet_type
+        self.schema = SHEET_SCHEMAS[sheet_type]
+        self.key_field = self.schema['key']
+        self.mapping = mapping or {}
+        self.problems = list(problems)
+        self.source = source
+
+        # Parallel lists of cleaned cell values, one per canonical column
+        self.columns = columns
+        self.size = len(next(iter(columns.values()), []))
+
+        # Rows usable as quiz questions: every required column holds a real value
+        required = [columns[field] for field in self.schema['required'] if field in columns]
+        if len(required) < len(self.schema['required']):
+            self.valid_rows = []
+        else:
+            self.valid_rows = [i for i in range(self.size) if all(is_valid_value(column[i]) for column in required)]
+
+        # Valid rows of each item, for knowledge lookups by grammar lesson / kanji / word
+        self.rows_by_key = {}
+        for row in self.valid_rows:
+            self.rows_by_key.setdefault(self.key(row), []).append(row)
+
+        self.sentences = self._build_sentences()
+        self.distractors = {
+            'meaning': DistractorPool(self.columns['meaning'][i] for i in self.valid_rows) if self.has('meaning') else DistractorPool(),
+            'sentence': DistractorPool(sentence['english'] for sentence in self.sentences)
+        }
+
+    @classmethod
+    def from_values(cls, sheet_type, values):
+        """Build a compact deck straight from a Sheets `values` payload (header row first).
+
+        Only the canonical columns are kept, as interned strings, so no pandas
+        objects are needed to serve requests.
+        """
+        return cls.from_rows(sheet_type, values[0] if values else [], values[1:])
+
+    @classmethod
+    def from_rows(cls, sheet_type, header, rows):
+        """Build a compact deck from a header row and an iterable of rows, consumed one row at a time.
+
+        Only the canonical columns are kept, so a source far larger than the
+        deck (an XML dictionary, a wide CSV) is never held in memory at once.
+        """
+        header = [str(name) for name in header]
+        mapping, problems = resolve_columns(sheet_type, header)
+        fields = [(field, header.index(column)) for field, column in mapping.items() if column is not None]
+
+        columns = {field: [] for field, _ in fields}
+        count = 0
+        for row in rows:
+            for field, index in fields:
+                columns[field].append(sys.intern(clean_value(row[index])) if index < len(row) else '')
+            count += 1
+        if not columns:
+            columns = {SHEET_SCHEMAS[sheet_type]['key']: [''] * count}
+        return cls(sheet_type, columns, mapping, problems)
+
+    @classmethod
+    def from_parts(cls, sheet_type, columns, valid_rows, rows_by_key, sentences, distractors,
+                   mapping=None, problems=(), size=None):
+        """Assemble a deck from prebuilt parts (e.g. read from a compiled deck file) without re-deriving them"""
+        deck = cls.__new__(cls)
+        deck.sheet_type = sheet_type
+        deck.schema = SHEET_SCHEMAS[sheet_type]
+        deck.key_field = deck.schema['key']
+        deck.mapping = mapping or {}
+        deck.problems = list(problems)
+        deck.source = None
+        deck.columns = columns
+        deck.size = size if size is not None else len(next(iter(columns.values()), []))
+        deck.valid_rows = valid_rows
+        deck.rows_by_key = rows_by_key
+        deck.sentences = sentences
+        deck.distractors = distractors
+        return deck
+
+    @classmethod
+    def from_dataframe(cls, sheet_type, data):
+        """Build a deck from a sheet DataFrame, resolving its columns once"""
+        mapping, problems = resolve_columns(sheet_type, list(data.columns))
+        columns = {field: [clean_value(value) for value in data[column].tolist()]
+                   for field, column in mapping.items() if column is not None}
+        if not columns:
+            columns = {SHEET_SCHEMAS[sheet_type]['key']: [''] * len(data)}
+        return cls(sheet_type, columns, mapping, problems, source=data)
+
+    def __len__(self):
+        return len(self.valid_rows)
+
+    def has(self, field):
+        """Check whether the sheet provides a canonical column"""
+        return field in self.columns
+
+    def value(self, field, row, default=''):
+        """Value of a canonical column for a row, or `default` if the sheet lacks that column"""
+        column = self.columns.get(field)
+        return column[row] if column is not None else default
+
+    def key(self, row):
+        """Identifier of the item in a row (grammar lesson, kanji or word)"""
+        return self.value(self.key_field, row)
+
+    def rows_for(self, key):
+        """Valid rows holding an item"""
+        return self.rows_by_key.get(key, ())
+
+    def sample_rows(self, n, exclude=None):
+        """Sample up to n distinct valid rows, skipping rows for which exclude(row) is true"""
+        rows = self.valid_rows if exclude is None else [row for row in self.valid_rows if not exclude(row)]
+        return random.sample(rows, min(n, len(rows)))
+
+    def describe(self):
+        """One-line summary of the resolved schema for the startup log"""
+        resolved = ', '.join(f"{field}='{column}'" for field, column in self.mapping.items() if column is not None)
+        return f"{self.sheet_type}: {len(self.valid_rows)}/{self.size} valid rows, {len(self.sentences)} sentences ({resolved})"
+
+    def _build_sentences(self):
+        """Parse the example column once into a flat list of sentence pairs"""
+        if not self.has('example'):
+            return []
+
+        sentences = []
+        for row, example_text in enumerate(self.columns['example']):
+            for sentence in parse_example_sentences(example_text):
+                sentence['sheet'] = self.sheet_type
+                sentence['source'] = self.key(row)
+                sentence['row'] = row
+                sentences.append(sentence)
+        return sentences
+
+
+# Knowledge levels tracked per item; items without one are 'unseen'
+KNOWLEDGE_LEVELS = ('good', 'medium', 'dont_know')
+
+# Base sampling weight of a row per knowledge level; 'good' rows still come up, just rarely
+LEVEL_WEIGHTS = {'good': 0.2, 'medium': 2.0, 'dont_know': 4.0, 'unseen': 1.0}
+
+
+class WeightTree:
+    """Fenwick tree over non-negative weights: O(log n) updates, prefix sums and weighted draws"""
+
+    __slots__ = ('size', 'weights', '_tree')
+
+    def __init__(self, weights):
+        self.size = len(weights)
+        self.weights = list(weights)
+        self._tree = [0.0] + self.weights
+        # Linear-time build: push each node's sum up to its parent
+        for i in range(1, self.size + 1):
+            parent = i + (i & -i)
+            if parent <= self.size:
+                self._tree[parent] += self._tree[i]
+
+    def total(self):
+        return self.prefix_sum(self.size)
+
+    def prefix_sum(self, count):
+        """Sum of the first count weights"""
+        total = 0.0
+        while count > 0:
+            total += self._tree[count]
+            count -= count & -count
+        return total
+
+    def set(self, position, weight):
+        delta = weight - self.weights[position]
+        self.weights[position] = weight
+        i = position + 1
+        while i <= self.size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def find(self, target):
+        """Position whose cumulative weight range holds target (0 <= target < total)"""
+        position = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            following = position + step
+            if following <= self.size and self._tree[following] <= target:
+                position = following
+                target -= self._tree[following]
+            step >>= 1
+        return min(position, self.size - 1)
+
+    def sample(self, n):
+        """Draw up to n distinct positions, each with probability proportional to its weight.
+
+        Drawn positions are zeroed while drawing and restored afterwards, so a
+        draw costs O(n log size) and leaves the tree unchanged.
+        """
+        drawn = []
+        while len(drawn) < n:
+            total = self.total()
+            if total <= 1e-9:
+                break
+            position = self.find(random.random() * total)
+            if self.weights[position] <= 0:
+                # Float drift landed on an empty slot; resync the tree and retry
+                self.__init__(self.weights)
+                continue
+            drawn.append((position, self.weights[position]))
+            self.set(position, 0.0)
+        for position, weight in drawn:
+            self.set(position, weight)
+        return [position for position, _ in drawn]
+
+
+class LevelIndex:
+    """Valid rows of a deck grouped by one learner's knowledge level, kept up to date incrementally.
+
+    Every valid row also has a sampling weight from its level and the
+    learner's answer history, kept in a WeightTree: a level change or an
+    answer updates one row in O(log n), and n quiz rows are drawn in
+    O(n log n) without re-normalizing the deck.
+    """
+
+    __slots__ = ('deck', 'built_at', '_row_levels', '_answers', '_weights')
+
+    def __init__(self, deck, levels, built_at=None, answers=None):
+        self.deck = deck
+        self.built_at = built_at
+        self._row_levels = {}
+        # item -> [answers, correct, ...] of this learner: the StatsEngine item rollup, updated as answers are logged
+        self._answers = answers if answers is not None else {}
+
+        weights = [0.0] * deck.size
+        for row in deck.valid_rows:
+            weights[row] = LEVEL_WEIGHTS['unseen']
+        self._weights = WeightTree(weights)
+
+        for key, level in levels:
+            self.set_level(key, level)
+        for key in list(self._answers):
+            self.reweigh(key)
+
+    def set_level(self, key, level):
+        """Move every row of an item to a new knowledge level"""
+        for row in self.deck.rows_for(key):
+            old_level = self._row_levels.get(row, 'unseen')
+            if old_level == level:
+                continue
+            self._row_levels[row] = level
+        self.reweigh(key)
+
+    def weight(self, row):
+        """Sampling weight of a row: items answered wrongly come up more often"""
+        answers, correct = self._answers.get(self.deck.key(row), (0, 0))[:2]
+        base = LEVEL_WEIGHTS.get(self.level(row), LEVEL_WEIGHTS['unseen'])
+        return base * (answers - correct + 1) / (correct + 1)
+
+    def reweigh(self, key):
+        """Recompute the sampling weights of an item's rows, e.g. after an answer about it was counted"""
+        for row in self.deck.rows_for(key):
+            self._weights.set(row, self.weight(row))
+
+    def level(self, row):
+        return self._row_levels.get(row, 'unseen')
+
+    def sample(self, n):
+        """Draw up to n distinct rows, weighted by knowledge level and error rate"""
+        return self._weights.sample(n)
@@ -0,0 +1,91 @@
+import random
+
+# Cell values that never make a usable answer
+INVALID_ANSWERS = {'', 'nan', 'n/a', 'none'}
+
+
+def normalize_answer(answer):
+    """Normalize an answer string for duplicate / exclusion checks"""
+    return str(answer).strip().lower()
+
+
+class DistractorPool:
+    """Pre-built pool of unique answers to draw wrong multiple choice options from"""
+
+    def __init__(self, answers=()):
+        self.answers = []
+        self._positions = {}
+
+        for answer in answers:
+            if answer is None:
+                continue
+            answer = str(answer).strip()
+            key = normalize_answer(answer)
+            if key in INVALID_ANSWERS or key in self._positions:
+                continue
+            self._positions[key] = len(self.answers)
+            self.answers.append(answer)
+
+    @classmethod
+    def from_parts(cls, answers, positions):
+        """Pool over prebuilt answers and a normalized answer -> position lookup (anything with get / in)"""
+        pool = cls()
+        pool.answers = answers
+        pool._positions = positions
+        return pool
+
+    def __len__(self):
+        return len(self.answers)
+
+    def __contains__(self, answer):
+        return normalize_answer(answer) in self._positions
+
+    def sample(self, k, exclude=None, rank=None, candidates=12):
+        """Draw up to k unique answers, never returning `exclude`.
+
+        Without `rank` the draw is uniform. With rank='length' or rank='overlap'
+        a fixed number of uniform candidates is drawn first and the ones closest
+        in length / sharing the most words with `exclude` are kept, which gives
+        more plausible distractors while staying constant time.
+        """
+        draw = max(k, candidates) if rank else k
+        picked = self._draw(draw, exclude)
+
+        if rank and exclude is not None:
+            picked.sort(key=lambda answer: self._distance(answer, exclude, rank))
+            picked = picked[:k]
+            random.shuffle(picked)
+        return picked[:k]
+
+    def _draw(self, k, exclude):
+        """Uniform duplicate-free draw by rejection sampling over pool positions"""
+        excluded = self._positions.get(normalize_answer(exclude)) if exclude is not None else None
+        available = len(self.answers) - (excluded is not None)
+
+        if available <= 0:
+            return []
+        if k >= available:
+            # Small pool: everything except the correct answer
+            picked = [answer for i, answer in enumerate(self.answers) if i != excluded]
+            random.shuffle(picked)
+            return picked
+
+        chosen = set()
+        size = len(self.answers)
+        while len(chosen) < k:
+            i = random.randrange(size)
+            if i != excluded:
+                chosen.add(i)
+        return [self.answers[i] for i in chosen]
+
+    @staticmethod
+    def _distance(answer, reference, rank):
+        """Lower is more plausible as a distractor for `reference`"""
+        if rank == 'length':
+            return abs(len(answer) - len(reference))
+        if rank == 'overlap':
+            answer_words = set(normalize_answer(answer).split())
+            reference_words = set(normalize_answer(reference).split())
+            union = answer_words | reference_words
+            return -len(answer_words & reference_words) / len(union) if union else 0
+        raise ValueError(f"Unknown distractor ranking: {rank}")
@@ -0,0 +1,186 @@
+import collections
+import re
+import threading
+import unicodedata
+
+# Words that don't carry the meaning of an answer
+STOP_WORDS = frozenset({
+    'the', 'a', 'an', 'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'do', 'does',
+    'did', 'will', 'would', 'could', 'should', 'may', 'might', 'can', 'of', 'in', 'on', 'at', 'to', 'for',
+    'with', 'by', 'from', 'up', 'down', 'out', 'off', 'over', 'under', 'and', 'or', 'but', 'so', 'because',
+    'if', 'then', 'else', 'when', 'where', 'why', 'how', 'what', 'which', 'who', 'whom', 'whose'
+})
+
+# Share of an answer's key words a reply must contain to count as correct
+KEY_WORD_RATIO = 0.5
+
+_PUNCTUATION = re.compile(r"[^\w\s']+|'(?!\w)|(?<!\w)'")
+_VOWELS = set('aeiou')
+
+
+def normalize(text):
+    """Lowercase, unify width / compatibility forms and turn punctuation into spaces"""
+    text = unicodedata.normalize('NFKC', text).lower().replace('’', "'")
+    return ' '.join(_PUNCTUATION.sub(' ', text).split())
+
+
+def _undouble(word):
+    # stopped -> stopp -> stop, running -> runn -> run
+    if len(word) > 3 and word[-1] == word[-2] and word[-1] not in _VOWELS and word[-1] not in 'lsz':
+        return word[:-1]
+    return word
+
+
+def stem(word):
+    """Strip common plural / tense endings so 'studies', 'studied' and 'study' compare equal"""
+    if word.endswith("'s"):
+        word = word[:-2]
+    if len(word) <= 3:
+        return word
+    if word.endswith('ies') or word.endswith('ied'):
+        return word[:-3] + 'y'
+    if word.endswith('ing') and len(word) > 5:
+        return _undouble(word[:-3])
+    if word.endswith('ed') and len(word) > 4:
+        return _undouble(word[:-2])
+    if word.endswith(('ches', 'shes', 'sses', 'xes', 'zes')):
+        return word[:-2]
+    if word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+
+def key_stems(normalized):
+    """Stems of the words of a normalized text that carry meaning"""
+    return frozenset(stem(word) for word in normalized.split() if word not in STOP_WORDS)
+
+
+def within_distance(a, b, limit):
+    """Whether the edit distance of a and b is at most limit.
+
+    Only a band of 2 * limit + 1 cells per row is computed, and the scan
+    stops as soon as a whole row exceeds the limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return False
+    if a == b:
+        return True
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        low, high = max(1, i - limit), min(len(b), i + limit)
+        current = [limit + 1] * (len(b) + 1)
+        current[0] = i if i <= limit else limit + 1
+        for j in range(low, high + 1):
+            cost = 0 if char_a == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+        if min(current[max(0, low - 1):high + 1]) > limit:
+            return False
+        previous = current
+    return previous[len(b)] <= limit
+
+
+def fuzzy_limit(word):
+    """Typos tolerated in a word of this length"""
+    return 0 if len(word) < 5 else 1 if len(word) < 9 else 2
+
+
+class CompiledAnswer:
+    """A correct answer, normalized and split into key-word stems once"""
+
+    __slots__ = ('normalized', 'stems', 'needed')
+
+    def __init__(self, text):
+        self.normalized = normalize(text)
+        self.stems = key_stems(self.normalized)
+        self.needed = KEY_WORD_RATIO * len(self.stems)
+
+
+class AnswerGrader:
+    """Grades free-text answers against known correct answers.
+
+    Correct answers are compiled when a deck loads (compile()), so grading a
+    reply only normalizes and stems the reply itself: O(len(reply)) set
+    lookups, plus a bounded edit-distance check of unmatched words when
+    fuzzy matching is on. At most max_cached compiled answers are kept, least
+    recently used first out, so answers of reloaded decks don't pile up.
+    """
+
+    def __init__(self, fuzzy=True, max_cached=50000):
+        self.fuzzy = fuzzy
+        self.max_cached = max_cached
+        self._compiled = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _store(self, answer, entry):
+        """Cache a compiled answer, dropping the least recently used ones (call under _lock)"""
+        self._compiled[answer] = entry
+        self._compiled.move_to_end(answer)
+        while len(self._compiled) > self.max_cached:
+            self._compiled.popitem(last=False)
+
+    def compile(self, answers):
+        """Precompile correct answers; returns how many were new"""
+        compiled = {}
+        for answer in answers:
+            if answer and answer not in self._compiled and answer not in compiled:
+                compiled[answer] = CompiledAnswer(answer)
+        with self._lock:
+            for answer, entry in compiled.items():
+                self._store(answer, entry)
+        return len(compiled)
+
+    def compiled(self, answer):
+        with self._lock:
+            entry = self._compiled.get(answer)
+            if entry is not None:
+                self._compiled.move_to_end(answer)
+                return entry
+        entry = CompiledAnswer(answer)
+        with self._lock:
+            self._store(answer, entry)
+        return entry
+
+    def grade(self, user_answer, correct_answer, fuzzy=None):
+        """Whether a reply is close enough to the correct answer"""
+        if not user_answer or not correct_answer:
+            return False
+        fuzzy = self.fuzzy if fuzzy is None else fuzzy
+        correct = self.compiled(correct_answer)
+        reply = normalize(user_answer)
+        if not reply:
+            return False
+        if reply == correct.normalized:
+            return True
+
+        if correct.stems:
+            matched = set()
+            unmatched = []
+            for word in reply.split():
+                if word in STOP_WORDS:
+                    continue
+                word_stem = stem(word)
+                if word_stem in correct.stems:
+                    matched.add(word_stem)
+                    if len(matched) >= correct.needed:
+                        return True
+                elif fuzzy:
+                    unmatched.append(word_stem)
+
+            for word_stem in unmatched:
+                limit = fuzzy_limit(word_stem)
+                if not limit:
+                    continue
+                for key in correct.stems:
+                    if key not in matched and within_distance(word_stem, key, limit):
+                        matched.add(key)
+                        break
+                if len(matched) >= correct.needed:
+                    return True
+            return False
+
+        # No key words (e.g. only stop words): fall back to containment
+        return reply in correct.normalized or correct.normalized in reply
+
+    def grade_many(self, pairs, fuzzy=None):
+        """Grade (user_answer, correct_answer) pairs"""
+        return [self.grade(user_answer, correct_answer, fuzzy) for user_answer, correct_answer in pairs]
@@ -0,0 +1,381 @@
+import atexit
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+class KnowledgeStore:
+    """Dict-like store of knowledge levels (item -> 'good' / 'medium' / 'dont_know').
+
+    Updates land in memory immediately and are written behind: after
+    `flush_delay` seconds a background timer appends every pending change to
+    an append-only journal (`<file>.journal`). Once the journal holds
+    `compact_every` entries it is folded into the JSON snapshot, which is
+    replaced atomically. Loading replays the journal on top of the snapshot,
+    so a crash loses at most the last `flush_delay` seconds of clicks and
+    never corrupts the file.
+    """
+
+    def __init__(self, file_path, flush_delay=0.5, compact_every=500):
+        self.file_path = file_path
+        self.journal_path = f"{file_path}.journal"
+        self.flush_delay = flush_delay
+        self.compact_every = compact_every
+
+        self._data = {}
+        self._pending = {}
+        self._journal_entries = 0
+        self._timer = None
+        self._lock = threading.Lock()      # guards _data / _pending / _timer
+        self._io_lock = threading.Lock()   # serializes journal appends and compaction
+
+        self.load()
+        atexit.register(self.close)
+
+    # --- dict interface -------------------------------------------------
+
+    def __getitem__(self, item):
+        return self._data[item]
+
+    def __setitem__(self, item, level):
+        self.update({item: level})
+
+    def __contains__(self, item):
+        return item in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(list(self._data))
+
+    def get(self, item, default=None):
+        return self._data.get(item, default)
+
+    def items(self):
+        with self._lock:
+            return list(self._data.items())
+
+    def keys(self):
+        return list(self._data)
+
+    def items_at(self, levels):
+        """(item, level) pairs of the items at one of the given knowledge levels"""
+        levels = set(levels)
+        with self._lock:
+            return [(item, level) for item, level in self._data.items() if level in levels]
+
+    def update(self, levels):
+        """Set several knowledge levels at once and schedule a write-behind flush"""
+        with self._lock:
+            self._data.update(levels)
+            self._pending.update(levels)
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    # --- persistence ----------------------------------------------------
+
+    def load(self):
+        """Load the JSON snapshot and replay the journal on top of it"""
+        data = {}
+        if os.path.exists(self.file_path):
+            try:
+                with open(self.file_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                print(f"✅ Loaded {len(data)} entries from {self.file_path}.")
+            except (json.JSONDecodeError, IOError) as e:
+                print(f"⚠️ Could not load {self.file_path}, starting fresh. Error: {e}")
+                data = {}
+        else:
+            print(f"ℹ️ No {self.file_path} found. A new one will be created.")
+
+        replayed = 0
+        if os.path.exists(self.journal_path):
+            valid_bytes = 0
+            with open(self.journal_path, 'rb') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line.decode('utf-8'))
+                    except (UnicodeDecodeError, json.JSONDecodeError):
+                        # A torn last line from a crash mid-append
+                        break
+                    data[entry['item']] = entry['level']
+                    valid_bytes += len(line)
+                    replayed += 1
+            if valid_bytes < os.path.getsize(self.journal_path):
+                # Drop the torn tail so later appends start on a clean line
+                with open(self.journal_path, 'r+b') as f:
+                    f.truncate(valid_bytes)
+            if replayed:
+                print(f"✅ Replayed {replayed} journal entries from {self.journal_path}.")
+
+        with self._lock:
+            self._data = data
+            self._pending = {}
+        self._journal_entries = replayed
+
+    def flush(self):
+        """Append pending changes to the journal, compacting it once it grows large"""
+        with self._io_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._timer = None
+            if not pending:
+                return
+
+            try:
+                with open(self.journal_path, 'a', encoding='utf-8') as f:
+                    for item, level in pending.items():
+                        f.write(json.dumps({'item': item, 'level': level}, ensure_ascii=False) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._journal_entries += len(pending)
+            except IOError as e:
+                print(f"❌ Could not write {self.journal_path}. Error: {e}")
+                with self._lock:
+                    # Keep the changes for the next flush, without overwriting newer ones
+                    self._pending = {**pending, **self._pending}
+                return
+
+        if self._journal_entries >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        """Atomically rewrite the JSON snapshot with the current data and truncate the journal"""
+        with self._io_lock:
+            with self._lock:
+                snapshot = dict(self._data)
+                pending, self._pending = self._pending, {}
+
+            # A temp file of its own, so two processes compacting the same store never rename each other's
+            directory, name = os.path.split(os.path.abspath(self.file_path))
+            temp_path = None
+            try:
+                fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f'.{name}.', suffix='.tmp')
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(snapshot, f, ensure_ascii=False, indent=4)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.file_path)
+                temp_path = None
+                # Everything journaled so far is now in the snapshot
+                open(self.journal_path, 'w').close()
+                self._journal_entries = 0
+            except IOError as e:
+                print(f"❌ Could not save {self.file_path}. Error: {e}")
+                with self._lock:
+                    self._pending = {**pending, **self._pending}
+            finally:
+                if temp_path is not None and os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    def close(self):
+        """Stop the pending timer and write everything to the snapshot"""
+        with self._lock:
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        if self._pending or self._journal_entries:
+            self.compact()
+
+
+class _SQLiteStore:
+    """Rows of one (user, deck) pair in a shared SQLite database, with one connection per thread"""
+
+    SCHEMA = ''
+
+    _local = threading.local()
+    # (store class, database) pairs whose schema this process has already created
+    _schema_ready = set()
+    _schema_lock = threading.Lock()
+
+    def __init__(self, db_path, deck, user_id='default'):
+        self.db_path = db_path
+        self.deck = deck
+        self.user_id = user_id
+        key = (type(self), os.path.abspath(db_path))
+        if key not in self._schema_ready:
+            with self._schema_lock:
+                if key not in self._schema_ready:
+                    with self._connect() as connection:
+                        connection.executescript(self.SCHEMA)
+                    self._schema_ready.add(key)
+
+    def _connect(self):
+        """One connection per thread and database file"""
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        connection = connections.get(self.db_path)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connections[self.db_path] = connection
+        return connection
+
+    def _query(self, sql, *params):
+        return self._connect().execute(sql, (self.user_id, self.deck) + params).fetchall()
+
+    def flush(self):
+        """Updates are committed immediately; nothing to flush"""
+
+    def close(self):
+        """Close this thread's connection"""
+        connection = getattr(self._local, 'connections', {}).pop(self.db_path, None)
+        if connection is not None:
+            connection.close()
+
+
+class SQLiteKnowledgeStore(_SQLiteStore):
+    """Knowledge levels of one (user, deck) pair in a shared SQLite database.
+
+    Same interface as KnowledgeStore, but every update is committed straight
+    to the database, so several worker processes (and many learners) see
+    consistent state. The database runs in WAL mode so readers never block
+    the writer.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS knowledge (
+            user_id TEXT NOT NULL,
+            deck TEXT NOT NULL,
+            item TEXT NOT NULL,
+            level TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (user_id, deck, item)
+        ) WITHOUT ROWID;
+        -- Covers items_at(): a learner's items at some levels, without reading the rest of the deck
+        CREATE INDEX IF NOT EXISTS knowledge_by_level ON knowledge (user_id, deck, level);
+    """
+
+    # --- dict interface -------------------------------------------------
+
+    def __getitem__(self, item):
+        level = self.get(item)
+        if level is None:
+            raise KeyError(item)
+        return level
+
+    def __setitem__(self, item, level):
+        self.update({item: level})
+
+    def __contains__(self, item):
+        return self.get(item) is not None
+
+    def __len__(self):
+        return self._query('SELECT COUNT(*) FROM knowledge WHERE user_id = ? AND deck = ?')[0][0]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, item, default=None):
+        rows = self._query('SELECT level FROM knowledge WHERE user_id = ? AND deck = ? AND item = ?', item)
+        return rows[0][0] if rows else default
+
+    def items(self):
+        return self._query('SELECT item, level FROM knowledge WHERE user_id = ? AND deck = ?')
+
+    def keys(self):
+        return [item for item, _ in self.items()]
+
+    def items_at(self, levels):
+        """(item, level) pairs of the items at one of the given knowledge levels (served by the level index)"""
+        levels = tuple(levels)
+        return self._query(f"SELECT item, level FROM knowledge WHERE user_id = ? AND deck = ? "
+                           f"AND level IN ({', '.join('?' * len(levels))})", *levels)
+
+    def update(self, levels):
+        """Set several knowledge levels in one transaction"""
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany(
+                """INSERT INTO knowledge (user_id, deck, item, level, updated_at) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT (user_id, deck, item) DO UPDATE SET level = excluded.level, updated_at = excluded.updated_at""",
+                [(self.user_id, self.deck, item, level, now) for item, level in levels.items()]
+            )
+
+
+class SQLiteCardStore(_SQLiteStore):
+    """Spaced-repetition cards of one (user, deck) pair: item -> (interval, ease, reps, due).
+
+    Cards have their own table next to the knowledge levels, one column per
+    field, so both can be queried directly. Cards stored by older versions
+    as 'interval;ease;reps;due' strings under a '<deck>:srs' knowledge deck
+    are moved over the first time the deck's store is opened.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS srs_cards (
+            user_id TEXT NOT NULL,
+            deck TEXT NOT NULL,
+            item TEXT NOT NULL,
+            interval REAL NOT NULL,
+            ease REAL NOT NULL,
+            reps INTEGER NOT NULL,
+            due REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (user_id, deck, item)
+        ) WITHOUT ROWID;
+    """
+
+    # (database, deck) pairs already checked for cards stored the old way
+    _imported = set()
+
+    def __init__(self, db_path, deck, user_id='default'):
+        super().__init__(db_path, deck, user_id)
+        key = (os.path.abspath(db_path), deck)
+        if key not in self._imported:
+            with self._schema_lock:
+                if key not in self._imported:
+                    self._import_encoded_cards()
+                    self._imported.add(key)
+
+    def _import_encoded_cards(self):
+        connection = self._connect()
+        legacy_deck = f'{self.deck}:srs'
+        try:
+            rows = connection.execute('SELECT user_id, item, level, updated_at FROM knowledge WHERE deck = ?',
+                                      (legacy_deck,)).fetchall()
+        except sqlite3.OperationalError:
+            # No knowledge table in this database
+            return
+        if not rows:
+            return
+        cards = []
+        for user_id, item, encoded, updated_at in rows:
+            try:
+                interval, ease, reps, due = encoded.split(';')
+                cards.append((user_id, self.deck, item, float(interval), float(ease), int(reps), float(due), updated_at))
+            except ValueError:
+                continue
+        with connection:
+            connection.executemany(
+                """INSERT OR IGNORE INTO srs_cards (user_id, deck, item, interval, ease, reps, due, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", cards)
+            connection.execute('DELETE FROM knowledge WHERE deck = ?', (legacy_deck,))
+        print(f"✅ Moved {len(cards)} {self.deck} review cards into the srs_cards table of {self.db_path}.")
+
+    def __len__(self):
+        return self._query('SELECT COUNT(*) FROM srs_cards WHERE user_id = ? AND deck = ?')[0][0]
+
+    def items(self):
+        return [(item, tuple(fields)) for item, *fields in self._query(
+            'SELECT item, interval, ease, reps, due FROM srs_cards WHERE user_id = ? AND deck = ?')]
+
+    def update(self, cards):
+        """Store several cards ({item: (interval, ease, reps, due)}) in one transaction"""
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany(
+                """INSERT INTO srs_cards (user_id, deck, item, interval, ease, reps, due, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (user_id, deck, item) DO UPDATE SET interval = excluded.interval,
+                       ease = excluded.ease, reps = excluded.reps, due = excluded.due, updated_at = excluded.updated_at""",
+                [(self.user_id, self.deck, item, *fields, now) for item, fields in cards.items()]
+            )
@@ -0,0 +1,117 @@
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QuizPool:
+    """Bounded pools of ready-made quiz sets, refilled in the background.
+
+    Pools are keyed by (deck_type, user_id, num_questions, level): the user
+    decides which items are filtered out as 'good', so a quiz built for one
+    learner is never handed to another. `build(key)` makes a quiz set (or None when the
+    deck has nothing to ask) and `items_of(key, quiz_set)` tells which deck
+    items it asks about, so a knowledge update only drops the quizzes that
+    contain the updated items.
+
+    take() pops a pooled quiz in O(1) and schedules a refill; it returns
+    None on a cold pool, and the caller builds the quiz itself.
+    """
+
+    def __init__(self, build, items_of, size=4, max_keys=1024, workers=1):
+        self.build = build
+        self.items_of = items_of
+        self.size = size
+        self.max_keys = max_keys
+        self._pools = collections.OrderedDict()   # key -> deque of (items, quiz_set)
+        self._generations = {}                     # (deck_type, user_id) -> invalidation counter
+        self._epochs = {}                          # deck_type -> reload counter
+        self._refilling = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='quiz-pool')
+
+    def take(self, key):
+        """Pop a ready quiz set for key (or None) and top the pool back up"""
+        if self.size <= 0:
+            return None
+        with self._lock:
+            pool = self._pools.get(key)
+            quiz_set = None
+            if pool:
+                quiz_set = pool.popleft()[1]
+            if pool is not None:
+                self._pools.move_to_end(key)
+        self.refill(key)
+        return quiz_set
+
+    def refill(self, key):
+        """Schedule a background refill of key's pool, unless one is already running"""
+        if self.size <= 0:
+            return
+        with self._lock:
+            if key in self._refilling:
+                return
+            self._refilling.add(key)
+        self._executor.submit(self._refill, key)
+
+    def _refill(self, key):
+        try:
+            while True:
+                with self._lock:
+                    pool = self._pools.get(key)
+                    if pool is not None and len(pool) >= self.size:
+                        return
+                    generation = self._generation(key)
+
+                quiz_set = self.build(key)
+                if not quiz_set:
+                    return
+                items = frozenset(self.items_of(key, quiz_set))
+
+                with self._lock:
+                    if self._generation(key) != generation:
+                        # Knowledge changed while building; the quiz may already be stale
+                        continue
+                    pool = self._pools.setdefault(key, collections.deque())
+                    self._pools.move_to_end(key)
+                    pool.append((items, quiz_set))
+                    while len(self._pools) > self.max_keys:
+                        self._pools.popitem(last=False)
+        except Exception as e:
+            print(f"❌ Could not pre-generate quiz {key}: {e}")
+        finally:
+            with self._lock:
+                self._refilling.discard(key)
+
+    def _generation(self, key):
+        return self._epochs.get(key[0], 0), self._generations.get(key[:2], 0)
+
+    def invalidate(self, deck_type, user_id, items):
+        """Drop the pooled quizzes of a learner's deck that ask about any of items"""
+        items = set(items)
+        refill = []
+        with self._lock:
+            self._generations[(deck_type, user_id)] = self._generations.get((deck_type, user_id), 0) + 1
+            for key, pool in self._pools.items():
+                if key[:2] != (deck_type, user_id):
+                    continue
+                fresh = [entry for entry in pool if not (entry[0] & items)]
+                if len(fresh) < len(pool):
+                    pool.clear()
+                    pool.extend(fresh)
+                    refill.append(key)
+        for key in refill:
+            self.refill(key)
+
+    def clear(self, deck_type=None):
+        """Drop every pooled quiz (of one deck), e.g. after the deck was reloaded"""
+        with self._lock:
+            for key in list(self._pools):
+                if deck_type is None or key[0] == deck_type:
+                    del self._pools[key]
+            for deck in ([deck_type] if deck_type else {key[0] for key in self._refilling} | set(self._epochs)):
+                self._epochs[deck] = self._epochs.get(deck, 0) + 1
+
+    def counts(self):
+        """Number of ready quizzes per pool key"""
+        with self._lock:
+            return {key: len(pool) for key, pool in self._pools.items()}
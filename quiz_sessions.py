@@ -0,0 +1,126 @@
+import collections
+import json
+import secrets
+import sqlite3
+import threading
+import time
+
+
+class SQLiteQuizBackend:
+    """Quiz states in a SQLite table, so they survive restarts and are shared across workers"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS quiz_sessions (
+                    quiz_id TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+        return connection
+
+    def load(self, quiz_id):
+        row = self._connect().execute(
+            'SELECT state FROM quiz_sessions WHERE quiz_id = ? AND expires_at > ?', (quiz_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, quiz_id, state, expires_at):
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO quiz_sessions (quiz_id, state, expires_at) VALUES (?, ?, ?)',
+                (quiz_id, json.dumps(state, ensure_ascii=False), expires_at)
+            )
+
+    def purge_expired(self):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM quiz_sessions WHERE expires_at <= ?', (time.time(),))
+
+
+class QuizSessionStore:
+    """Server-side quiz state keyed by an opaque quiz id kept in the session cookie.
+
+    States live in an in-memory LRU capped at `max_entries`. Each entry
+    expires `ttl` seconds after it was last used. With a backend every change
+    is also written through to it, and misses are read back from it.
+    """
+
+    def __init__(self, max_entries=10000, ttl=6 * 3600, backend=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend
+        self._entries = collections.OrderedDict()   # quiz_id -> (expires_at, state)
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def create(self, state):
+        """Store a new quiz state and return its id"""
+        quiz_id = secrets.token_urlsafe(16)
+        self.save(quiz_id, state)
+        return quiz_id
+
+    def get(self, quiz_id):
+        """Quiz state for an id, or None if unknown or expired"""
+        if not quiz_id:
+            return None
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(quiz_id)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries[quiz_id] = (now + self.ttl, entry[1])
+                    self._entries.move_to_end(quiz_id)
+                    return entry[1]
+                del self._entries[quiz_id]
+
+        if self.backend is None:
+            return None
+        state = self.backend.load(quiz_id)
+        if state is not None:
+            self._remember(quiz_id, state, now + self.ttl)
+        return state
+
+    def save(self, quiz_id, state):
+        """Store (or replace) the state of a quiz"""
+        expires_at = time.time() + self.ttl
+        self._remember(quiz_id, state, expires_at)
+        if self.backend is not None:
+            self.backend.save(quiz_id, state, expires_at)
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                self.backend.purge_expired()
+
+    def update(self, quiz_id, **changes):
+        """Change some fields of a stored quiz state and return it"""
+        state = self.get(quiz_id)
+        if state is None:
+            return None
+        state.update(changes)
+        self.save(quiz_id, state)
+        return state
+
+    def _remember(self, quiz_id, state, expires_at):
+        now = time.time()
+        with self._lock:
+            self._entries[quiz_id] = (expires_at, state)
+            self._entries.move_to_end(quiz_id)
+            # Evict the least recently used entries, and expired ones found at the old end
+            while self._entries:
+                oldest_id, (oldest_expiry, _) = next(iter(self._entries.items()))
+                if len(self._entries) > self.max_entries or oldest_expiry <= now:
+                    self._entries.popitem(last=False)
+                else:
+                    break
@@ -0,0 +1,220 @@
+import bisect
+import threading
+import unicodedata
+
+# Deck fields that are searchable, per sheet type (as canonical schema fields)
+SEARCH_FIELDS = {
+    'kanji': ('kanji', 'onyomi', 'kunyomi', 'meaning'),
+    'vocabulary': ('word', 'reading', 'meaning'),
+    'grammar': ('grammar', 'japanese', 'meaning')
+}
+
+_ROMAJI_SYLLABLES = {
+    'a': 'あ', 'i': 'い', 'u': 'う', 'e': 'え', 'o': 'お',
+    'ka': 'か', 'ki': 'き', 'ku': 'く', 'ke': 'け', 'ko': 'こ',
+    'sa': 'さ', 'shi': 'し', 'si': 'し', 'su': 'す', 'se': 'せ', 'so': 'そ',
+    'ta': 'た', 'chi': 'ち', 'ti': 'ち', 'tsu': 'つ', 'tu': 'つ', 'te': 'て', 'to': 'と',
+    'na': 'な', 'ni': 'に', 'nu': 'ぬ', 'ne': 'ね', 'no': 'の',
+    'ha': 'は', 'hi': 'ひ', 'fu': 'ふ', 'hu': 'ふ', 'he': 'へ', 'ho': 'ほ',
+    'ma': 'ま', 'mi': 'み', 'mu': 'む', 'me': 'め', 'mo': 'も',
+    'ya': 'や', 'yu': 'ゆ', 'yo': 'よ',
+    'ra': 'ら', 'ri': 'り', 'ru': 'る', 're': 'れ', 'ro': 'ろ',
+    'wa': 'わ', 'wo': 'を', 'nn': 'ん', "n'": 'ん',
+    'ga': 'が', 'gi': 'ぎ', 'gu': 'ぐ', 'ge': 'げ', 'go': 'ご',
+    'za': 'ざ', 'ji': 'じ', 'zi': 'じ', 'zu': 'ず', 'ze': 'ぜ', 'zo': 'ぞ',
+    'da': 'だ', 'di': 'ぢ', 'du': 'づ', 'de': 'で', 'do': 'ど',
+    'ba': 'ば', 'bi': 'び', 'bu': 'ぶ', 'be': 'べ', 'bo': 'ぼ',
+    'pa': 'ぱ', 'pi': 'ぴ', 'pu': 'ぷ', 'pe': 'ぺ', 'po': 'ぽ',
+    'sha': 'しゃ', 'shu': 'しゅ', 'sho': 'しょ', 'cha': 'ちゃ', 'chu': 'ちゅ', 'cho': 'ちょ',
+    'ja': 'じゃ', 'ju': 'じゅ', 'jo': 'じょ', 'jya': 'じゃ', 'jyu': 'じゅ', 'jyo': 'じょ'
+}
+for _consonant, _kana in (('k', 'き'), ('n', 'に'), ('h', 'ひ'), ('m', 'み'), ('r', 'り'),
+                          ('g', 'ぎ'), ('b', 'び'), ('p', 'ぴ')):
+    for _vowel, _small in (('a', 'ゃ'), ('u', 'ゅ'), ('o', 'ょ')):
+        _ROMAJI_SYLLABLES[f'{_consonant}y{_vowel}'] = _kana + _small
+
+
+def to_hiragana(text):
+    """Fold katakana into hiragana"""
+    return ''.join(chr(ord(char) - 0x60) if 'ァ' <= char <= 'ヶ' else char for char in text)
+
+
+def normalize(text):
+    """Search form of a text: NFKC, lowercase, katakana folded into hiragana"""
+    return to_hiragana(unicodedata.normalize('NFKC', str(text)).lower().strip())
+
+
+def romaji_to_hiragana(text):
+    """Hepburn (or Kunrei) romaji to hiragana, or None if text isn't romaji"""
+    kana = []
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char in '- ':
+            i += 1
+            continue
+        # Doubled consonant: small tsu
+        if i + 1 < len(text) and char == text[i + 1] and char.isalpha() and char not in 'aeioun':
+            kana.append('っ')
+            i += 1
+            continue
+        for length in (3, 2, 1):
+            syllable = _ROMAJI_SYLLABLES.get(text[i:i + length])
+            if syllable:
+                kana.append(syllable)
+                i += length
+                break
+        else:
+            # 'n' before a consonant or at the end
+            if char == 'n':
+                kana.append('ん')
+                i += 1
+            else:
+                return None
+    return ''.join(kana)
+
+
+def _grams(text):
+    """Character bigrams of a text, plus single characters outside ASCII (kanji / kana)"""
+    grams = {text[i:i + 2] for i in range(len(text) - 1)}
+    grams.update(char for char in text if ord(char) > 0x7F)
+    return grams
+
+
+class SearchIndex:
+    """Character n-gram inverted index over the entries of several decks.
+
+    Each entry is one deck row, identified by its deck and searchable field
+    values. Postings map a bigram (or a single kanji / kana) to the entries
+    containing it; a sorted list of (value, entry) pairs answers prefix
+    queries by binary search. Reloading a deck only re-indexes the entries
+    whose text changed.
+    """
+
+    def __init__(self):
+        self._entries = {}        # entry id -> (deck_type, key, {field: value}, {field: normalized})
+        self._by_text = {}        # (deck_type, field values) -> entry id
+        self._postings = {}       # gram -> set of entry ids
+        self._prefixes = []       # sorted (normalized value, entry id, field)
+        self._next_id = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def update_deck(self, deck):
+        """Index the rows of a (re)loaded deck; returns (added, removed) entry counts"""
+        fields = tuple(field for field in SEARCH_FIELDS.get(deck.sheet_type, ()) if deck.has(field))
+        wanted = {}
+        for row in deck.valid_rows:
+            values = tuple(deck.value(field, row) for field in fields)
+            wanted.setdefault((deck.sheet_type, fields, values), deck.key(row))
+
+        with self._lock:
+            stale = [text for text in self._by_text if text[0] == deck.sheet_type and text not in wanted]
+            fresh = [(text, key) for text, key in wanted.items() if text not in self._by_text]
+            # Small changes are spliced into the sorted prefix list, large ones re-sort it once
+            bulk = len(stale) + len(fresh) > 1000
+
+            removed_ids = {self._by_text.pop(text) for text in stale}
+            for entry_id in removed_ids:
+                self._remove(entry_id, splice=not bulk)
+            if bulk and removed_ids:
+                self._prefixes = [entry for entry in self._prefixes if entry[1] not in removed_ids]
+
+            for text, key in fresh:
+                self._by_text[text] = self._add(deck.sheet_type, key, dict(zip(text[1], text[2])), splice=not bulk)
+            if bulk and fresh:
+                self._prefixes.sort()
+        return len(fresh), len(stale)
+
+    def _add(self, deck_type, key, values, splice=True):
+        entry_id = self._next_id
+        self._next_id += 1
+        normalized = {field: normalize(value) for field, value in values.items() if value}
+        self._entries[entry_id] = (deck_type, key, values, normalized)
+        for field, text in normalized.items():
+            for gram in _grams(text):
+                self._postings.setdefault(gram, set()).add(entry_id)
+            if splice:
+                bisect.insort(self._prefixes, (text, entry_id, field))
+            else:
+                self._prefixes.append((text, entry_id, field))
+        return entry_id
+
+    def _remove(self, entry_id, splice=True):
+        _, _, _, normalized = self._entries.pop(entry_id)
+        for field, text in normalized.items():
+            for gram in _grams(text):
+                postings = self._postings.get(gram)
+                if postings is not None:
+                    postings.discard(entry_id)
+                    if not postings:
+                        del self._postings[gram]
+            if not splice:
+                continue
+            position = bisect.bisect_left(self._prefixes, (text, entry_id, field))
+            if position < len(self._prefixes) and self._prefixes[position][1] == entry_id:
+                del self._prefixes[position]
+
+    def search(self, query, decks=None, limit=20):
+        """Entries matching query: exact matches first, then prefix matches, then substring matches.
+
+        Latin queries are also tried as romaji, so 'taberu' finds たべる.
+        Returns [{'deck', 'key', 'field', 'match', 'values'}].
+        """
+        text = normalize(query)
+        if not text:
+            return []
+        variants = [text]
+        kana = romaji_to_hiragana(text) if text.isascii() else None
+        if kana and kana != text:
+            variants.append(kana)
+
+        results, seen = [], set()
+
+        def collect(entry_id, field, match):
+            if entry_id in seen:
+                return
+            deck_type, key, values, _ = self._entries[entry_id]
+            if decks and deck_type not in decks:
+                return
+            seen.add(entry_id)
+            results.append({'deck': deck_type, 'key': key, 'field': field, 'match': match, 'values': values})
+
+        with self._lock:
+            # Exact and prefix matches from the sorted values
+            prefixed = []
+            for variant in variants:
+                position = bisect.bisect_left(self._prefixes, (variant,))
+                while position < len(self._prefixes) and len(prefixed) < 4 * limit:
+                    value, entry_id, field = self._prefixes[position]
+                    if not value.startswith(variant):
+                        break
+                    prefixed.append((value != variant, len(value), entry_id, field))
+                    position += 1
+            for is_prefix, _, entry_id, field in sorted(prefixed):
+                collect(entry_id, field, 'prefix' if is_prefix else 'exact')
+                if len(results) >= limit:
+                    return results
+
+            # Substring matches: intersect the postings of the query grams, then verify
+            for variant in variants:
+                grams = sorted((self._postings.get(gram, set()) for gram in _grams(variant)), key=len)
+                if not grams:
+                    continue
+                candidates = grams[0]
+                for postings in grams[1:]:
+                    candidates = candidates & postings
+                    if not candidates:
+                        break
+                for entry_id in candidates:
+                    if entry_id in seen:
+                        continue
+                    for field, value in self._entries[entry_id][3].items():
+                        if variant in value:
+                            collect(entry_id, field, 'substring')
+                            break
+                    if len(results) >= limit:
+                        return results
+        return results
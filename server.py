@@ -0,0 +1,301 @@
+"""Production server for the JLPT web app: prefork worker processes, each with a pool of threads.
+
+The parent process loads the decks once (one Sheets fetch, or the local
+snapshot), builds the shared indexes, freezes the garbage collector and
+then forks the workers, so every worker reads the same deck memory
+copy-on-write instead of fetching and holding its own copy. Sheet refreshes
+also run in the parent; when a sheet changed, the workers are replaced one
+at a time with fresh forks.
+
+Run with `JLPT_KNOWLEDGE_BACKEND=sqlite python server.py --workers 4 --threads 8`.
+"""
+import argparse
+import gc
+import glob
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+
+class KeepAliveHandler(WSGIRequestHandler):
+    """Request handler that closes idle keep-alive connections, so they don't hold pool threads"""
+
+    timeout = 5
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """WSGI server handling requests on a fixed-size thread pool"""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads=8, fd=None, handler=KeepAliveHandler):
+        # Set after __init__, which closes the placeholder socket it opens when given an fd
+        self._executor = None
+        super().__init__(host, port, app, handler=handler, fd=fd)
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='request')
+
+    def process_request(self, request, client_address):
+        self._executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        """Stop listening, then wait for the requests in flight"""
+        super().server_close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+
+class PreforkServer:
+    """Parent process of the workers: forks them, restarts the ones that die and refreshes the sheets"""
+
+    def __init__(self, web_app, wsgi_app, host='0.0.0.0', port=5000, workers=2, threads=8,
+                 refresh_interval=0, revalidate=False, graceful_timeout=30, quiz_session_db=None):
+        self.web_app = web_app
+        self.wsgi_app = wsgi_app
+        self.host = host
+        self.port = port
+        self.num_workers = workers
+        self.threads = threads
+        self.refresh_interval = refresh_interval
+        self.graceful_timeout = graceful_timeout
+        self.quiz_session_db = quiz_session_db
+
+        self.workers = {}    # pid -> worker slot
+        self._started = {}   # pid -> start time, to slow down a crash loop
+        self.socket = None
+        self._stopping = False
+        self._refresh_now = revalidate
+        self._next_refresh = time.time() + refresh_interval if refresh_interval else None
+
+    def run(self):
+        self.socket = socket.create_server((self.host, self.port), backlog=2048, reuse_port=False)
+        self.socket.set_inheritable(True)
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+
+        self.prepare_fork()
+        for slot in range(self.num_workers):
+            self.spawn(slot)
+        print(f"🌐 Serving on http://{self.host}:{self.port} with {self.num_workers} workers "
+              f"x {self.threads} threads (pid {os.getpid()})")
+
+        try:
+            while not self._stopping:
+                self.reap()
+                if self._refresh_now or (self._next_refresh and time.time() >= self._next_refresh):
+                    self.refresh()
+                time.sleep(0.5)
+        finally:
+            self.stop()
+
+    def prepare_fork(self):
+        """Build everything the workers share, then move it out of the garbage collector's reach.
+
+        gc.freeze() keeps collections in the workers from writing to the
+        inherited objects, which would copy their memory pages into each worker.
+        """
+        gc.unfreeze()
+        # Statistics from every answer logged so far, including by the workers this fork replaces
+        replay_worker_logs(self.web_app)
+        self.web_app.build_indexes()
+        self.web_app.cross_index()
+        self.web_app.close_stores()
+        gc.collect()
+        gc.freeze()
+
+    def spawn(self, slot):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self.serve_worker(slot)
+            except BaseException as e:
+                print(f"❌ Worker {slot} crashed: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        self.workers[pid] = slot
+        self._started[pid] = time.time()
+        return pid
+
+    def serve_worker(self, slot):
+        """Body of a worker process: serve requests on the inherited socket until SIGTERM"""
+        parent = os.getppid()
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+
+        self.web_app.after_fork(slot, self.quiz_session_db)
+        self.web_app.reload_handler = lambda: os.kill(parent, signal.SIGHUP)
+        server = PooledWSGIServer(self.host, self.port, self.wsgi_app, self.threads, fd=self.socket.fileno())
+        # shutdown() waits for serve_forever() to return, so it can't run in the signal handler itself
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+
+        self.web_app.warm_quiz_pools()
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            self.web_app.close_stores()
+
+    def reap(self):
+        """Collect exited workers and start replacements"""
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            slot = self.workers.pop(pid, None)
+            started = self._started.pop(pid, 0)
+            if slot is not None and not self._stopping:
+                print(f"⚠️ Worker {slot} (pid {pid}) exited with status {status}, restarting it")
+                if time.time() - started < 1:
+                    time.sleep(1)
+                self.prepare_fork()
+                self.spawn(slot)
+
+    def refresh(self):
+        """Re-pull the sheets in the parent; if anything changed, replace the workers one by one"""
+        self._refresh_now = False
+        if self.refresh_interval:
+            self._next_refresh = time.time() + self.refresh_interval
+        try:
+            changes = self.web_app.refresh_data()
+        except Exception as e:
+            print(f"⚠️ Sheet refresh crashed: {e}")
+            return
+        if changes:
+            self.rolling_restart()
+
+    def rolling_restart(self):
+        """Replace every worker with a fork of the refreshed parent, one at a time"""
+        print(f"🔁 Restarting {len(self.workers)} workers with the new data")
+        for pid, slot in list(self.workers.items()):
+            # The old worker stops first: the new one takes over its answer log, replayed up to its last answer
+            self.terminate(pid)
+            self.workers.pop(pid, None)
+            self._started.pop(pid, None)
+            if self._stopping:
+                return
+            self.prepare_fork()
+            self.spawn(slot)
+
+    def terminate(self, pid):
+        """Ask a worker to finish its requests and exit; kill it after graceful_timeout"""
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        deadline = time.time() + self.graceful_timeout
+        while time.time() < deadline:
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if done:
+                return
+            time.sleep(0.05)
+        print(f"⚠️ Worker pid {pid} did not stop in {self.graceful_timeout:g}s, killing it")
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+    def stop(self):
+        self._stopping = True
+        for pid in list(self.workers):
+            self.terminate(pid)
+        self.workers.clear()
+        self._started.clear()
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+
+    def _handle_reload(self, signum, frame):
+        self._refresh_now = True
+
+
+def replay_worker_logs(web_app):
+    """Rebuild the statistics from the answer log and the logs of the worker processes"""
+    paths = [path for path in sorted(glob.glob(f"{web_app.answer_log.file_path}.*"))
+             if path.rsplit('.', 1)[1].isdigit()]
+    replayed = web_app.reload_stats(paths)
+    if replayed:
+        print(f"✅ Loaded {replayed} answers from {web_app.answer_log.file_path} and {len(paths)} worker logs.")
+
+
+if __name__ == '__main__':
+    from app import app, jlpt_app
+
+    parser = argparse.ArgumentParser(description='JLPT N3 study web app (production server)')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    # JSON knowledge files are per process, so only the SQLite backend can be shared by several workers
+    shared_knowledge = jlpt_app.knowledge_backend == 'sqlite'
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('JLPT_WORKERS', 2 if shared_knowledge else 1)),
+                        help='worker processes (more than one needs JLPT_KNOWLEDGE_BACKEND=sqlite)')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('JLPT_THREADS', 8)),
+                        help='request threads per worker')
+    parser.add_argument('--offline', action='store_true',
+                        help='serve purely from the local sheet snapshot, never calling the Sheets API')
+    parser.add_argument('--snapshot', default=jlpt_app.snapshot_file,
+                        help='snapshot file (or .json fixture of {sheet_type: values}, which is never overwritten) to start from; '
+                        'one other than the default is loaded in place of the deck file')
+    parser.add_argument('--deck-file', default=jlpt_app.deck_file,
+                        help="compiled deck file, mapped at startup in place of the snapshot ('' disables)")
+    parser.add_argument('--refresh-interval', type=float, default=jlpt_app.refresh_interval,
+                        help='re-pull the sheets every N seconds (0 disables; POST /api/admin/reload refreshes on demand)')
+    parser.add_argument('--graceful-timeout', type=float, default=30,
+                        help='seconds a stopping worker gets to finish its requests')
+    parser.add_argument('--preload', default=os.environ.get('JLPT_PRELOAD_LEVELS', ''),
+                        help="comma-separated levels whose decks load before forking, shared by the workers ('all' for every level)")
+    parser.add_argument('--quiz-session-db', default=os.environ.get('JLPT_QUIZ_SESSION_DB', 'quiz_sessions.db'),
+                        help='SQLite database the workers share running quizzes through')
+    args = parser.parse_args()
+    if args.workers > 1 and not shared_knowledge:
+        print(f"❌ {args.workers} workers would each keep their own copy of the JSON knowledge files and "
+              f"overwrite each other's updates; set JLPT_KNOWLEDGE_BACKEND=sqlite or use --workers 1")
+        exit(1)
+
+    print("🚀 Starting JLPT Web App server...")
+    # Workers only need the compact decks; DataFrames would be one more copy to share
+    jlpt_app.compact_decks = True
+    jlpt_app.deck_file = args.deck_file
+    phase_start = time.perf_counter()
+    source = jlpt_app.load_initial_data(args.snapshot, args.offline)
+    if source is None:
+        exit(1)
+    phase_start = jlpt_app.record_phase(f"data ({source})", phase_start)
+    # Knowledge stores load on first use; do it once here so the workers share them
+    # (the answer statistics are replayed before every fork)
+    for deck_type in jlpt_app.sheets_config:
+        jlpt_app.knowledge(deck_type)
+    phase_start = jlpt_app.record_phase('knowledge', phase_start)
+    if args.preload:
+        jlpt_app.preload_levels(None if args.preload == 'all' else args.preload.lower().split(','))
+        jlpt_app.record_phase('preload', phase_start)
+    jlpt_app.startup_report()
+
+    PreforkServer(
+        jlpt_app, app, host=args.host, port=args.port, workers=args.workers, threads=args.threads,
+        refresh_interval=0 if args.offline else args.refresh_interval,
+        revalidate=source != 'sheets' and not args.offline,
+        graceful_timeout=args.graceful_timeout,
+        quiz_session_db=args.quiz_session_db if args.workers > 1 else None
+    ).run()
@@ -0,0 +1,95 @@
+import random
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Sheets API responses worth retrying: quota / rate limiting and transient server errors
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def is_http_error(error):
+    """Check whether error is an HTTP error from the Sheets API"""
+    # The client library is imported on first use; until it is loaded no call can have raised one
+    errors = sys.modules.get('googleapiclient.errors')
+    return errors is not None and isinstance(error, errors.HttpError)
+
+
+def is_retryable(error):
+    """Check whether a failed Sheets call should be retried"""
+    if is_http_error(error):
+        return getattr(error.resp, 'status', None) in RETRYABLE_STATUSES
+    return isinstance(error, (socket.timeout, ConnectionError, TimeoutError))
+
+
+def call_with_backoff(call, retries=5, base_delay=0.5, max_delay=16.0, sleep=time.sleep):
+    """Run call(), retrying retryable errors with exponential backoff and full jitter.
+
+    Returns (result, attempts). Non-retryable errors, and the last retryable
+    one once `retries` is exhausted, are raised to the caller.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return call(), attempt
+        except Exception as error:
+            if attempt > retries or not is_retryable(error):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+            print(f"⏳ Sheets API error ({error}), retrying in {delay:.2f}s (attempt {attempt}/{retries})")
+            sleep(delay)
+
+
+def _batch_get(service, spreadsheet_id, ranges, retries, sleep):
+    """Fetch several ranges of one spreadsheet in a single batchGet call"""
+    start = time.perf_counter()
+    result, attempts = call_with_backoff(
+        lambda: service.spreadsheets().values().batchGet(spreadsheetId=spreadsheet_id, ranges=ranges).execute(),
+        retries=retries,
+        sleep=sleep
+    )
+    elapsed = time.perf_counter() - start
+    value_ranges = result.get('valueRanges', [])
+    return [value_range.get('values', []) for value_range in value_ranges], elapsed, attempts
+
+
+def fetch_sheets(service, requests, service_factory=None, retries=5, sleep=time.sleep):
+    """Fetch many sheets with one batchGet per spreadsheet.
+
+    `requests` maps sheet_type -> (spreadsheet_id, range). Spreadsheets are
+    fetched in parallel; each thread uses its own client from `service_factory`
+    when one is given, since API clients are not thread-safe.
+
+    Returns (values, timings, errors): values maps sheet_type -> Sheets `values`
+    payload, timings maps sheet_type -> {'seconds', 'attempts', 'batch_size'}
+    and errors maps sheet_type -> the exception that made its batch fail.
+    """
+    groups = {}
+    for sheet_type, (spreadsheet_id, sheet_range) in requests.items():
+        groups.setdefault(spreadsheet_id, []).append((sheet_type, sheet_range))
+
+    def fetch_group(spreadsheet_id, members):
+        client = service_factory() if service_factory and len(groups) > 1 else service
+        return _batch_get(client, spreadsheet_id, [sheet_range for _, sheet_range in members], retries, sleep)
+
+    values, timings, errors = {}, {}, {}
+    with ThreadPoolExecutor(max_workers=max(1, len(groups)), thread_name_prefix='sheets-fetch') as executor:
+        futures = {spreadsheet_id: executor.submit(fetch_group, spreadsheet_id, members)
+                   for spreadsheet_id, members in groups.items()}
+
+        for spreadsheet_id, future in futures.items():
+            members = groups[spreadsheet_id]
+            try:
+                results, elapsed, attempts = future.result()
+            except Exception as error:
+                for sheet_type, _ in members:
+                    errors[sheet_type] = error
+                continue
+
+            for (sheet_type, _), sheet_values in zip(members, results):
+                values[sheet_type] = sheet_values
+                timings[sheet_type] = {'seconds': elapsed, 'attempts': attempts, 'batch_size': len(members)}
+
+    return values, timings, errors
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+import zlib
+
+# File layout: MAGIC, one byte format version, then a zlib-compressed JSON document
+# holding every sheet column by column (header + one list per column).
+MAGIC = b'JLPTSNAP'
+FORMAT_VERSION = 1
+
+
+def values_version(sheets_values):
+    """Content hash of a {sheet_type: values} mapping, used to stamp and compare snapshots"""
+    payload = json.dumps(sheets_values, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _to_columns(values):
+    """Transpose a Sheets `values` payload (header row first) into columns, padding short rows with ''"""
+    if not values:
+        return {'header': [], 'columns': []}
+    header = values[0]
+    width = max(len(row) for row in values)
+    header = list(header) + [''] * (width - len(header))
+    columns = [[row[i] if i < len(row) else '' for row in values[1:]] for i in range(width)]
+    return {'header': header, 'columns': columns}
+
+
+def _strip_padding(row):
+    """Drop the trailing '' cells _to_columns padded a row with (Sheets omits trailing empty cells too)"""
+    row = list(row)
+    while row and row[-1] == '':
+        row.pop()
+    return row
+
+
+def _from_columns(sheet):
+    """Rebuild a Sheets `values` payload from its columnar form"""
+    header = _strip_padding(sheet['header'])
+    rows = [_strip_padding(row) for row in zip(*sheet['columns'])] if sheet['columns'] else []
+    return [header] + rows
+
+
+def save_snapshot(file_path, sheets_values, spreadsheet_id=None):
+    """Atomically write a snapshot of {sheet_type: values} and return its version stamp"""
+    version = values_version(sheets_values)
+    document = {
+        'version': version,
+        'saved_at': time.time(),
+        'spreadsheet_id': spreadsheet_id,
+        'sheets': {sheet_type: _to_columns(values) for sheet_type, values in sheets_values.items()}
+    }
+    payload = zlib.compress(json.dumps(document, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 6)
+
+    # A temp file of its own, so two processes saving the same snapshot never rename each other's
+    directory, name = os.path.split(os.path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f'.{name}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC + bytes([FORMAT_VERSION]) + payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return version
+
+
+def is_snapshot(file_path):
+    """Check whether a file was written by save_snapshot (and not, e.g., a .json fixture)"""
+    try:
+        with open(file_path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def load_snapshot(file_path):
+    """Load a snapshot written by save_snapshot.
+
+    Plain `.json` fixture files holding {sheet_type: values} are accepted too.
+    Returns {'version', 'saved_at', 'spreadsheet_id', 'sheets': {sheet_type: values},
+    'fixture': True for a .json fixture}, or None if the file is missing or unreadable.
+    """
+    if not os.path.exists(file_path):
+        return None
+
+    try:
+        with open(file_path, 'rb') as f:
+            raw = f.read()
+
+        if raw.startswith(MAGIC):
+            if raw[len(MAGIC)] != FORMAT_VERSION:
+                print(f"⚠️ Snapshot {file_path} has unsupported format version {raw[len(MAGIC)]}")
+                return None
+            document = json.loads(zlib.decompress(raw[len(MAGIC) + 1:]).decode('utf-8'))
+            sheets = {sheet_type: _from_columns(sheet) for sheet_type, sheet in document['sheets'].items()}
+        else:
+            sheets = json.loads(raw.decode('utf-8'))
+            document = {'version': values_version(sheets), 'saved_at': os.path.getmtime(file_path)}
+
+        return {
+            'version': document['version'],
+            'saved_at': document.get('saved_at'),
+            'spreadsheet_id': document.get('spreadsheet_id'),
+            'sheets': sheets,
+            'fixture': not raw.startswith(MAGIC)
+        }
+    except (OSError, ValueError, KeyError, IndexError, zlib.error) as e:
+        print(f"⚠️ Could not read snapshot {file_path}: {e}")
+        return None
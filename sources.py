@@ -0,0 +1,212 @@
+"""Local deck sources, read row by row.
+
+Every reader returns (header, rows) where rows is a generator, so
+Deck.from_rows() builds a deck from a file of any size with bounded memory:
+
+- .csv / .tsv (.tab, .txt): delimited text, header row first
+- .apkg: Anki package export (the notes of its most used note type)
+- .xml (optionally .gz): JMdict (vocabulary) or KANJIDIC2 (kanji) dictionaries
+
+A source spec is `TYPE=PATH`, optionally followed by `#Name,Name,...` to
+rename the columns (e.g. Anki's 'Front,Back' to 'Word,Meaning').
+"""
+import csv
+import gzip
+import html
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import zipfile
+
+from decks import SHEET_SCHEMAS
+
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+
+# Headers of the dictionary readers, in the names the deck schemas resolve
+JMDICT_HEADER = ['Word', 'Reading', 'Meaning']
+KANJIDIC_HEADER = ['Kanji', 'Meaning', 'Onyomi', 'Kunyomi']
+
+_LINE_BREAK = re.compile(r'<br\s*/?>|</div>|</p>', re.IGNORECASE)
+_TAG = re.compile(r'<[^>]+>')
+_SOUND = re.compile(r'\[sound:[^\]]*\]')
+
+
+def parse_source_specs(text):
+    """{sheet_type: (path, header or None)} from comma-separated specs like 'kanji=kanjidic2.xml,vocabulary=n3.tsv'"""
+    pieces = []
+    for piece in re.split(r'[,;\n]', text):
+        piece = piece.strip()
+        # A piece without '=' is one more column name of the previous spec's rename
+        if pieces and '#' in pieces[-1] and '=' not in piece:
+            pieces[-1] += ',' + piece
+        elif piece:
+            pieces.append(piece)
+
+    specs = {}
+    for spec in pieces:
+        sheet_type, _, path = spec.partition('=')
+        sheet_type = sheet_type.strip()
+        if sheet_type not in SHEET_SCHEMAS or not path:
+            raise ValueError(f"Expected TYPE=PATH with TYPE one of {', '.join(SHEET_SCHEMAS)}, got {spec!r}")
+        path, _, header = path.partition('#')
+        specs[sheet_type] = (path.strip(), [name.strip() for name in header.split(',')] if header else None)
+    return specs
+
+
+def source_signature(path, header=None):
+    """Identity of a source file as it is now (path, column renames, size, modification time)"""
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}|{','.join(header or ())}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+def open_source(path, header=None):
+    """(header, rows) of a local source file, picking the reader from the file extension"""
+    name = path.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    if name.endswith('.apkg'):
+        source_header, rows = read_apkg(path)
+    elif name.endswith('.xml'):
+        source_header, rows = read_xml_dictionary(path)
+    elif name.endswith(('.tsv', '.tab', '.txt')):
+        source_header, rows = read_delimited(path, '\t')
+    else:
+        source_header, rows = read_delimited(path, ',')
+    return (header or source_header), rows
+
+
+def _open_text(path):
+    if path.lower().endswith('.gz'):
+        return gzip.open(path, 'rt', newline='', encoding='utf-8-sig')
+    return open(path, newline='', encoding='utf-8-sig')
+
+
+def read_delimited(path, delimiter=','):
+    """Header and rows of a CSV / TSV file"""
+    f = _open_text(path)
+    reader = csv.reader(f, delimiter=delimiter)
+    header = next(reader, [])
+
+    def rows():
+        with f:
+            yield from reader
+    return header, rows()
+
+
+def clean_field(text):
+    """An Anki field as plain text: line breaks kept as newlines, tags, sounds and entities removed"""
+    text = _LINE_BREAK.sub('\n', text)
+    text = _SOUND.sub('', _TAG.sub('', text))
+    return '\n'.join(line.strip() for line in html.unescape(text).replace('\xa0', ' ').split('\n')).strip()
+
+
+def read_apkg(path):
+    """Header (field names) and rows (note fields) of the most used note type of an Anki .apkg export"""
+    with zipfile.ZipFile(path) as archive:
+        names = set(archive.namelist())
+        collection = next((name for name in ('collection.anki21', 'collection.anki2') if name in names), None)
+        if collection is None:
+            raise ValueError(f"{path} has no legacy collection; export it from Anki with "
+                             "'Support older Anki versions' ticked")
+        # SQLite needs a real file; the collection is copied out in chunks
+        temp = tempfile.NamedTemporaryFile(suffix='.anki2', delete=False)
+        with temp, archive.open(collection) as packed:
+            shutil.copyfileobj(packed, temp, 1 << 20)
+
+    connection = sqlite3.connect(temp.name)
+    try:
+        top = connection.execute('SELECT mid FROM notes GROUP BY mid ORDER BY COUNT(*) DESC LIMIT 1').fetchone()
+        if top is None:
+            raise ValueError(f"{path} holds no notes")
+        note_type = top[0]
+        header = _anki_field_names(connection, note_type)
+    except Exception:
+        connection.close()
+        os.remove(temp.name)
+        raise
+
+    def rows():
+        try:
+            for (fields,) in connection.execute('SELECT flds FROM notes WHERE mid = ? ORDER BY id', (note_type,)):
+                yield [clean_field(field) for field in fields.split('\x1f')]
+        finally:
+            connection.close()
+            os.remove(temp.name)
+    return header, rows()
+
+
+def _anki_field_names(connection, note_type):
+    """Field names of a note type, from the `fields` table (Anki 2.1.28+) or the JSON in `col.models`"""
+    tables = {name for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if 'fields' in tables:
+        return [name for (name,) in connection.execute(
+            'SELECT name FROM fields WHERE ntid = ? ORDER BY ord', (note_type,))]
+    import json
+
+    (models,) = connection.execute('SELECT models FROM col').fetchone()
+    model = json.loads(models)[str(note_type)]
+    return [field['name'] for field in sorted(model['flds'], key=lambda field: field['ord'])]
+
+
+def read_xml_dictionary(path):
+    """Header and rows of a JMdict or KANJIDIC2 file, parsed one entry at a time"""
+    import xml.etree.ElementTree as ET
+
+    f = gzip.open(path, 'rb') if path.lower().endswith('.gz') else open(path, 'rb')
+    events = ET.iterparse(f, events=('start', 'end'))
+    try:
+        _, root = next(events)
+    except (StopIteration, ET.ParseError):
+        f.close()
+        raise ValueError(f"{path} is not an XML dictionary")
+    if root.tag == 'JMdict':
+        return JMDICT_HEADER, _entries(f, events, root, 'entry', _jmdict_row)
+    if root.tag == 'kanjidic2':
+        return KANJIDIC_HEADER, _entries(f, events, root, 'character', _kanjidic_row)
+    f.close()
+    raise ValueError(f"{path}: unsupported dictionary <{root.tag}>, expected JMdict or kanjidic2")
+
+
+def _entries(f, events, root, tag, to_row):
+    """Rows of the `tag` elements, dropping each one from the tree once read"""
+    with f:
+        for event, element in events:
+            if event != 'end' or element.tag != tag:
+                continue
+            row = to_row(element)
+            root.clear()
+            if row:
+                yield row
+
+
+def _english(elements, language_attribute):
+    return [element.text.strip() for element in elements
+            if element.text and element.get(language_attribute, 'eng') in ('eng', 'en')]
+
+
+def _jmdict_row(entry):
+    """[word, reading, meaning]: first kanji form (else reading) and the glosses of the first English sense"""
+    kanji = [element.text for element in entry.iterfind('k_ele/keb')]
+    readings = [element.text for element in entry.iterfind('r_ele/reb')]
+    for sense in entry.iterfind('sense'):
+        glosses = _english(sense.iterfind('gloss'), XML_LANG)
+        if glosses:
+            break
+    else:
+        return None
+    word = kanji[0] if kanji else readings[0] if readings else None
+    return [word, readings[0] if readings else '', '; '.join(glosses)] if word else None
+
+
+def _kanjidic_row(character):
+    """[kanji, meaning, onyomi, kunyomi] of a KANJIDIC2 character"""
+    literal = character.findtext('literal')
+    group = 'reading_meaning/rmgroup'
+    meanings = _english(character.iterfind(f'{group}/meaning'), 'm_lang')
+    if not literal or not meanings:
+        return None
+    onyomi = [reading.text for reading in character.iterfind(f'{group}/reading') if reading.get('r_type') == 'ja_on']
+    kunyomi = [reading.text for reading in character.iterfind(f'{group}/reading') if reading.get('r_type') == 'ja_kun']
+    return [literal, ', '.join(meanings[:3]), '、'.join(onyomi), '、'.join(kunyomi)]
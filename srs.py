@@ -0,0 +1,113 @@
+import heapq
+import time
+
+# SM-2 answer quality of each knowledge button
+LEVEL_QUALITY = {'good': 5, 'medium': 3, 'dont_know': 1}
+
+DAY = 24 * 3600
+MIN_EASE = 1.3
+START_EASE = 2.5
+
+
+class Card:
+    """SM-2 scheduling state of one item: interval in days, ease factor, successful repetitions, due time"""
+
+    __slots__ = ('interval', 'ease', 'reps', 'due')
+
+    def __init__(self, interval=0.0, ease=START_EASE, reps=0, due=0.0):
+        self.interval = interval
+        self.ease = ease
+        self.reps = reps
+        self.due = due
+
+    def fields(self):
+        """(interval, ease, reps, due), as stored by the card stores"""
+        return (self.interval, round(self.ease, 2), self.reps, round(self.due))
+
+    @classmethod
+    def from_fields(cls, fields):
+        if isinstance(fields, str):
+            # 'interval;ease;reps;due', as older versions stored cards
+            fields = fields.split(';')
+        interval, ease, reps, due = fields
+        return cls(float(interval), float(ease), int(reps), float(due))
+
+    def review(self, quality, now=None):
+        """Reschedule after an answer of quality 0-5 (SM-2)"""
+        now = time.time() if now is None else now
+        if quality < 3:
+            # Lapse: start the repetitions over, keep the ease
+            self.reps = 0
+            self.interval = 1
+        else:
+            self.reps += 1
+            if self.reps == 1:
+                self.interval = 1
+            elif self.reps == 2:
+                self.interval = 6
+            else:
+                self.interval = round(self.interval * self.ease, 1)
+            self.ease = max(MIN_EASE, self.ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+        self.due = now + self.interval * DAY
+        return self
+
+
+class DueQueue:
+    """Cards of one learner's deck in a min-heap on due time.
+
+    Taking the next n due items pops and re-pushes n heap entries, so it costs
+    O(n log m) for m cards instead of a scan. Rescheduling pushes a new entry
+    and leaves the old one behind; stale entries are skipped when popped and
+    dropped when the heap grows to twice the number of cards.
+    """
+
+    __slots__ = ('cards', 'built_at', '_heap')
+
+    def __init__(self, cards=(), built_at=None):
+        self.built_at = built_at
+        self.cards = {}
+        for item, fields in cards:
+            try:
+                self.cards[item] = Card.from_fields(fields)
+            except (ValueError, TypeError):
+                continue
+        self._heap = [(card.due, item) for item, card in self.cards.items()]
+        heapq.heapify(self._heap)
+
+    def __len__(self):
+        return len(self.cards)
+
+    def record(self, item, level, now=None):
+        """Review an item with a knowledge level; returns its updated card (None for unknown levels)"""
+        quality = LEVEL_QUALITY.get(level)
+        if quality is None:
+            return None
+        card = self.cards.get(item)
+        if card is None:
+            card = self.cards[item] = Card()
+        card.review(quality, now)
+        heapq.heappush(self._heap, (card.due, item))
+        if len(self._heap) > 2 * len(self.cards) + 64:
+            self._heap = [(card.due, item) for item, card in self.cards.items()]
+            heapq.heapify(self._heap)
+        return card
+
+    def due(self, n, now=None):
+        """Up to n items that are due, the most overdue first"""
+        now = time.time() if now is None else now
+        taken, seen = [], set()
+        while self._heap and len(taken) < n:
+            due, item = self._heap[0]
+            if due > now:
+                break
+            heapq.heappop(self._heap)
+            card = self.cards.get(item)
+            if card is None or card.due != due or item in seen:
+                # Superseded by a later review
+                continue
+            seen.add(item)
+            taken.append((due, item))
+        for entry in taken:
+            heapq.heappush(self._heap, entry)
+        return [item for _, item in taken]
+